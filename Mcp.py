@@ -1,22 +1,42 @@
-import os, shutil
+import os, shutil, time
 
 from models.Cp.model import CpModel
+from models.Cp.lns import CpLns
 from models.SAT.SAT_model import Sat_model
+from models.SAT.cnf_model import Cnf_model
 from models.MIP.mip_model import Mip_model, Or_model, Pulp_model
-from models.SMT.smt_model import Z3_smt_model
+from models.SMT.smt_model import Z3_smt_model, Z3_smt_successor_model
+from models.SMT.smtlib_runner import Smtlib_runner
+from models.Heuristic.heuristic_model import Heuristic_model
 from instance import Instance
 from os import listdir, makedirs
 from os.path import isfile, join, exists
 import argparse
 import json
 from json_parser import Json_parser
+from scheduler import Scheduler, Job, SharedBound
+from result_store import Result_store
 
 from typing import Union
 
 parser = argparse.ArgumentParser()
 parser.add_argument("-c", "--configuration_file", type=str)
+parser.add_argument("--fresh", action="store_true", help="solve every job again, ignoring the stored results")
+parser.add_argument("--retry-non-optimal", type=float, default=None, metavar="FACTOR",
+                    help="solve again the jobs with a non optimal stored result, with FACTOR times their budget")
 json_parser = Json_parser()
 
+# the files defining the model of each approach, a change in them invalidates the stored results
+MODEL_FILES = {
+    'CP': ['models/Cp/Cp_model.mzn', 'models/Cp/model.py', 'models/Cp/lns.py', 'models/Cp/solutions.py',
+           'models/Heuristic/heuristic_model.py'],
+    'SAT': ['models/SAT/SAT_model.py', 'models/SAT/Sat_utils.py', 'models/SAT/cnf_model.py', 'models/SAT/cnf.py'],
+    'MIP': ['models/MIP/mip_model.py', 'models/MIP/matrix_builder.py', 'models/Heuristic/heuristic_model.py',
+            'models/Abstract_model.py'],
+    'SMT': ['models/SMT/smt_model.py', 'models/SMT/smtlib_runner.py', 'models/Abstract_model.py'],
+    'HEURISTIC': ['models/Heuristic/heuristic_model.py', 'models/Abstract_model.py']
+}
+
 
 def load_parameters():
     args = parser.parse_args()
@@ -47,143 +67,232 @@ def load_specific_instances(instances_path: 'str', instance_to_solve: 'list[str]
     return instances
 
 
-def solve_cp(config: 'dict', instances_path: 'str',
-             instance_to_solve: Union[list[str], str] = 'all_instances'):
+def load_instances(instances_path: 'str',
+                   instance_to_solve: Union[list[str], str] = 'all_instances') -> 'list[Instance]':
+    if instance_to_solve == 'all_instances':
+        return load_all_instances(instances_path)
+    return load_specific_instances(instances_path, instance_to_solve)
+
+
+def share_bound(job: 'Job', solver) -> None:
+    if 'shared' in job.options:
+        job.options['shared'].register(job.solver)
+        solver.set_shared_bound(job.options['shared'])
+
+
+def run_cp(job: 'Job') -> 'dict':
+    if job.solver.endswith(CpLns.SUFFIX):
+        return run_cp_lns(job)
     solver = CpModel('./models/Cp/Cp_model.mzn')
-    print("============================================================================")
-    print(f'loaded models {solver.model_name}')
+    solver.add_instance(job.instance, job.solver)
+    if 'incumbent' in job.options:
+        solver.set_incumbent(*job.options['incumbent'])
+    share_bound(job, solver)
+    print(f"solving instance {job.instance.name} with CP solver {job.solver}...")
+    publish = None
+    if 'shared' in job.options:
+        # every incumbent goes to the race as soon as minizinc prints it
+        publish = lambda incumbent: job.options['shared'].publish(incumbent['obj'], incumbent['sol'])
+    solution = solver.solve(job.config['timeout'], processes=job.processes, callback=publish)
+    return solution.get_result()
+
+
+def run_cp_lns(job: 'Job') -> 'dict':
+    solver = CpLns('./models/Cp/Cp_model.mzn', job.instance, job.solver[:-len(CpLns.SUFFIX)])
+    if 'incumbent' in job.options:
+        solver.set_incumbent(*job.options['incumbent'])
+    print(f"solving instance {job.instance.name} with CP large neighbourhood search {job.solver}...")
+    return solver.solve(job.config['timeout'], processes=job.processes,
+                        time_limit=job.config.get('lns_time_limit', 2000))
+
+
+def run_sat(job: 'Job') -> 'dict':
+    if job.solver == 'cnf' or job.solver.startswith('cnf-'):
+        # cnf is solved by z3, cnf-<binary> by that SAT solver
+        solver = Cnf_model(job.solver[4:] or 'z3', stream=job.config.get('cnf_stream', False))
+    else:
+        solver = Sat_model()
+    print(f"building SAT model for instance {job.instance.name}...")
+    solver.add_instance(job.instance, build=True)
+    share_bound(job, solver)
+    print("model built, now solving...")
+    if isinstance(solver, Sat_model) and job.config.get('search', 'split') == 'parallel':
+        return solver.parallel_search(timeout=job.config['timeout'], processes=job.processes)
+    return solver.split_search(timeout=job.config['timeout'], processes=job.processes)
 
 
-    if instance_to_solve == 'all_instances':
-        instances = load_all_instances(instances_path)
+def run_mip(job: 'Job') -> 'dict':
+    lib = job.options['lib']
+    solver_name = job.options['solver_name']
+    builder = job.config.get('builder', 'python')
+    print(f"solving instance {job.instance.name} with library {lib} and solver {solver_name}...")
+
+    if lib == 'mip':
+        solver = Mip_model(lib, job.instance, h=False, param=0, solver_name=solver_name, builder=builder)
+
+    elif lib == 'ortools':
+        solver = Or_model(lib, job.instance, solver_name=solver_name, builder=builder)
+
+    elif lib == 'pulp':
+        solver = Pulp_model(lib, job.instance, timeout=job.config['timeout'], builder=builder)
+
     else:
-        instances = load_specific_instances(instances_path, instance_to_solve)
+        raise Exception(f"unknown lib {lib}")
+
+    if 'incumbent' in job.options:
+        solver.set_incumbent(*job.options['incumbent'])
+    share_bound(job, solver)
+    solver.solve(processes=job.processes, timeout=job.config['timeout'])
+    return solver.get_result()
+
+
+def smt_model(config: 'dict', instance: 'Instance') -> 'Z3_smt_model':
+    formulation = config.get('formulation', 'table')
+    if formulation == 'successor':
+        return Z3_smt_successor_model("z3", instance)
+    return Z3_smt_model("z3", instance, compact=formulation == 'compact', redundant=config.get('redundant', True))
+
+
+def run_smt(job: 'Job') -> 'dict':
+    if job.solver.startswith('smtlib-'):
+        # smtlib-<binary> solves the exported model with that SMT-LIB 2 solver
+        print(f"solving instance {job.instance.name} with {job.solver[7:]}...")
+        solver = Smtlib_runner(job.solver[7:], job.instance, join(smt_export_folder(job.config), f'{job.instance.name}.smt2'))
+        share_bound(job, solver)
+        solver.solve(processes=job.processes, timeout=job.config['timeout'])
+        return solver.get_result()
+    print(f"building SMT model for instance {job.instance.name}...")
+    solver = smt_model(job.config, job.instance)
+    share_bound(job, solver)
+    print("model built, now solving...")
+    if job.config.get('search', 'incremental') == 'portfolio':
+        solver.portfolio(job.config.get('portfolio', ['default', 'qflia', 'optimize']), timeout=job.config['timeout'])
+    else:
+        solver.solve(processes=job.processes, timeout=job.config['timeout'])
+    return solver.get_result()
+
+
+def run_heuristic(job: 'Job') -> 'dict':
+    print(f"solving instance {job.instance.name} with the heuristic...")
+    solver = Heuristic_model("heuristic", job.instance)
+    solver.solve(processes=job.processes, timeout=job.config['timeout'])
+    return solver.get_result()
+
+
+def warm_start_options(config: 'dict', instance: 'Instance', incumbents: 'dict') -> 'dict':
+    if config.get('warm_start', False) and instance.name in incumbents:
+        return {'incumbent': incumbents[instance.name]}
+    return {}
+
 
+def cp_jobs(config: 'dict', instances: 'list[Instance]', incumbents: 'dict') -> 'list[Job]':
     if config.get("export_folder", "") != "":
         if not exists(config['export_folder']):
             makedirs(config['export_folder'])
 
+        solver = CpModel('./models/Cp/Cp_model.mzn')
         for instance in instances:
             solver.add_instance(instance)
             solver.save(config['export_folder'])
-    for instance in instances:
-        print("============================================================================")
-        print(f"solving instance {instance.name}")
-        for cp_solver in config['solvers']:
-            solver.add_instance(instance, cp_solver)
-            print("model built, now solving...")
-            solution = solver.solve(config['timeout'], processes=config['processes'])
-            result = solution.get_result()
-            json_parser.save_results('CP', instance.name, result, instance.max_load_indexes, cp_solver)
-            print("<----------------------------------------------->")
-            print(f'solution for solver {cp_solver}:')
-            print(result)
-
-
-def solve_sat(config: 'dict', instances_path: 'str',
-              instance_to_solve: Union[list[str], str] = 'all_instances'):
-    solver_to_use = config['solvers'][0]
-    solver = Sat_model()
-    print('loaded sat model')
-
-    if instance_to_solve == 'all_instances':
-        instances = load_all_instances(instances_path)
-    else:
-        instances = load_specific_instances(instances_path, instance_to_solve)
 
-    for instance in instances:
-        print("============================================================================")
-        print(f"solving instance {instance.name}")
-        print("building model...")
-        solver.add_instance(instance, build=True)
-        print("model built, now solving...")
-        solution = solver.split_search(timeout=config['timeout'], processes=config['processes'])
-        print(solution)
-        json_parser.save_results('SAT', instance.name, solution, instance.max_load_indexes, solver_to_use)
+    # CP timeouts are expressed in milliseconds
+    return [Job('CP', cp_solver, instance, run_cp, config, config['timeout'] / 1000, config['processes'],
+                warm_start_options(config, instance, incumbents))
+            for instance in instances for cp_solver in config['solvers']]
 
 
-def solve_mip(config: 'dict', instances_path: 'str',
-              instance_to_solve: Union[list[str], str] = 'all_instances'):
-    libraries = config['library']
+def sat_jobs(config: 'dict', instances: 'list[Instance]') -> 'list[Job]':
+    # SAT timeouts are expressed in milliseconds
+    return [Job('SAT', solver_to_use, instance, run_sat, config, config['timeout'] / 1000, config['processes'])
+            for solver_to_use in config['solvers'] for instance in instances]
 
-    if instance_to_solve == 'all_instances':
-        instances = load_all_instances(instances_path)
-    else:
-        instances = load_specific_instances(instances_path, instance_to_solve)
 
+def mip_jobs(config: 'dict', instances: 'list[Instance]', incumbents: 'dict') -> 'list[Job]':
     if config.get("export_folder", "") != "":
         if not exists(config['export_folder']):
             makedirs(config['export_folder'])
 
         for instance in instances:
-            Or_model("or-tools", instance).save(config['export_folder'])
+            Or_model("or-tools", instance, builder=config.get('builder', 'python')).save(config['export_folder'])
 
-    for lib in libraries:
+    jobs = []
+    for lib in config['library']:
         for instance in instances:
-            key = lib + '_solvers'
-            solver_to_use = config[key]
-            for solver_name in solver_to_use:
-                print("============================================================================")
-                print(f'loaded Mip model implemented with library {lib} and solver {solver_name}')
-                print("============================================================================")
-                print(f"solving instance {instance.name}")
-
-                if lib == 'mip':
-                    solver = Mip_model(lib, instance, h=False, param=0, solver_name=solver_name)
+            for solver_name in config[lib + '_solvers']:
+                options = {'lib': lib, 'solver_name': solver_name}
+                options.update(warm_start_options(config, instance, incumbents))
+                jobs.append(Job('MIP', lib + '_' + solver_name, instance, run_mip, config, config['timeout'],
+                                config['processes'], options))
+    return jobs
 
-                elif lib == 'ortools':
-                    solver = Or_model(lib, instance, solver_name=solver_name)
 
-                elif lib == 'pulp':
-                    solver = Pulp_model(lib, instance, timeout=config['timeout'])
+def smt_export_folder(config: 'dict') -> 'str':
+    return config.get("export_folder", "") or '.cache/smt/export'
 
-                else:
-                    raise Exception(f"unknown lib {lib}")
 
-                sub_folders = lib + '_' + solver_name
+def smt_jobs(config: 'dict', instances: 'list[Instance]') -> 'list[Job]':
+    # the smtlib-<binary> solvers need the exported models
+    if config.get("export_folder", "") != "" or any(solver.startswith('smtlib-') for solver in config['solvers']):
+        if not exists(smt_export_folder(config)):
+            makedirs(smt_export_folder(config))
 
-                print("model built, now solving...")
-                solver.solve(processes=config['processes'], timeout=config['timeout'])
-                result = solver.get_result()
+        for instance in instances:
+            smt_model(config, instance).save(smt_export_folder(config))
 
-                json_parser.save_results('MIP', instance.name, result, instance.max_load_indexes, sub_folders)
-                print("<----------------------------------------------->")
-                print(f'solution for library {lib}:')
-                print(result)
+    return [Job('SMT', solver_to_use, instance, run_smt, config, config['timeout'], config['processes'])
+            for solver_to_use in config['solvers'] for instance in instances]
 
 
-def solve_smt(config: 'dict', instances_path: 'str',
-              instance_to_solve: Union[list[str], str] = 'all_instances'):
+def heuristic_jobs(config: 'dict', instances: 'list[Instance]') -> 'list[Job]':
     solver_to_use = config['solvers'][0]
+    return [Job('HEURISTIC', solver_to_use, instance, run_heuristic, config, config['timeout'], config['processes'])
+            for instance in instances]
 
-    if instance_to_solve == 'all_instances':
-        instances = load_all_instances(instances_path)
-    else:
-        instances = load_specific_instances(instances_path, instance_to_solve)
 
-    if config.get("export_folder", "") != "":
-        if not exists(config['export_folder']):
-            makedirs(config['export_folder'])
-    print(f'loaded SMT model implemented with z3')
+def print_job_result(job: 'Job', result: 'dict') -> None:
+    print("<----------------------------------------------->")
+    print(f'solution of job {job}:')
+    print(result)
+
+
+def save_job_result(job: 'Job', result: 'dict') -> None:
+    json_parser.save_results(job.approach, job.instance.name, result, job.instance.max_load_indexes, job.solver)
+    print_job_result(job, result)
+
+
+def race(scheduler: 'Scheduler', jobs: 'list[Job]', instances: 'list[Instance]', upper_bounds: 'dict',
+         incumbents: 'dict') -> None:
+    # the jobs of every instance run together and only the best solution of the race is saved
     for instance in instances:
-        print(f"solving instance {instance.name}")
-        print("building model...")
-        solver = Z3_smt_model("z3", instance)
-        if config.get("export_folder", "") != "":
-            solver.save(config["export_folder"])
-        print("model built, now solving...")
-        solver.solve(processes=config['processes'], timeout=config['timeout'])
-        result = solver.get_result()
-        json_parser.save_results('SMT', instance.name, result, instance.max_load_indexes, solver_to_use)
-        print("<----------------------------------------------->")
-        print(f'solution:')
+        shared = SharedBound(instance)
+        if instance.name in incumbents:
+            shared.register('heuristic')
+            shared.publish(upper_bounds[instance.name], incumbents[instance.name][0])
+        instance_jobs = [job for job in jobs if job.instance is instance]
+        for job in instance_jobs:
+            job.options['shared'] = shared
+
+        print("============================================================================")
+        print(f'racing {len(instance_jobs)} jobs on instance {instance.name}')
+        start = time.time()
+        if not shared.closed():
+            scheduler.race(instance_jobs, shared, print_job_result)
+        best = shared.best()
+        result = {'time': round(time.time() - start, 3), 'optimal': best is not None and shared.closed(),
+                  'obj': None, 'sol': None, 'winner': None}
+        if best is not None:
+            result['obj'], result['sol'], result['winner'] = best
+        json_parser.save_results('RACE', instance.name, result, instance.max_load_indexes, 'race')
+        print(f'race on instance {instance.name}:')
         print(result)
 
 
 def merge_json_files(input_dir, output_dir, used_models):
     solvers = ['chuffed', 'gecode', 'or-tools', 'chuffed-no-sym', 'gecode-no-sym', 'or-tools-no-sym',
+               'chuffed-lns', 'gecode-lns', 'or-tools-lns',
                'ortools_SAT', 'ortools_CBC', 'mip_CBC', 'ortools_SCIP', 'pulp_CBC',
-               'z3_smt', 'z3_sat']
+               'z3_smt', 'smtlib-z3', 'smtlib-cvc5', 'smtlib-yices-smt2', 'z3_sat', 'cnf', 'cnf-kissat', 'cnf-cadical',
+               'cnf-minisat', 'heuristic', 'race']
     instance_result_id = ['00', '01', '02', '03', '04', '05', '06', '07', '08', '07', '08', '09',
                           '10', '11', '12', '13', '14', '15', '16', '17', '18', '19', '20', '21'
                           ]
@@ -221,30 +330,72 @@ def merge_json_files(input_dir, output_dir, used_models):
     print('Results ready')
 
 
-def main(config: 'dict'):
+def main(config: 'dict', fresh: 'bool' = False, retry_factor: 'float|None' = None):
     input_directory = ".cache/results"
     output_directory = "res"
-    models_to_use = config['usage_mode']['models_to_use']
+    usage_mode = config['usage_mode']
+    models_to_use = usage_mode['models_to_use']
 
-    instances_to_solve = config['usage_mode']['instances_to_solve']
-    if os.path.exists(input_directory):
+    instances = load_instances(config['instances_path'], usage_mode['instances_to_solve'])
+    # the results of the jobs that are not run again are written back from the store
+    if fresh and os.path.exists(input_directory):
         shutil.rmtree(input_directory)
 
-    if 'cp' in models_to_use:
+    scheduler = Scheduler(cores=usage_mode.get('cores', 0), grace=usage_mode.get('grace', 30))
+    store = Result_store(MODEL_FILES)
+
+    def schedule(jobs: 'list[Job]', on_result) -> None:
+        on_result = store.recorder(on_result)
+        if not fresh:
+            jobs = store.plan(jobs, on_result, retry_factor)
+        print(f'scheduling {len(jobs)} jobs on {scheduler.cores} cores')
+        scheduler.run(jobs, on_result)
+
+    # the heuristic solutions, used as warm starts by the approaches that ask for them
+    incumbents = {}
+    upper_bounds = {}
+    if 'heuristic' in models_to_use:
+        # the heuristic runs first, its solutions bound the objective of the exact models
+
+        def save_heuristic_result(job: 'Job', result: 'dict') -> None:
+            if result['obj'] is not None:
+                upper_bounds[job.instance.name] = result['obj']
+                # saving the result reorders the couriers, the models want them in the instance order
+                incumbents[job.instance.name] = (result['sol'], result['time'])
+            save_job_result(job, result)
+
         print("============================================================================")
-        solve_cp(config['cp'], config['instances_path'], instances_to_solve)
+        print('computing heuristic solutions')
+        schedule(heuristic_jobs(config['heuristic'], instances), save_heuristic_result)
+        if config['heuristic'].get('tighten_max_path', True):
+            for instance in instances:
+                if instance.name in upper_bounds:
+                    instance.tighten_max_path(upper_bounds[instance.name])
+
+    # in a race the heuristic solution is already the bound the models have to beat
+    racing = usage_mode.get('race', False)
+    warm_starts = {} if racing else incumbents
+
+    jobs = []
+    if 'cp' in models_to_use:
+        jobs += cp_jobs(config['cp'], instances, warm_starts)
     if 'sat' in models_to_use:
-        print("============================================================================")
-        solve_sat(config['sat'], config['instances_path'], instances_to_solve)
+        jobs += sat_jobs(config['sat'], instances)
     if 'mip' in models_to_use:
-        print("============================================================================")
-        solve_mip(config['mip'], config['instances_path'], instances_to_solve)
+        jobs += mip_jobs(config['mip'], instances, warm_starts)
     if 'smt' in models_to_use:
+        jobs += smt_jobs(config['smt'], instances)
+
+    if racing:
+        race(scheduler, jobs, instances, upper_bounds, incumbents)
+        models_to_use = models_to_use + ['race']
+    else:
         print("============================================================================")
-        solve_smt(config['smt'], config['instances_path'], instances_to_solve)
+        schedule(jobs, save_job_result)
 
     merge_json_files(input_directory, output_directory, models_to_use)
 
 
 if __name__ == '__main__':
-    main(load_parameters())
+    arguments = parser.parse_args()
+    main(load_parameters(), arguments.fresh, arguments.retry_non_optimal)
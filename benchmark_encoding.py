@@ -0,0 +1,162 @@
+import os
+import json
+import time
+import resource
+import argparse
+import subprocess
+import multiprocessing
+import numpy as np
+
+from instance import Instance
+
+# builds the SAT and SMT models of the instances without solving them and reports, as json, how big they get
+parser = argparse.ArgumentParser()
+parser.add_argument("instances", nargs="*", help="instance files, all the ones in ./instances/ by default")
+parser.add_argument("--models", nargs="+", default=["sat", "cnf", "smt", "smt-compact", "smt-successor"],
+                    choices=["sat", "cnf", "smt", "smt-compact", "smt-successor"])
+parser.add_argument("--generate", nargs="*", default=[], metavar="NxM",
+                    help="also build random instances with N items and M couriers, e.g. 30x6")
+parser.add_argument("--timeout", type=float, default=600, help="seconds given to every build")
+parser.add_argument("--output", type=str, default=None, help="json file for the report, stdout by default")
+parser.add_argument("--compare", type=str, default=None, metavar="REPORT",
+                    help="a previous report: prints the ratio of every measure to it")
+
+GENERATED_FOLDER = '.cache/benchmark'
+MEASURES = ['build_time', 'variables', 'assertions', 'peak_rss_mb']
+
+
+def generate_instance(n: 'int', m: 'int', seed: 'int' = 0) -> 'str':
+    # items and origin at random points of a grid, manhattan distances, loads large enough for every item
+    rng = np.random.default_rng(seed)
+    points = rng.integers(0, 100, size=(n + 1, 2))
+    distances = np.abs(points[:, None, :] - points[None, :, :]).sum(axis=2)
+    size = rng.integers(1, 30, size=n)
+    max_load = rng.integers(int(size.sum() / m) + 1, int(2 * size.sum() / m) + 2, size=m)
+    os.makedirs(GENERATED_FOLDER, exist_ok=True)
+    path = os.path.join(GENERATED_FOLDER, f'gen_n{n}_m{m}_s{seed}.dat')
+    with open(path, 'w') as f:
+        f.write(f'{m}\n{n}\n')
+        f.write(' '.join(map(str, max_load)) + '\n')
+        f.write(' '.join(map(str, size)) + '\n')
+        for row in distances:
+            f.write(' '.join(map(str, row)) + '\n')
+    return path
+
+
+def build(model: 'str', instance_path: 'str', sender) -> None:
+    # runs in its own process, so that the peak memory is the one of this build only
+    from models.SAT.SAT_model import Sat_model
+    from models.SAT.cnf_model import Cnf_model
+    from models.SMT.smt_model import Z3_smt_model, Z3_smt_successor_model
+
+    instance = Instance(instance_path)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if model == 'sat':
+        built = Sat_model()
+        built.add_instance(instance)
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        stats = built.encoding_stats()
+        text = built.s.to_smt2()
+        variables, assertions = text.count('(declare-fun'), len(built.s.assertions())
+    elif model == 'cnf':
+        built = Cnf_model()
+        built.add_instance(instance)
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        stats = dict(built.encoding_stats(), families={})
+        variables, assertions = stats['variables'], stats['clauses']
+        built.close()
+    else:
+        if model == 'smt-successor':
+            built = Z3_smt_successor_model('z3', instance)
+        else:
+            built = Z3_smt_model('z3', instance, compact=model == 'smt-compact')
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        stats = built.encoding_stats()
+        text = built._solver.to_smt2()
+        variables, assertions = text.count('(declare-fun'), len(built._solver.assertions())
+    sender.send({
+        'instance': instance.name,
+        'model': model,
+        'n': instance.n,
+        'm': instance.m,
+        'build_time': stats['build_time'],
+        'variables': variables,
+        'assertions': assertions,
+        # measured before counting the variables, in kilobytes on Linux
+        'peak_rss_mb': round(peak_rss / 1024, 1),
+        'rss_before_mb': round(rss_before / 1024, 1),
+        'families': stats['families']
+    })
+
+
+def measure(model: 'str', instance_path: 'str', timeout: 'float') -> 'dict':
+    context = multiprocessing.get_context('spawn')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=build, args=(model, instance_path, sender), daemon=True)
+    process.start()
+    sender.close()
+    if receiver.poll(timeout):
+        try:
+            result = receiver.recv()
+        except EOFError:
+            result = None
+    else:
+        result = None
+    process.terminate()
+    process.join()
+    if result is None:
+        name = os.path.basename(instance_path).replace('.dat', '')
+        return {'instance': name, 'model': model, 'error': f'no result within {timeout:g} s'}
+    return result
+
+
+def compare(report: 'dict', previous: 'dict') -> 'list[str]':
+    old = {(r['instance'], r['model']): r for r in previous['results'] if 'error' not in r}
+    lines = []
+    for result in report['results']:
+        key = (result['instance'], result['model'])
+        if key not in old or 'error' in result:
+            continue
+        ratios = []
+        for measure_name in MEASURES:
+            if old[key][measure_name]:
+                ratios.append(f"{measure_name} x{result[measure_name] / old[key][measure_name]:.2f}")
+        lines.append(f"{key[0]} {key[1]}: " + ', '.join(ratios))
+    return lines
+
+
+def main(arguments) -> None:
+    instance_paths = arguments.instances
+    if len(instance_paths) == 0:
+        instance_paths = [os.path.join('./instances', f) for f in sorted(os.listdir('./instances'))
+                          if f.endswith('.dat')]
+    for size in arguments.generate:
+        n, m = (int(x) for x in size.lower().split('x'))
+        instance_paths.append(generate_instance(n, m))
+
+    commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], stdout=subprocess.PIPE,
+                            stderr=subprocess.DEVNULL, text=True).stdout.strip()
+    report = {'commit': commit, 'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'results': []}
+    for instance_path in instance_paths:
+        for model in arguments.models:
+            result = measure(model, instance_path, arguments.timeout)
+            report['results'].append(result)
+            print(f"{result['instance']} {model}: " +
+                  (result['error'] if 'error' in result else
+                   ', '.join(f"{measure_name} {result[measure_name]}" for measure_name in MEASURES)), flush=True)
+
+    if arguments.output is not None:
+        with open(arguments.output, 'w') as f:
+            json.dump(report, f, indent=4)
+    else:
+        print(json.dumps(report, indent=4))
+    if arguments.compare is not None:
+        with open(arguments.compare, 'r') as f:
+            previous = json.load(f)
+        print(f"compared to {previous.get('commit', arguments.compare)}:")
+        for line in compare(report, previous):
+            print(line)
+
+
+if __name__ == '__main__':
+    main(parser.parse_args())
@@ -0,0 +1,123 @@
+import math
+import numpy as np
+
+# Lower bounds on the objective (the longest route). All of them hold for every feasible
+# solution without assuming the triangle inequality on the distance matrix.
+
+
+def shortest_paths(distances: 'np.ndarray') -> 'np.ndarray':
+    # Floyd-Warshall, one relaxation over the whole matrix per intermediate node
+    sp = np.array(distances, dtype=np.int64)
+    for k in range(sp.shape[0]):
+        np.minimum(sp, sp[:, k:k + 1] + sp[k:k + 1, :], out=sp)
+    return sp
+
+
+def cheapest_arcs(distances: 'np.ndarray') -> 'tuple':
+    # cheapest arc leaving and entering every node, self loops excluded
+    d = np.array(distances, dtype=np.int64)
+    np.fill_diagonal(d, np.iinfo(np.int64).max)
+    return d.min(axis=1), d.min(axis=0)
+
+
+def max_items_per_courier(size: 'list', max_load: 'list') -> 'list':
+    # the k-th courier can never carry more items than the smallest ones fitting in its load
+    cumulative_size = np.cumsum(sorted(size))
+    return [int(np.searchsorted(cumulative_size, load, side='right')) for load in max_load]
+
+
+def round_trip_bound(sp: 'np.ndarray', origin: 'int') -> 'int':
+    # every item lies on a closed walk through the origin
+    items = np.arange(origin)
+    return int(np.max(sp[origin, items] + sp[items, origin]))
+
+
+def insertion_bound(distances: 'np.ndarray', origin: 'int', min_packs: 'int') -> 'int':
+    # the courier delivering item i delivers at least min_packs items: its route uses one arc
+    # leaving the origin, one leaving i and one leaving each of its other min_packs - 1 items
+    out_arcs, in_arcs = cheapest_arcs(distances)
+    best = 0
+    for arcs in (out_arcs, in_arcs):
+        items = arcs[:origin]
+        others = np.sort(items)[:min_packs]
+        for i in range(origin):
+            # the cheapest min_packs - 1 items different from i
+            rest = others[:min_packs - 1]
+            if min_packs > 1 and items[i] <= others[min_packs - 2]:
+                rest = others[:min_packs]
+                rest = np.delete(rest, np.searchsorted(rest, items[i]))
+            best = max(best, int(arcs[origin] + items[i] + np.sum(rest)))
+    return best
+
+
+def cardinality_bound(distances: 'np.ndarray', origin: 'int', size: 'list', max_load: 'list') -> 'int':
+    # if every courier delivered fewer than q items the items could not all be delivered,
+    # so some courier delivers at least q items and pays at least q + 1 arcs for them;
+    # q stops at the n items when the couriers cannot carry them all, the instance has no solution then
+    capacities = max_items_per_courier(size, max_load)
+    q = 1
+    while q < origin and sum(min(q, c) for c in capacities) < origin:
+        q += 1
+    out_arcs, in_arcs = cheapest_arcs(distances)
+    return int(max(arcs[origin] + np.sum(np.sort(arcs[:origin])[:q]) for arcs in (out_arcs, in_arcs)))
+
+
+def average_bound(distances: 'np.ndarray', origin: 'int', m: 'int') -> 'int':
+    # the routes leave every item once and the origin once per courier, the longest route
+    # is at least the average of their total length
+    out_arcs, _ = cheapest_arcs(distances)
+    departures = np.sort(np.array(distances[origin, :origin], dtype=np.int64))[:m]
+    return int(math.ceil((np.sum(out_arcs[:origin]) + np.sum(departures)) / m))
+
+
+def lp_relaxation_bound(instance) -> 'int':
+    # linear relaxation of the MIP formulation, solved with GLOP
+    from ortools.linear_solver import pywraplp
+
+    solver = pywraplp.Solver.CreateSolver('GLOP')
+    o = instance.n + 1
+    x = {}
+    for k in range(instance.m):
+        for i in range(o):
+            for j in range(o):
+                if i != j:
+                    x[k, i, j] = solver.NumVar(0, 1, '')
+    u = {(k, i): solver.NumVar(1, o, '') for k in range(instance.m) for i in range(o)}
+    obj = solver.NumVar(0, solver.infinity(), 'obj')
+
+    for k in range(instance.m):
+        solver.Add(obj >= solver.Sum(int(instance.distances[i][j]) * x[k, i, j] for (kk, i, j) in x if kk == k))
+        for i in range(o):
+            solver.Add(solver.Sum(x[k, i, j] for j in range(o) if j != i)
+                       == solver.Sum(x[k, j, i] for j in range(o) if j != i))
+        solver.Add(solver.Sum(x[k, o - 1, j] for j in range(o - 1)) == 1)
+        solver.Add(solver.Sum(instance.size[j] * x[k, i, j] for i in range(o) for j in range(o - 1) if i != j)
+                   <= instance.max_load[k])
+        solver.Add(solver.Sum(x[k, i, j] for i in range(o) for j in range(o - 1) if i != j) >= instance.min_packs)
+        for i in range(o - 1):
+            for j in range(o - 1):
+                if i != j:
+                    solver.Add(u[k, j] - u[k, i] >= 1 - o * (1 - x[k, i, j]))
+    for j in range(o - 1):
+        solver.Add(solver.Sum(x[k, i, j] for k in range(instance.m) for i in range(o) if i != j) == 1)
+
+    solver.Minimize(obj)
+    if solver.Solve() != pywraplp.Solver.OPTIMAL:
+        return 0
+    # the objective is integral, round up while forgiving the LP tolerance
+    return int(math.ceil(obj.solution_value() - 1e-6))
+
+
+def lower_bounds(instance, lp_relaxation_limit: 'int' = 10000) -> 'dict':
+    # the LP relaxation is only worth its building time when the courier-arc table is small
+    o = instance.n
+    sp = shortest_paths(instance.distances)
+    bounds = {
+        'round_trip': round_trip_bound(sp, o),
+        'insertion': insertion_bound(instance.distances, o, instance.min_packs),
+        'cardinality': cardinality_bound(instance.distances, o, instance.size, instance.max_load),
+        'average': average_bound(instance.distances, o, instance.m)
+    }
+    if instance.m * (instance.n + 1) ** 2 <= lp_relaxation_limit:
+        bounds['lp_relaxation'] = lp_relaxation_bound(instance)
+    return bounds
@@ -1,100 +1,165 @@
+import os
+import json
+import hashlib
 import numpy as np
 from time import time
 from more_itertools import locate
 
+from bounds import lower_bounds
+
+# Bump it whenever the parsing or the bounds change, so that stale cache entries are ignored
+CACHE_VERSION = 2
+
+
+def greedy_paths(distances: 'np.ndarray', origin: 'int', steps: 'int') -> 'tuple':
+    # Builds at once the n greedy paths that leave the origin towards every item and then move
+    # steps - 1 times to the farthest item not visited yet, breaking ties on the lowest index.
+    # Returns the cost of each path and the item it ends at.
+    n = distances.shape[0] - 1
+    rows = np.arange(n)
+    visited = np.zeros(shape=(n, n + 1), dtype=bool)
+    visited[:, origin] = True
+    visited[rows, rows] = True
+    last = rows.copy()
+    costs = distances[origin, rows].astype(np.int64)
+
+    for _ in range(steps - 1):
+        # visited nodes are masked with a value no unvisited node can win against
+        candidates = np.where(visited, -1, distances[last])
+        following = np.argmax(candidates, axis=1)
+        costs += distances[last, following]
+        visited[rows, following] = True
+        last = following
+
+    return costs, last
+
+
 class Instance:
 
-    def __init__(self, file_path: 'str') -> None:
+    def __init__(self, file_path: 'str', cache_folder: 'str|None' = '.cache/instances') -> None:
         self.name = file_path.split('/')[-1].replace('.dat', '')
-        file = open(file_path, "r")
-        lines = [line.replace('\n', '') for line in file]
+        file = open(file_path, "rb")
+        content = file.read()
         file.close()
+        key = hashlib.sha256(content + f'version={CACHE_VERSION}'.encode()).hexdigest()
+        self.hash = key
+
+        if cache_folder is None or not self.__load_cache(cache_folder, key):
+            self.__parse(content.decode())
+            if cache_folder is not None:
+                self.__save_cache(cache_folder, key)
+
+        self.optimal_paths = None
+        self.number_of_origin_stops = int(((self.max_packs + 2) * self.m) - self.n)
+        self.origin = int(self.n+1)
+        self.n_array = [i+1 for i in range(self.n + 1)]
+        self.count_array = [1 for _ in range(self.n)] + [self.number_of_origin_stops]
+
+    def __parse(self, content: 'str') -> 'None':
+        lines = [line for line in content.split('\n') if line.strip() != '']
         self.m = int(lines[0])
         self.n = int(lines[1])
-        loads = lines[2].split(' ')
-        self.max_load = [int(l) for l in loads]
+        self.max_load = [int(l) for l in lines[2].split()]
         self.max_load_indexes = np.argsort(self.max_load)
         self.max_load = list(sorted(self.max_load))
-        sizes = lines[3].split(' ')
-        self.size = [int(s) for s in sizes if s != '']
-        lines = lines[4:]
-        self.distances = np.zeros(shape=(self.n + 1, self.n + 1), dtype=int)
-        for i in range(self.n + 1):
-            line = lines[i].split(' ')
-            for j in range(self.n + 1):
-                self.distances[i, j] = int(line[j])
+        self.size = [int(s) for s in lines[3].split()]
+        self.distances = np.array([line.split() for line in lines[4:self.n + 5]], dtype=int)
 
-        self.optimal_paths = None
         self.min_path = 0
-        start_time = time()
         self.max_packs = self.n-self.m+1
         self.compute_bounds()
-        self.number_of_origin_stops = int(((self.max_packs + 2) * self.m) - self.n)
-        self.origin = int(self.n+1)
-        self.n_array = [i+1 for i in range(self.n + 1)]
-        self.count_array = [1 for _ in range(self.n)] + [self.number_of_origin_stops]
-        self.presolve_time = time() - start_time
+
+    def __load_cache(self, cache_folder: 'str', key: 'str') -> 'bool':
+        metadata_path = os.path.join(cache_folder, f'{key}.json')
+        distances_path = os.path.join(cache_folder, f'{key}.npy')
+        if not os.path.exists(metadata_path) or not os.path.exists(distances_path):
+            return False
+        try:
+            with open(metadata_path, 'r') as f:
+                metadata = json.load(f)
+            self.distances = np.load(distances_path, mmap_mode='r')
+        except (OSError, ValueError):
+            return False
+
+        self.m = metadata['m']
+        self.n = metadata['n']
+        self.max_load = metadata['max_load']
+        self.max_load_indexes = np.array(metadata['max_load_indexes'])
+        self.size = metadata['size']
+        self.min_path = metadata['min_path']
+        self.max_path = metadata['max_path']
+        self.min_packs = metadata['min_packs']
+        self.max_packs = metadata['max_packs']
+        self.lower_bounds = metadata['lower_bounds']
+        self.presolve_time = metadata['presolve_time']
+        return True
+
+    def __save_cache(self, cache_folder: 'str', key: 'str') -> 'None':
+        os.makedirs(cache_folder, exist_ok=True)
+        metadata = {
+            'm': self.m,
+            'n': self.n,
+            'max_load': [int(l) for l in self.max_load],
+            'max_load_indexes': [int(i) for i in self.max_load_indexes],
+            'size': self.size,
+            'min_path': int(self.min_path),
+            'max_path': int(self.max_path),
+            'min_packs': int(self.min_packs),
+            'max_packs': int(self.max_packs),
+            'lower_bounds': self.lower_bounds,
+            'presolve_time': self.presolve_time
+        }
+        # write to a private file and rename it, so that concurrent workers never read a partial entry
+        pid = os.getpid()
+        distances_tmp = os.path.join(cache_folder, f'{key}.{pid}.tmp.npy')
+        metadata_tmp = os.path.join(cache_folder, f'{key}.{pid}.tmp.json')
+        np.save(distances_tmp, self.distances)
+        with open(metadata_tmp, 'w') as f:
+            json.dump(metadata, f)
+        os.replace(distances_tmp, os.path.join(cache_folder, f'{key}.npy'))
+        os.replace(metadata_tmp, os.path.join(cache_folder, f'{key}.json'))
 
     def compute_bounds(self) -> 'None':
+        start_time = time()
         o = self.n
-
-        def compute_path(current_cost, nodes, select, steps):
-            if steps > len(nodes) - 1:
-                next_step, cost = select(nodes)
-                updated_nodes = nodes + [next_step]
-                cost += current_cost
-                return compute_path(cost, updated_nodes, select, steps)
-            return {'p': nodes, 'c': current_cost}
-
         max_weight = sum(self.max_load[1:])
-
-        def min_select(nodes):
-            dist = np.copy(self.distances[nodes[-1], :])
-            dist[nodes] = np.max(dist) + 1
-            c = np.min(dist)
-            i, = np.where(dist == c)
-            return i[0], c
-
-        ordered_size = sorted(self.size)
+        # cumulative_size[k] is the total size of the k smallest items
+        cumulative_size = np.concatenate(([0], np.cumsum(sorted(self.size))))
 
         k = 1
-        while sum(ordered_size[:self.n - k]) > max_weight:
-            k += 1
-        if k == 1:
-            self.min_path = int(np.max(
-                [self.distances[o, i] + self.distances[i, o] for i in range(self.n)]
-            ))
-        else:
-            min_origin = int(min([self.distances[i, o] for i in range(self.n)]))
-            self.min_path = int(
-                max([
-                    int(compute_path(self.distances[o, i], [o, i], min_select, k)['c']) + min_origin
-                    for i in range(self.n)
-                ]
-                ))
-
-        k = 1
-        while sum(ordered_size[:self.n - k]) > max_weight:
+        while cumulative_size[self.n - k] > max_weight:
             k += 1
         self.min_packs = k
 
         k = 1
-        while sum(ordered_size[:k]) < self.max_load[-1] and k < self.n:
+        while cumulative_size[k] < self.max_load[-1] and k < self.n:
             k += 1
 
         self.max_packs = min(k, self.max_packs)
 
-        def max_select(nodes):
-            dist = np.copy(self.distances[nodes[-1], :])
-            dist[nodes] = -1
-            c = np.max(dist)
-            i, = np.where(dist == c)
-            return i[0], c
+        costs, last = greedy_paths(self.distances, o, k)
+        self.max_path = int(np.max(costs + self.distances[last, o]))
 
-        maxes = [compute_path(self.distances[o, i], [o, i], max_select, k) for i in range(self.n)]
-        self.max_path = int(np.max([int(m['c']) + self.distances[m['p'][-1], o] for m in maxes]))
+        # every candidate is a valid lower bound, the objective is at least the best of them
+        self.lower_bounds = lower_bounds(self)
+        self.min_path = max(self.lower_bounds.values())
+        self.max_path = max(self.max_path, self.min_path)
+        self.presolve_time = time() - start_time
 
-    def save_dzn(self, file_path=None):
+    def route_length(self, route: 'list') -> 'int':
+        # route in the result['sol'] format: the items a courier delivers, numbered from 1
+        stops = np.array([self.n] + [i - 1 for i in route] + [self.n])
+        return int(np.sum(self.distances[stops[:-1], stops[1:]], dtype=np.int64))
+
+    def objective(self, routes: 'list[list]') -> 'int':
+        # the longest route, 0 when no courier moves
+        return max([0] + [self.route_length(route) for route in routes])
+
+    def tighten_max_path(self, upper_bound: 'int') -> 'None':
+        # upper_bound is the objective of a known solution, no better solution can be longer than it
+        self.max_path = max(min(self.max_path, int(upper_bound)), self.min_path)
+
+    def dzn(self) -> 'str':
         similar = self.get_similar(self.max_load)
         similar_str = "[" + ", ".join(["{" + ",".join([str(s) for s in sim]) + "}" for sim in similar]) + "]"
         distaces_list = self.distances
@@ -114,12 +179,16 @@ count_array = {self.count_array};
 min_packs = {self.min_packs};
 similars = {similar_str}
         '''
+        return instance
+
+    def save_dzn(self, file_path=None):
         name = self.name
         path = "."
         if not file_path is None:
             path = file_path
         file = open(f"{path}/{name}.dzn", "w")
-        file.write(instance)
+        file.write(self.dzn())
+        file.close()
 
     def get_similar(self, loads):
         ret_lst = []
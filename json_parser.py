@@ -10,7 +10,9 @@ class Json_parser:
             "MIP": os.path.join(result_directory_path, "MIP"),
             "SAT": os.path.join(result_directory_path, "SAT"),
             "CP": os.path.join(result_directory_path, "CP"),
-            "SMT": os.path.join(result_directory_path, "SMT")
+            "SMT": os.path.join(result_directory_path, "SMT"),
+            "HEURISTIC": os.path.join(result_directory_path, "HEURISTIC"),
+            "RACE": os.path.join(result_directory_path, "RACE")
         }
 
     def save_results(self, approach_name, instance_number, result, reorder_values, sub_folder="_None_"):
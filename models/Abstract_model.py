@@ -16,6 +16,62 @@ class Abstract_model:
         self._result = {}
 
         self._courier_routes = {k: [] for k in range(instance.m)}
+        self._incumbent = None
+        self._incumbent_time = None
+        self._shared = None
+
+    def set_incumbent(self, routes: 'list', found_in: 'float' = 0) -> None:
+        # routes in the result['sol'] format: for every courier, in the order of instance.max_load,
+        # the list of the items it delivers (numbered from 1); found_in is what the solution cost
+        self._incumbent = [list(route) for route in routes]
+        self._incumbent_time = found_in
+
+    def set_shared_bound(self, shared) -> None:
+        # scheduler.SharedBound of a race: the model publishes its solutions there and
+        # does not look for solutions that are not better than the best one of the race
+        self._shared = shared
+
+    def _share_result(self, proved: 'bool') -> None:
+        # proved: the search showed that no solution is better than the one it returns, or
+        # than the best one of the race when it found nothing better
+        if self._shared is None:
+            return
+        if self._result.get('obj') is not None and self._result.get('sol') is not None:
+            self._shared.publish(int(self._result['obj']), self._result['sol'])
+        if proved:
+            self._shared.close()
+
+    def incumbent_objective(self) -> 'int':
+        return self._instance.objective(self._incumbent)
+
+    def _incumbent_values(self) -> 'tuple[dict, dict]':
+        # value of every table entry and position, counted from 1, of every delivered item in its route
+        o = self._instance.origin - 1
+        table = {(k, i, j): 0 for k in range(self._instance.m)
+                 for i in range(self._instance.origin) for j in range(self._instance.origin)}
+        positions = {}
+        for k, route in enumerate(self._incumbent):
+            if len(route) == 0:
+                continue
+            nodes = [o] + [i - 1 for i in route] + [o]
+            for a, b in zip(nodes, nodes[1:]):
+                table[k, a, b] = 1
+            for p, i in enumerate(route):
+                positions[k, i - 1] = p + 1
+        return table, positions
+
+    def _report_warm_start(self, time_to_first_solution: 'float|None') -> None:
+        # the warm_start field of the result, only when the solver told when it had its first solution and
+        # did not end worse than the incumbent: otherwise it ignored the incumbent and there is nothing to report
+        if self._incumbent is None or time_to_first_solution is None:
+            return
+        if self._result.get('obj') is None or self._result['obj'] > self.incumbent_objective():
+            return
+        self._result['warm_start'] = {
+            'obj': self.incumbent_objective(),
+            'found_in': round(self._incumbent_time, 3),
+            'time_to_first_solution': round(time_to_first_solution, 3)
+        }
 
     def _get_solution(self) -> 'list':
         # Create a dictionary to store the routes for each courier
@@ -0,0 +1,126 @@
+import time
+import copy
+import numpy as np
+
+from multiprocessing import Pool
+from instance import Instance
+from models.Cp.model import CpModel, route_rows
+from models.Heuristic.heuristic_model import Heuristic_model
+
+
+def fixing_constraints(instance: 'Instance', routes: 'list[list]', free: 'set') -> 'list[str]':
+    # keeps every item that is not free on its courier, and the whole route of the untouched couriers
+    constraints = []
+    rows = route_rows(routes, instance)
+    for k, route in enumerate(routes):
+        if len(free.intersection(route)) == 0:
+            constraints += [f'constraint courier_route[{k + 1}, {p + 1}] = {stop};' for p, stop in enumerate(rows[k])]
+        constraints += [f'constraint packs[{i}] = {k + 1};' for i in route if i not in free]
+    return constraints
+
+
+def solve_neighbourhood(task: 'tuple') -> 'tuple|None':
+    # runs in a worker: only the solutions better than the incumbent are searched
+    model_path, instance, solver, routes, free, best, time_limit = task
+    instance = copy.copy(instance)
+    instance.tighten_max_path(best - 1)
+    if instance.max_path >= best:
+        return None
+    # every neighbourhood is a model of its own, solved once: it is not worth a cache entry
+    model = CpModel(model_path, cache=False)
+    model.add_instance(instance, solver)
+    model.add_constraints(fixing_constraints(instance, routes, free))
+    result = model.solve(time_limit).get_result()
+    if result['obj'] is None or result['obj'] >= best:
+        return None
+    return result['obj'], result['sol']
+
+
+class CpLns:
+    SUFFIX = '-lns'
+
+    def __init__(self, model_file_path: 'str', instance: 'Instance', solver: 'str', seed: 'int' = 0):
+        self.__model_path = model_file_path
+        self.__instance = instance
+        # the neighbourhoods fix couriers as they are in the incumbent, which the ordering of identical
+        # couriers of the symmetry breaking would often forbid, so the sub-solves always run without it
+        self.__solver = solver if CpModel.NO_SYMMETRY in solver else solver + CpModel.NO_SYMMETRY
+        self.__rng = np.random.default_rng(seed)
+        self.__distances = np.asarray(instance.distances, dtype=np.int64)
+        self.__incumbent = None
+
+    def set_incumbent(self, routes: 'list[list]', found_in: 'float' = 0) -> 'None':
+        self.__incumbent = [list(route) for route in routes]
+
+    def __items_of(self, routes: 'list[list]', couriers) -> 'list':
+        return [i for k in couriers for i in routes[k]]
+
+    def __random_couriers(self, routes: 'list[list]', size: 'int') -> 'set':
+        free = []
+        for k in self.__rng.permutation(len(routes)):
+            if len(free) >= size:
+                break
+            free += routes[k]
+        return set(free)
+
+    def __related_items(self, routes: 'list[list]', size: 'int') -> 'set':
+        # the items closest to a random one, distances taken in both directions
+        seed = int(self.__rng.integers(self.__instance.n))
+        closeness = self.__distances[seed, :-1] + self.__distances[:-1, seed]
+        return set(int(i) + 1 for i in np.argsort(closeness, kind='stable')[:size])
+
+    def __worst_courier(self, routes: 'list[list]', size: 'int') -> 'set':
+        # the items of the longest route and the ones closest to them
+        worst = int(np.argmax([self.__instance.route_length(route) for route in routes]))
+        free = routes[worst]
+        if len(free) == 0:
+            return self.__random_couriers(routes, size)
+        stops = np.array(free) - 1
+        closeness = np.min(self.__distances[stops, :-1] + self.__distances[:-1, stops].T, axis=0)
+        closest = [int(i) + 1 for i in np.argsort(closeness, kind='stable')]
+        return set(free + [i for i in closest if i not in free][:max(0, size - len(free))])
+
+    def __initial_solution(self, timeout: 'float') -> 'list|None':
+        if self.__incumbent is not None:
+            return self.__incumbent
+        heuristic = Heuristic_model('heuristic', self.__instance)
+        heuristic.solve(timeout=timeout)
+        return heuristic.get_result()['sol']
+
+    def solve(self, timeout: 'int' = 300000, processes: 'int' = 1, time_limit: 'int' = 2000) -> 'dict':
+        # timeout and time_limit, the budget of every neighbourhood, are expressed in milliseconds
+        start_time = time.time()
+        deadline = start_time + timeout / 1000
+        result = {'optimal': False, 'obj': None, 'sol': None, 'iterations': 0}
+
+        routes = self.__initial_solution(min(10, timeout / 10000))
+        if routes is None:
+            result['time'] = round(time.time() - start_time, 3)
+            return result
+        best = self.__instance.objective(routes)
+
+        neighbourhoods = [self.__random_couriers, self.__related_items, self.__worst_courier]
+        # the share of free items grows while the search is stuck and goes back down on improvement
+        fraction = 0.3
+        with Pool(max(1, processes)) as pool:
+            while best > self.__instance.min_path:
+                remaining = int((deadline - time.time()) * 1000)
+                if remaining < min(time_limit, 500):
+                    break
+                size = max(2, int(fraction * self.__instance.n))
+                tasks = [(self.__model_path, self.__instance, self.__solver, routes,
+                          neighbourhoods[(result['iterations'] + w) % len(neighbourhoods)](routes, size),
+                          best, min(time_limit, remaining)) for w in range(max(1, processes))]
+                improved = False
+                for found in pool.imap_unordered(solve_neighbourhood, tasks):
+                    if found is not None and found[0] < best:
+                        best, routes = found
+                        improved = True
+                result['iterations'] += len(tasks)
+                fraction = 0.3 if improved else min(0.8, fraction * 1.1)
+
+        result['time'] = round(time.time() - start_time, 3)
+        result['optimal'] = best <= self.__instance.min_path
+        result['obj'] = best
+        result['sol'] = routes
+        return result
@@ -1,130 +1,300 @@
 import json
 import re
+import numpy as np
+from collections import deque
 from os.path import join, exists
-from os import makedirs, remove
+from os import makedirs
 from instance import *
 
-from models.Cp.solutions import CpSolution
+from models.Cp.solutions import CpSolution, route_lists
+import os
+import shutil
+import hashlib
+import tempfile
 import subprocess
+import threading
+import time
 
 
 class CpModel:
 
     NO_SYMMETRY = "-no-sym"
     NO_SYMMETRY_STR = "mzn_ignore_symmetry_breaking_constraints=true;"
-    MODEL_PATH  = '.cache/cp/model.mzn'
+    FZN_CACHE = '.cache/cp/fzn'
+    WORKSPACES = '.cache/cp/work'
+    OUTPUT_MODE = 'json'
+    __version = None
 
-    def __init__(self, model_file_path: 'str') -> 'None':
+    def __init__(self, model_file_path: 'str', cache: 'bool' = True) -> 'None':
+        # cache: whether the flattened models are kept in FZN_CACHE, models solved only once, as the
+        # neighbourhoods of the LNS, are better flattened in the workspace and removed with it
         self.__model_path = model_file_path
+        self.__cache = cache
         self.model_name = model_file_path.split('/')[-1].replace('.mzn', '')
 
     def add_instance(self, instance: 'Instance', solver: 'str' = 'Gecode') -> 'None':
         self.__instance = instance
         self.__solver = solver
+        self.__incumbent = None
+        self.__incumbent_time = None
+        self.__shared = None
+        self.__process = None
+        self.__info = {}
+        self.__constraints = []
 
-    def solve(self, timeout: 'int' = 300000, processes: 'int' = 1) -> CpSolution:
-        if not exists('.cache'):
-            makedirs('.cache')
-        if not exists('.cache/cp'):
-            makedirs('.cache/cp')
+    def set_incumbent(self, routes: 'list', found_in: 'float' = 0) -> 'None':
+        # routes in the result['sol'] format, found_in is what the solution cost
+        self.__incumbent = [list(route) for route in routes]
+        self.__incumbent_time = found_in
 
-        solver = self.__solver
-        symmetry_breaking = True
-        if self.NO_SYMMETRY in self.__solver:
-            solver = solver.replace(self.NO_SYMMETRY, '')
-            symmetry_breaking = False
-        self.__instance.save_dzn('.cache/cp')
-        parameters = ['minizinc', '--solver', solver, self.MODEL_PATH , f'.cache/cp/{self.__instance.name}.dzn',
-                      '-s', '-p', str(processes), '-i', '--json-stream']
-        if timeout > 0:
-            parameters += ['--time-limit', str(timeout)]
+    def add_constraints(self, constraints: 'list[str]') -> 'None':
+        # MiniZinc constraint items appended to the model, e.g. to fix part of a solution
+        self.__constraints += constraints
 
+    def set_shared_bound(self, shared) -> 'None':
+        # scheduler.SharedBound of a race, see __watch
+        self.__shared = shared
+
+    def __warm_start_annotation(self) -> 'str':
+        packs = [0 for _ in range(self.__instance.n)]
+        for k, route in enumerate(self.__incumbent):
+            for i in route:
+                packs[i - 1] = k + 1
+        routes = [stop for row in route_rows(self.__incumbent, self.__instance) for stop in row]
+        return f'warm_start_array([warm_start(packs, {packs}), warm_start(array1d(courier_route), {routes})]) :: '
+
+    def __final_model(self, symmetry_breaking: 'bool') -> 'str':
         model = open(self.__model_path,'r')
         model_str = model.read()
         model.close()
+        if self.__incumbent is not None:
+            model_str = re.sub(r'solve\s*::', 'solve :: ' + self.__warm_start_annotation(), model_str, count=1)
         if not symmetry_breaking:
             model_str += self.NO_SYMMETRY_STR
+        if len(self.__constraints) > 0:
+            model_str += '\n' + '\n'.join(self.__constraints) + '\n'
+        return model_str
 
-        model_final = open(self.MODEL_PATH,'w+')
-        model_final.write(model_str)
-        model_final.close()
-        completed_process = subprocess.Popen(parameters, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        info = {}
-        solutions = []
-        statistics = []
-        states = []
-        for line in completed_process.stdout:
-            message_data = json.loads(line)
-            if message_data.get("type") == "solution":
-                output_section = message_data.get("output", {})
-                solution = manage_the_solution(output_section['dzn'])
-                solutions.append(solution)
-            if message_data.get("type") == "statistics":
-                statistics.append(message_data)
-            if message_data.get("type") == "status":
-                states.append(message_data)
-
-        completed_process.wait()
-        info['solutions'] = solutions
-        info['statistics'] = statistics
-        info['states'] = states
-        remove('.cache/cp/model.mzn')
-        return CpSolution(info)
+    def solve(self, timeout: 'int' = 300000, processes: 'int' = 1, history: 'int' = 0, callback=None,
+              stop_at: 'int|None' = None) -> CpSolution:
+        # only the last solution is kept, history is how many of the previous ones are kept too;
+        # callback gets every incumbent of stream as soon as it is found
+        for incumbent in self.stream(timeout, processes, history, stop_at):
+            if callback is not None:
+                callback(incumbent)
+        return CpSolution(self.__info)
+
+    def stream(self, timeout: 'int' = 300000, processes: 'int' = 1, history: 'int' = 0, stop_at: 'int|None' = None):
+        # yields every incumbent, as a dict with its objective, its routes and the seconds since the
+        # start, as soon as minizinc prints it; the search stops once the objective is stop_at
+        # (min_path by default), when stop() is called or when the generator is closed
+        makedirs(self.FZN_CACHE, exist_ok=True)
 
-    def save(self, path):
-        file_name = join(path,f'{self.__instance.name}.fnz')
-        if not exists('.cache/cp'):
-                makedirs('.cache/cp')
-        
         solver = self.__solver
         symmetry_breaking = True
         if self.NO_SYMMETRY in self.__solver:
             solver = solver.replace(self.NO_SYMMETRY, '')
             symmetry_breaking = False
-        model = open(self.__model_path,'r')
-        model_str = model.read()
-        model.close()
-        if not symmetry_breaking:
-            model_str += self.NO_SYMMETRY_STR
+        if stop_at is None:
+            stop_at = self.__instance.min_path
+
+        model_str = self.__final_model(symmetry_breaking)
+        workspace = self.__workspace()
+        self.__stopped = False
+        try:
+            yield from self.__solve(solver, model_str, workspace, timeout, processes, history, stop_at)
+        finally:
+            self.stop()
+            shutil.rmtree(workspace, ignore_errors=True)
+
+    def stop(self) -> 'None':
+        # ends the search, what has been found so far is the result of the solve
+        self.__stopped = True
+        if self.__process is not None and self.__process.poll() is None:
+            self.__process.terminate()
+
+    def __solve(self, solver: 'str', model_str: 'str', workspace: 'str', timeout: 'int',
+                processes: 'int', history: 'int', stop_at: 'int'):
+        start = time.time()
+        self.__info = {}
+        solution = None
+        n_solutions = 0
+        previous = deque(maxlen=history)
+        statistics = []
+        states = []
+        first_solution_time = None
+        flatten_time = 0
+        deadline = start + timeout / 1000
+        restart = True
+        first_run = True
+        while restart and not self.__stopped:
+            if self.__shared is not None:
+                # the run only looks for solutions better than the best one of the race
+                self.__instance.tighten_max_path(self.__shared.value() - 1)
+            # a restart has a max_path of its own that no later solve shares, it is not worth a cache entry
+            fzn, ozn, compile_time = self.__compile(solver, model_str, workspace, self.__cache and first_run)
+            first_run = False
+            flatten_time += compile_time
+            parameters = ['minizinc', '--solver', solver, fzn, '--ozn-file', ozn, '--output-mode', self.OUTPUT_MODE,
+                          '-s', '-p', str(processes), '-i', '--json-stream', '--output-time']
+            if timeout > 0:
+                parameters += ['--time-limit', str(max(1, int((deadline - time.time()) * 1000)))]
+
+            self.__process = subprocess.Popen(parameters, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+            states = []
+            self.__best = self.__instance.max_path + 1
+            self.__restart = False
+            run_over = threading.Event()
+            if self.__shared is not None:
+                threading.Thread(target=self.__watch, args=(run_over,), daemon=True).start()
+            for line in self.__process.stdout:
+                message_data = json.loads(line)
+                if message_data.get("type") == "solution":
+                    if solution is not None and history > 0:
+                        previous.append(solution)
+                    solution = decode_solution(message_data.get("output", {}))
+                    n_solutions += 1
+                    self.__best = solution['max_distance']
+                    if first_solution_time is None and 'time' in message_data:
+                        first_solution_time = message_data['time'] / 1000
+                    if solution['max_distance'] <= stop_at:
+                        self.stop()
+                    yield {
+                        'obj': solution['max_distance'],
+                        'sol': route_lists(solution['courier_route']),
+                        'time': round(time.time() - start, 3)
+                    }
+                if message_data.get("type") == "statistics":
+                    statistics.append(message_data)
+                if message_data.get("type") == "status":
+                    states.append(message_data)
+
+            self.__process.wait()
+            run_over.set()
+            restart = self.__restart and (timeout <= 0 or time.time() < deadline)
+            if self.__shared is not None and not self.__restart and len(states) > 0 and \
+                    states[0]['status'] in ('OPTIMAL_SOLUTION', 'UNSATISFIABLE'):
+                # the run is complete, nothing is better than its last solution or than the bound it had
+                self.__shared.close()
+
+        if self.__stopped and len(states) == 0 and solution is not None:
+            # minizinc was terminated before it could tell how the search ended
+            optimal = solution['max_distance'] <= self.__instance.min_path
+            states = [{'type': 'status', 'status': 'OPTIMAL_SOLUTION' if optimal else 'SATISFIED'}]
+
+        self.__info['solution'] = solution
+        self.__info['n_solutions'] = n_solutions
+        self.__info['history'] = list(previous)
+        self.__info['statistics'] = statistics
+        self.__info['states'] = states
+        self.__info['flatten_time'] = round(flatten_time, 3)
+        if self.__incumbent is not None and first_solution_time is not None:
+            self.__info['warm_start'] = {
+                'obj': self.__instance.objective(self.__incumbent),
+                'found_in': round(self.__incumbent_time, 3),
+                'time_to_first_solution': round(first_solution_time, 3)
+            }
+
+    @classmethod
+    def __minizinc_version(cls) -> 'str':
+        if cls.__version is None:
+            cls.__version = subprocess.run(['minizinc', '--version'], stdout=subprocess.PIPE,
+                                           stderr=subprocess.PIPE, text=True).stdout
+        return cls.__version
+
+    def __workspace(self) -> 'str':
+        # private folder of a solve or an export, removed when it is over; it is on the same file
+        # system as the caches, so that what is built there can be renamed into place
+        makedirs(self.WORKSPACES, exist_ok=True)
+        return tempfile.mkdtemp(prefix=f'{self.__instance.name}-', dir=self.WORKSPACES)
+
+    def __write_sources(self, model_str: 'str', workspace: 'str') -> 'tuple[str, str]':
+        model_path = join(workspace, 'model.mzn')
+        data_path = join(workspace, f'{self.__instance.name}.dzn')
+        with open(model_path, 'w') as f:
+            f.write(model_str)
+        with open(data_path, 'w') as f:
+            f.write(self.__instance.dzn())
+        return model_path, data_path
+
+    def __compile(self, solver: 'str', model_str: 'str', workspace: 'str',
+                  cache: 'bool' = True) -> 'tuple[str, str, float]':
+        # the flattening only depends on the model, the data and the solver: the compiled files are kept
+        # under a hash of them and the later solves go straight to the solver; without cache they stay
+        # in the workspace
+        dzn_str = self.__instance.dzn()
+        key = hashlib.sha256('\n'.join([model_str, dzn_str, solver, self.OUTPUT_MODE,
+                                         self.__minizinc_version()]).encode()).hexdigest()
+        folder = join(self.FZN_CACHE, key)
+        fzn = join(folder, 'model.fzn')
+        ozn = join(folder, 'model.ozn')
+        if cache and exists(fzn) and exists(ozn):
+            return fzn, ozn, 0
+
+        start = time.time()
+        model_path, data_path = self.__write_sources(model_str, workspace)
+        compiled = join(workspace, key)
+        makedirs(compiled, exist_ok=True)
+        parameters = ['minizinc', '-c', '--solver', solver, model_path, data_path, '--output-mode', self.OUTPUT_MODE,
+                      '--fzn', join(compiled, 'model.fzn'), '--ozn', join(compiled, 'model.ozn')]
+        completed_process = subprocess.run(parameters, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        if completed_process.returncode != 0:
+            raise Exception(f'minizinc could not compile the model: {completed_process.stderr}')
+        if not cache:
+            return join(compiled, 'model.fzn'), join(compiled, 'model.ozn'), time.time() - start
+        try:
+            os.rename(compiled, folder)
+        except OSError:
+            # another solve has compiled the same model in the meantime
+            pass
+        return fzn, ozn, time.time() - start
+
+    def __watch(self, run_over: 'threading.Event') -> 'None':
+        # minizinc cannot take a new bound while it runs: it is restarted when another solver of the
+        # race finds a better solution than the last one of the run, and stopped when the race is over
+        while not run_over.wait(0.5):
+            if self.__shared.closed():
+                self.stop()
+                return
+            if self.__shared.value() < self.__best:
+                self.__restart = True
+                self.__process.terminate()
+                return
+
+    def save(self, path):
+        file_name = join(path,f'{self.__instance.name}.fnz')
+
+        symmetry_breaking = self.NO_SYMMETRY not in self.__solver
+        workspace = self.__workspace()
+        try:
+            model_path, data_path = self.__write_sources(self.__final_model(symmetry_breaking), workspace)
+            fzn = join(workspace, 'model.fzn')
+            parameters = ['minizinc', model_path, data_path, "--fzn", fzn, "-c"]
+            output = subprocess.run(parameters, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True).stderr
+            if output == "":
+                # copied next to the destination and renamed, a reader never sees a partial file
+                tmp_file = f'{file_name}.{os.getpid()}.tmp'
+                shutil.copyfile(fzn, tmp_file)
+                os.replace(tmp_file, file_name)
+                print(f"exported model to file {self.__instance.name} into folder {path}")
+            else:
+                print(output)
+        finally:
+            shutil.rmtree(workspace, ignore_errors=True)
+
+def route_rows(routes: 'list[list]', instance: 'Instance') -> 'list[list]':
+    # routes in the result['sol'] format as rows of courier_route: from the origin back to it, padded with it
+    origin = instance.origin
+    path_length = instance.max_packs + 2
+    return [[origin] + list(route) + [origin for _ in range(path_length - len(route) - 1)] for route in routes]
+
 
-        model_final = open(self.MODEL_PATH,'w+')
-        model_final.write(model_str)
-        model_final.close()
-
-        self.__instance.save_dzn('.cache/cp')
-        parameters = ['minizinc', self.MODEL_PATH, f'.cache/cp/{self.__instance.name}.dzn', "--fzn", file_name, "-c"]
-        output = subprocess.run(parameters, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True).stderr
-        if output == "":
-            print(f"exported model to file {self.__instance.name} into folder {path}")
-        else:
-            print(output)
-        remove('.cache/cp/model.mzn')
-
-def manage_the_solution(solution_str):
-    pattern = r'(\w+)\s*=\s*((?:\[\|[\s\S]*?\|\])|(?:\[.*?\])|(?:\d+));'
-    matches = re.findall(pattern, solution_str)
-    parsed_data = {}
-
-    for key, value in matches:
-        if '[' in value:
-            value = re.findall(r'\d+', value)
-            value = [int(v) for v in value]
-        elif ';' in value:
-            value = value.split(';')
-            value = [int(v.strip()) for v in value]
-        else:
-            value = int(value)
-        parsed_data[key] = value
-
-    total_size = len(parsed_data['courier_route'])
-    m = len(parsed_data['courier_distance'])
-    sublist_size = total_size // m
-
-    parsed_data['courier_route'] = [parsed_data['courier_route'][i:i + sublist_size] for i in
-                                    range(0, len(parsed_data['courier_route']), sublist_size)]
-    new_data = []
-    for sublist in parsed_data['courier_route']:
-        m = max(sublist)
-        new_data.append(list(filter(lambda d: d < m, sublist)))
-    parsed_data['courier_route'] = new_data
-    return parsed_data
+def decode_solution(output_section: 'dict') -> 'dict':
+    # the json output of a solution, the routes stay in a (couriers x stops) array padded with the origin
+    values = output_section['json']
+    if isinstance(values, str):
+        values = json.loads(values)
+    return {
+        'max_distance': int(values['max_distance']),
+        'courier_route': np.asarray(values['courier_route'], dtype=np.int32)
+    }
@@ -1,6 +1,11 @@
 LAMBDA = 0.1
 
 
+def route_lists(courier_route) -> 'list[list]':
+    # courier_route: (couriers x stops) array, every route starts at the origin and the items are the other stops
+    return [route[route != route[0]].tolist() for route in courier_route]
+
+
 class CpSolution:
 
     def __init__(self, info: 'dict') -> None:
@@ -13,13 +18,13 @@ class CpSolution:
         self.__result = {}
 
 
-        solutions = info['solutions']
         statistics = info['statistics']
+        has_solutions = info['solution'] is not None
 
-        if len(solutions) != 0:
+        if has_solutions:
             self.parse_statistics(statistics)
-            self.parse_solutions(solutions)
-        status = self.get_status(info['states'], len(solutions) > 0, int(self.__solve_time) >= 299000)
+            self.parse_solutions(info['solution'], info['n_solutions'], info['history'])
+        status = self.get_status(info['states'], has_solutions, int(self.__solve_time) >= 299000)
         if status == 'OPTIMAL_SOLUTION':
             self.__found_optimal_solution = True
         if status == 'UNKNOWN':
@@ -32,7 +37,12 @@ class CpSolution:
         self.__result['time'] = self.__solve_time
         self.__result['optimal'] = self.__found_optimal_solution
         self.__result['obj'] = self.__last_solution['max_distance']
-        self.__result['sol'] = self.__last_solution['courier_route']
+        self.__result['sol'] = route_lists(self.__last_solution['courier_route'])
+        if 'flatten_time' in info:
+            # the solve time above does not include it
+            self.__result['flatten_time'] = info['flatten_time']
+        if 'warm_start' in info:
+            self.__result['warm_start'] = info['warm_start']
 
 
     def get_status(self, states, has_solutions, has_timeouted):
@@ -60,10 +70,11 @@ class CpSolution:
                 self.__n_solutions = 0
                 self.__solve_time = 300
 
-    def parse_solutions(self, all_solutions: 'dict') -> None:
-        self.solutions = all_solutions
-        self.__last_solution = self.solutions[-1]
-        self.__n_solutions = len(self.solutions)
+    def parse_solutions(self, last_solution: 'dict', n_solutions: 'int', history: 'list') -> None:
+        # history: the solutions kept before the last one, oldest first
+        self.solutions = history + [last_solution]
+        self.__last_solution = last_solution
+        self.__n_solutions = n_solutions
 
     def get_result(self) -> dict:
         return self.__result
@@ -0,0 +1,222 @@
+import time
+import numpy as np
+
+from models.Abstract_model import Abstract_model
+from instance import Instance
+
+
+class Heuristic_model(Abstract_model):
+
+    def __init__(self, lib: 'str', instance: 'Instance', seed: 'int' = 0):
+        super().__init__(lib, instance)
+        self.__distances = np.asarray(instance.distances, dtype=np.int64)
+        self.__size = np.asarray(instance.size, dtype=np.int64)
+        self.__capacity = np.asarray(instance.max_load, dtype=np.int64)
+        self.__o = instance.n
+        self.__rng = np.random.default_rng(seed)
+        self._end_time = time.time()
+
+    def route_length(self, route: 'list') -> 'int':
+        if len(route) == 0:
+            return 0
+        d = self.__distances
+        nodes = np.array([self.__o] + route + [self.__o])
+        return int(np.sum(d[nodes[:-1], nodes[1:]]))
+
+    def __insertion_costs(self, route: 'list', item: 'int') -> 'np.ndarray':
+        # extra length of the route when the item is inserted before each of its positions
+        d = self.__distances
+        nodes = np.array([self.__o] + route + [self.__o])
+        return d[nodes[:-1], item] + d[item, nodes[1:]] - d[nodes[:-1], nodes[1:]]
+
+    def __insert(self, routes: 'list', lengths: 'np.ndarray', loads: 'np.ndarray', order,
+                 blink: 'float' = 0) -> 'bool':
+        # cheapest feasible insertion of the items, in the given order; every courier but the
+        # last feasible one is skipped with probability blink to diversify the recreated solutions
+        for position, item in enumerate(order):
+            items_left = len(order) - position
+            counts = np.array([len(r) for r in routes])
+            deficit = np.maximum(self._instance.min_packs - counts, 0)
+            feasible = (loads + self.__size[item] <= self.__capacity) & (counts < self._instance.max_packs)
+            # once the items left are just enough to reach min_packs everywhere, only the couriers short of it can take them
+            if np.sum(deficit) >= items_left:
+                feasible &= deficit > 0
+            if not np.any(feasible):
+                return False
+
+            best = None
+            candidates = np.flatnonzero(feasible)
+            for c, k in enumerate(candidates):
+                if c < len(candidates) - 1 and self.__rng.random() < blink:
+                    continue
+                costs = self.__insertion_costs(routes[k], item)
+                p = int(np.argmin(costs))
+                new_length = lengths[k] + costs[p]
+                if best is None or new_length < best[0]:
+                    best = (new_length, k, p)
+            new_length, k, p = best
+            routes[k].insert(p, int(item))
+            lengths[k] = new_length
+            loads[k] += self.__size[item]
+        return True
+
+    def __initial_solution(self, deadline: 'float') -> 'list|None':
+        # biggest items first, then random orders until a capacity-feasible assignment is found
+        order = np.argsort(-self.__size, kind='stable')
+        while time.time() < deadline:
+            m = self._instance.m
+            routes = [[] for _ in range(m)]
+            if self.__insert(routes, np.zeros(m, dtype=np.int64), np.zeros(m, dtype=np.int64), order):
+                return routes
+            order = self.__rng.permutation(self._instance.n)
+        return None
+
+    def __relocate(self, routes, lengths, loads) -> 'bool':
+        a = int(np.argmax(lengths))
+        if len(routes[a]) <= self._instance.min_packs:
+            return False
+        d = self.__distances
+        current = (lengths.max(), lengths.sum())
+        nodes = [self.__o] + routes[a] + [self.__o]
+        for p in range(1, len(nodes) - 1):
+            x = nodes[p]
+            removal = d[nodes[p - 1], nodes[p + 1]] - d[nodes[p - 1], x] - d[x, nodes[p + 1]]
+            for b in range(len(routes)):
+                if b == a or len(routes[b]) >= self._instance.max_packs \
+                        or loads[b] + self.__size[x] > self.__capacity[b]:
+                    continue
+                costs = self.__insertion_costs(routes[b], x)
+                q = int(np.argmin(costs))
+                new_lengths = lengths.copy()
+                new_lengths[a] += removal
+                new_lengths[b] += costs[q]
+                if (new_lengths.max(), new_lengths.sum()) < current:
+                    routes[a].pop(p - 1)
+                    routes[b].insert(q, x)
+                    lengths[:] = new_lengths
+                    loads[a] -= self.__size[x]
+                    loads[b] += self.__size[x]
+                    return True
+        return False
+
+    def __swap(self, routes, lengths, loads) -> 'bool':
+        a = int(np.argmax(lengths))
+        d = self.__distances
+        current = (lengths.max(), lengths.sum())
+        nodes_a = np.array([self.__o] + routes[a] + [self.__o])
+        for p in range(1, len(nodes_a) - 1):
+            x = nodes_a[p]
+            pa, na = nodes_a[p - 1], nodes_a[p + 1]
+            for b in range(len(routes)):
+                if b == a or len(routes[b]) == 0:
+                    continue
+                nodes_b = np.array([self.__o] + routes[b] + [self.__o])
+                ys = nodes_b[1:-1]
+                pb, nb = nodes_b[:-2], nodes_b[2:]
+                # every item y of route b against x, all at once
+                delta_a = d[pa, ys] + d[ys, na] - d[pa, x] - d[x, na]
+                delta_b = d[pb, x] + d[x, nb] - d[pb, ys] - d[ys, nb]
+                feasible = (loads[a] - self.__size[x] + self.__size[ys] <= self.__capacity[a]) & \
+                           (loads[b] - self.__size[ys] + self.__size[x] <= self.__capacity[b])
+                new_a = lengths[a] + delta_a
+                new_b = lengths[b] + delta_b
+                others = np.delete(lengths, [a, b])
+                others_max = others.max() if len(others) > 0 else 0
+                new_max = np.maximum(np.maximum(new_a, new_b), others_max)
+                new_sum = lengths.sum() + delta_a + delta_b
+                better = feasible & ((new_max < current[0]) | ((new_max == current[0]) & (new_sum < current[1])))
+                if np.any(better):
+                    q = int(np.flatnonzero(better)[np.argmin(new_max[better])])
+                    y = int(ys[q])
+                    routes[a][p - 1] = y
+                    routes[b][q] = int(x)
+                    lengths[a] = new_a[q]
+                    lengths[b] = new_b[q]
+                    loads[a] += self.__size[y] - self.__size[x]
+                    loads[b] += self.__size[x] - self.__size[y]
+                    return True
+        return False
+
+    def __two_opt(self, routes, lengths) -> 'bool':
+        # reverses the best segment of every route, the distances are not assumed to be symmetric
+        d = self.__distances
+        improved = False
+        for k in range(len(routes)):
+            if len(routes[k]) < 2:
+                continue
+            nodes = np.array([self.__o] + routes[k] + [self.__o])
+            forward = np.concatenate(([0], np.cumsum(d[nodes[:-1], nodes[1:]])))
+            backward = np.concatenate(([0], np.cumsum(d[nodes[1:], nodes[:-1]])))
+            i, j = np.triu_indices(len(nodes) - 1, k=1)
+            valid = (i >= 1) & (j <= len(nodes) - 2)
+            i, j = i[valid], j[valid]
+            # segment nodes[i..j] is reversed: the arcs inside it change direction
+            delta = d[nodes[i - 1], nodes[j]] + d[nodes[i], nodes[j + 1]] \
+                - d[nodes[i - 1], nodes[i]] - d[nodes[j], nodes[j + 1]] \
+                + (backward[j] - backward[i]) - (forward[j] - forward[i])
+            if len(delta) == 0:
+                continue
+            best = int(np.argmin(delta))
+            if delta[best] < 0:
+                s, e = i[best] - 1, j[best]
+                routes[k][s:e] = routes[k][s:e][::-1]
+                lengths[k] += delta[best]
+                improved = True
+        return improved
+
+    def __local_search(self, routes, deadline):
+        lengths = np.array([self.route_length(r) for r in routes], dtype=np.int64)
+        loads = np.array([int(np.sum(self.__size[r])) for r in routes], dtype=np.int64)
+        while time.time() < deadline:
+            if self.__two_opt(routes, lengths):
+                continue
+            if self.__relocate(routes, lengths, loads):
+                continue
+            if not self.__swap(routes, lengths, loads):
+                break
+        return routes, lengths, loads
+
+    def __ruin_and_recreate(self, routes: 'list', items: 'int') -> 'list|None':
+        # removes some random items and inserts them back in a random order
+        removed = self.__rng.choice(self._instance.n, size=items, replace=False)
+        routes = [[i for i in r if i not in removed] for r in routes]
+        lengths = np.array([self.route_length(r) for r in routes], dtype=np.int64)
+        loads = np.array([int(np.sum(self.__size[r])) for r in routes], dtype=np.int64)
+        if not self.__insert(routes, lengths, loads, removed, blink=0.1):
+            return None
+        return routes
+
+    def solve(self, processes: 'int' = 1, timeout: 'int' = 10) -> None:
+        deadline = self._start_time + timeout
+        routes = self.__initial_solution(deadline)
+        self._result['optimal'] = False
+        self._result['obj'] = None
+        self._result['sol'] = None
+
+        if routes is not None:
+            routes, lengths, loads = self.__local_search(routes, deadline)
+            best_obj, best_routes = int(lengths.max()), [list(r) for r in routes]
+            # iterated local search until the time is over or min_path is reached: the walk goes on from
+            # every repaired solution and comes back to the best one after `restart` fruitless iterations
+            restart = 50
+            stall = 0
+            max_removed = min(self._instance.n, max(8, self._instance.n // 5))
+            while time.time() < deadline and best_obj > self._instance.min_path and self._instance.m > 1:
+                if stall % restart == 0:
+                    routes = [list(r) for r in best_routes]
+                stall += 1
+                recreated = self.__ruin_and_recreate(routes, int(self.__rng.integers(2, max_removed + 1)))
+                if recreated is None:
+                    continue
+                routes, lengths, _ = self.__local_search(recreated, deadline)
+                if int(lengths.max()) < best_obj:
+                    best_obj, best_routes = int(lengths.max()), [list(r) for r in routes]
+                    stall = 0
+
+            self._result['optimal'] = best_obj == self._instance.min_path
+            self._result['obj'] = best_obj
+            self._result['sol'] = [[i + 1 for i in route] for route in best_routes]
+
+        self._end_time = time.time()
+        self._inst_time = self._end_time - self._start_time
+        self._result['time'] = round(self._inst_time, 3)
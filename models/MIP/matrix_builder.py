@@ -0,0 +1,249 @@
+import numpy as np
+import mip
+import pulp
+from ortools.linear_solver import linear_solver_pb2
+
+from instance import Instance
+
+
+class Columns:
+    # the variables of a library indexed as a family of columns of the matrix, e.g. table[k, i, j]
+    def __init__(self, variables: 'list', indexes: 'np.ndarray') -> None:
+        self.__variables = variables
+        self.__indexes = indexes
+
+    def __getitem__(self, key):
+        return self.__variables[self.__indexes[key]]
+
+    def __len__(self) -> 'int':
+        return self.__indexes.size
+
+
+def varints(values: 'np.ndarray') -> 'tuple[np.ndarray, np.ndarray]':
+    # protobuf varint encoding of non-negative integers: the bytes of all of them one after the other,
+    # and how many bytes each one takes
+    values = np.asarray(values, dtype=np.int64)
+    lengths = np.ones(values.size, dtype=np.int64)
+    shifted = values >> 7
+    while np.any(shifted):
+        lengths += shifted > 0
+        shifted >>= 7
+    owner = np.repeat(np.arange(values.size), lengths)
+    position = np.arange(owner.size) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    stream = ((values[owner] >> (7 * position)) & 0x7f).astype(np.uint8)
+    stream[position < lengths[owner] - 1] |= 0x80
+    return stream, lengths
+
+
+def place(buffer: 'np.ndarray', stream: 'np.ndarray', lengths: 'np.ndarray', starts: 'np.ndarray') -> None:
+    # copies the consecutive chunks of stream, of the given lengths, to the given starts of buffer
+    offsets = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+    buffer[offsets + np.arange(stream.size)] = stream
+
+
+class Matrix_builder:
+    # the model of the MIP classes as arrays, built with numpy instead of one expression per constraint:
+    # every variable is a column with its bounds, every constraint a row with its lower and upper bound
+    # (-inf and inf when it has none), the coefficients are collected as COO triples and stored as CSR
+
+    def __init__(self, instance: 'Instance') -> None:
+        self.instance = instance
+        m, o = instance.m, instance.origin
+        n = o - 1
+
+        # columns: table[k, i, j], courier_distance[k], u[k, i] and obj
+        self.table = np.arange(m * o * o).reshape(m, o, o)
+        self.courier_distance = self.table.size + np.arange(m)
+        self.u = self.courier_distance[-1] + 1 + np.arange(m * o).reshape(m, o)
+        self.obj = int(self.u[-1, -1]) + 1
+        self.n_columns = self.obj + 1
+        self.lower = np.zeros(self.n_columns)
+        self.upper = np.ones(self.n_columns)
+        # a courier can't move to the same item
+        self.upper[self.table[:, np.arange(o), np.arange(o)]] = 0
+        self.upper[self.courier_distance] = instance.max_path
+        self.lower[self.u] = 1
+        self.upper[self.u] = o
+        self.lower[self.obj] = instance.min_path
+        self.upper[self.obj] = instance.max_path
+        self.objective = np.zeros(self.n_columns)
+        self.objective[self.obj] = 1
+
+        self.__rows, self.__cols, self.__data = [], [], []
+        self.__row_lower, self.__row_upper = [], []
+        self.n_rows = 0
+
+        distances = np.asarray(instance.distances, dtype=float)
+        size = np.asarray(instance.size, dtype=float)
+        # others[i]: the nodes other than i
+        others = np.nonzero(~np.eye(o, dtype=bool))[1].reshape(o, o - 1)
+        nodes = np.arange(o)[:, None]
+
+        # courier_distance[k] is the length of its route, obj the longest one
+        arcs = ~np.eye(o, dtype=bool)
+        self.__add(np.concatenate([self.courier_distance[:, None], self.table[:, arcs]], axis=1),
+                   np.concatenate([[1], -distances[arcs]]), 0, 0)
+        self.__add(np.stack([np.full(m, self.obj), self.courier_distance], axis=1), [1, -1], 0, np.inf)
+
+        # If an item is reached, it is also left by the same courier
+        self.__add(np.concatenate([self.table[:, nodes, others], self.table[:, others, nodes]], axis=2).reshape(m * o, -1),
+                   np.concatenate([np.ones(o - 1), -np.ones(o - 1)]), 0, 0)
+        # Every item is delivered
+        self.__add(self.table[:, others[:n], np.arange(n)[:, None]].transpose(1, 0, 2).reshape(n, -1), 1, 1, 1)
+        # Couriers start at the origin and end at the origin
+        self.__add(self.table[:, n, :n], 1, 1, 1)
+        self.__add(self.table[:, :n, n], 1, 1, 1)
+
+        # Each courier can carry at most max_load, and delivers between min_packs and max_packs items
+        delivered = arcs[:, :n]
+        self.__add(self.table[:, :, :n][:, delivered], np.broadcast_to(size, (o, n))[delivered],
+                   -np.inf, np.asarray(instance.max_load, dtype=float))
+        self.__add(self.table[:, :, :n][:, delivered], 1, instance.min_packs, instance.max_packs)
+
+        # If a courier goes for i to j then it cannot go from j to i, except for the origin
+        i, j = np.triu_indices(n, 1)
+        self.__add(np.stack([self.table[:, i, j], self.table[:, j, i]], axis=2).reshape(-1, 2), 1, -np.inf, 1)
+        # Sub-tour elimination: u[k, j] - u[k, i] - o * table[k, i, j] >= 1 - o
+        i, j = np.nonzero(~np.eye(n, dtype=bool))
+        self.__add(np.stack([self.u[:, j], self.u[:, i], self.table[:, i, j]], axis=2).reshape(-1, 3),
+                   [1, -1, -o], 1 - o, np.inf)
+
+        self.__to_csr()
+
+    def __add(self, columns: 'np.ndarray', coefficients, lower, upper) -> None:
+        # a block of rows with the same number of terms: columns[r] are the columns of row r,
+        # coefficients, lower and upper are broadcast to their shapes
+        columns = np.asarray(columns).reshape(-1, np.asarray(columns).shape[-1])
+        rows = len(columns)
+        self.__rows.append(np.broadcast_to(self.n_rows + np.arange(rows)[:, None], columns.shape).ravel())
+        self.__cols.append(columns.ravel())
+        self.__data.append(np.broadcast_to(np.asarray(coefficients, dtype=float), columns.shape).ravel())
+        self.__row_lower.append(np.broadcast_to(np.asarray(lower, dtype=float), rows))
+        self.__row_upper.append(np.broadcast_to(np.asarray(upper, dtype=float), rows))
+        self.n_rows += rows
+
+    def __to_csr(self) -> None:
+        rows = np.concatenate(self.__rows)
+        cols = np.concatenate(self.__cols)
+        data = np.concatenate(self.__data)
+        nonzero = data != 0
+        rows, cols, data = rows[nonzero], cols[nonzero], data[nonzero]
+        # the blocks are added in row order, the order inside a row does not matter
+        order = np.argsort(rows, kind='stable')
+        self.indices = cols[order]
+        self.data = data[order]
+        self.indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=self.n_rows))])
+        self.row_lower = np.concatenate(self.__row_lower)
+        self.row_upper = np.concatenate(self.__row_upper)
+        self.__rows = self.__cols = self.__data = self.__row_lower = self.__row_upper = None
+
+    def names(self) -> 'list[str]':
+        m, o = self.instance.m, self.instance.origin
+        return ([f'table_{k}_{i}_{j}' for k in range(m) for i in range(o) for j in range(o)] +
+                [f'courier_distance_{k}' for k in range(m)] +
+                [f'u_{k}_{i}' for k in range(m) for i in range(o)] + ['obj'])
+
+    def row(self, r: 'int') -> 'tuple[np.ndarray, np.ndarray]':
+        return self.indices[self.indptr[r]:self.indptr[r + 1]], self.data[self.indptr[r]:self.indptr[r + 1]]
+
+    def __senses(self):
+        # every row as (r, sense, rhs) with sense '<', '>' or '=', ranged rows are split in two
+        for r in range(self.n_rows):
+            lower, upper = self.row_lower[r], self.row_upper[r]
+            if lower == upper:
+                yield r, '=', lower
+                continue
+            if lower > -np.inf:
+                yield r, '>', lower
+            if upper < np.inf:
+                yield r, '<', upper
+
+    def load_mip(self, model: 'mip.Model') -> 'list':
+        # python-mip has no matrix interface: every row goes in as a LinExpr built from its arrays
+        variables = [model.add_var(name=name, lb=lower, ub=upper, var_type=mip.INTEGER)
+                     for name, lower, upper in zip(self.names(), self.lower, self.upper)]
+        for r, sense, rhs in self.__senses():
+            columns, coefficients = self.row(r)
+            model.add_constr(mip.LinExpr([variables[c] for c in columns], coefficients.tolist(), -rhs, sense))
+        model.objective = mip.minimize(variables[self.obj])
+        return variables
+
+    def __variables_proto(self) -> 'bytes':
+        # the variable field (3) of an MPModelProto in wire format: lower_bound (1), upper_bound (2),
+        # objective_coefficient (3), is_integer (4) and name (5) of every column
+        names = self.names()
+        text = np.frombuffer(''.join(names).encode(), dtype=np.uint8)
+        text_lengths = np.array([len(name) for name in names], dtype=np.int64)
+        text_headers, text_header_lengths = varints(text_lengths)
+        sizes = 9 * 3 + 2 + 1 + text_header_lengths + text_lengths
+        headers, header_lengths = varints(sizes)
+        starts = np.cumsum(1 + header_lengths + sizes) - (1 + header_lengths + sizes)
+        buffer = np.empty(int(np.sum(1 + header_lengths + sizes)), dtype=np.uint8)
+
+        buffer[starts] = 0x1a
+        place(buffer, headers, header_lengths, starts + 1)
+        p = starts + 1 + header_lengths
+        for tag, values in [(0x09, self.lower), (0x11, self.upper), (0x19, self.objective)]:
+            buffer[p] = tag
+            place(buffer, values.astype('<f8').view(np.uint8), np.full(self.n_columns, 8), p + 1)
+            p = p + 9
+        buffer[p], buffer[p + 1] = 0x20, 1
+        buffer[p + 2] = 0x2a
+        place(buffer, text_headers, text_header_lengths, p + 3)
+        place(buffer, text, text_lengths, p + 3 + text_header_lengths)
+        return buffer.tobytes()
+
+    def __constraints_proto(self) -> 'bytes':
+        # the constraint field (4) of an MPModelProto in wire format: lower_bound (2), upper_bound (3),
+        # and the packed var_index (6) and coefficient (7) of every row, encoded from the CSR arrays at once
+        indices, index_lengths = varints(self.indices)
+        cumulative = np.concatenate([[0], np.cumsum(index_lengths)])
+        index_bytes = cumulative[self.indptr[1:]] - cumulative[self.indptr[:-1]]
+        coefficient_bytes = 8 * np.diff(self.indptr)
+        index_headers, index_header_lengths = varints(index_bytes)
+        coefficient_headers, coefficient_header_lengths = varints(coefficient_bytes)
+        sizes = (9 * 2 + 1 + index_header_lengths + index_bytes + 1 + coefficient_header_lengths +
+                 coefficient_bytes)
+        headers, header_lengths = varints(sizes)
+        starts = np.cumsum(1 + header_lengths + sizes) - (1 + header_lengths + sizes)
+        buffer = np.empty(int(np.sum(1 + header_lengths + sizes)), dtype=np.uint8)
+
+        buffer[starts] = 0x22
+        place(buffer, headers, header_lengths, starts + 1)
+        p = starts + 1 + header_lengths
+        for tag, values in [(0x11, self.row_lower), (0x19, self.row_upper)]:
+            buffer[p] = tag
+            place(buffer, values.astype('<f8').view(np.uint8), np.full(self.n_rows, 8), p + 1)
+            p = p + 9
+        buffer[p] = 0x32
+        place(buffer, index_headers, index_header_lengths, p + 1)
+        p = p + 1 + index_header_lengths
+        place(buffer, indices, index_bytes, p)
+        p = p + index_bytes
+        buffer[p] = 0x3a
+        place(buffer, coefficient_headers, coefficient_header_lengths, p + 1)
+        p = p + 1 + coefficient_header_lengths
+        place(buffer, self.data.astype('<f8').view(np.uint8), coefficient_bytes, p)
+        return buffer.tobytes()
+
+    def load_ortools(self, solver) -> 'list':
+        # one MPModelProto, loaded at once into an empty pywraplp.Solver; protobuf has no columnar
+        # fields, every variable and row is a message of its own, so they are encoded with numpy and
+        # parsed in one call instead of being added one by one from python
+        proto = linear_solver_pb2.MPModelProto()
+        proto.MergeFromString(self.__variables_proto() + self.__constraints_proto())
+        error = solver.LoadModelFromProto(proto)
+        if error != '':
+            raise Exception(f"ortools could not load the model: {error}")
+        return solver.variables()
+
+    def load_pulp(self, problem: 'pulp.LpProblem') -> 'list':
+        variables = [pulp.LpVariable(name, lowBound=lower, upBound=upper, cat=pulp.LpInteger)
+                     for name, lower, upper in zip(self.names(), self.lower, self.upper)]
+        senses = {'<': pulp.LpConstraintLE, '>': pulp.LpConstraintGE, '=': pulp.LpConstraintEQ}
+        for r, sense, rhs in self.__senses():
+            columns, coefficients = self.row(r)
+            expression = pulp.LpAffineExpression(zip([variables[c] for c in columns], coefficients.tolist()))
+            problem.addConstraint(pulp.LpConstraint(expression, senses[sense], rhs=rhs), f'row_{r}_{sense == ">"}')
+        problem.setObjective(variables[self.obj])
+        return variables
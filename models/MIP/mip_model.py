@@ -1,3 +1,6 @@
+import os
+import re
+import tempfile
 from os.path import join
 import mip
 from ortools.linear_solver import pywraplp
@@ -7,18 +10,34 @@ import multiprocessing
 import time
 
 from models.Abstract_model import Abstract_model
+from models.Heuristic.heuristic_model import Heuristic_model
+from models.MIP.matrix_builder import Matrix_builder, Columns
 from instance import Instance
 
 
 class Mip_model(Abstract_model):
-    def __init__(self, lib: 'str', i: 'Instance', param, h: 'bool' = False, verbose: 'bool' = False, solver_name='CBC'):
+    def __init__(self, lib: 'str', i: 'Instance', param, h: 'bool' = False, verbose: 'bool' = False, solver_name='CBC',
+                 builder: 'str' = 'python'):
+        # builder: 'python' adds the constraints one expression at a time, 'matrix' loads them from Matrix_builder
         super().__init__(lib, i)
         self._table = {}
         self.__param = param
         self.__h = h
+        self.__builder = builder
 
         # Create model
         self.__model = mip.Model(solver_name=solver_name)
+        if not verbose:
+            self.__model.verbose = 0
+
+        if builder == 'matrix':
+            matrix = Matrix_builder(self._instance)
+            variables = matrix.load_mip(self.__model)
+            self._table = Columns(variables, matrix.table)
+            self._u = Columns(variables, matrix.u)
+            self.__obj = variables[matrix.obj]
+            self._build_time = time.time() - self._start_time
+            return
 
         # Create variables
         self._table = {}
@@ -35,81 +54,40 @@ class Mip_model(Abstract_model):
             for i in range(self._instance.origin):
                 self._u[k, i] = self.__model.add_var(var_type=mip.INTEGER, lb=1, ub=self._instance.origin,
                                                      name=f'u_{k}_{i}')
-
-        if not verbose:
-            self.__model.verbose = 0
-
-    @staticmethod
-    def clark_wright_savings(distances: 'list', capacity: int):
-        # Calculate savings for all pairs of nodes
-        savings = []
-        for i in range(1, len(distances)):
-            for j in range(i + 1, len(distances)):
-                savings.append((i, j, distances[0][i] + distances[0][j] - distances[i][j]))
-
-        # Sort savings in descending order
-        savings.sort(key=lambda x: x[2], reverse=True)
-
-        # Initialize routes
-        routes = [[0] for _ in range(len(distances))]
-        used_capacity = [0] * len(distances)
-
-        # Greedily assign customers to routes
-        for i, j, s in savings:
-            route_i = None
-            route_j = None
-            for r in range(len(routes)):
-                if i in routes[r]:
-                    route_i = r
-                if j in routes[r]:
-                    route_j = r
-            if route_i is not None and route_j is not None and route_i != route_j:
-                if used_capacity[route_i] + used_capacity[route_j] + distances[i][j] <= capacity:
-                    routes[route_i].remove(i)
-                    routes[route_j].remove(j)
-                    routes[route_i] += [i, j]
-                    used_capacity[route_i] += distances[i][j]
-                    used_capacity[route_j] += distances[i][j]
-
-        return routes
+        self._build_time = time.time() - self._start_time
 
     def solve(self, processes:'int' = 1, timeout:'int' = 300) -> None:
-
-        # Objective
-        obj = self.__model.add_var(var_type=mip.INTEGER, name='obj')
-
-        for k in range(self._instance.m):
-            self.__model += self.__courier_distance[k] == mip.xsum(
-                self._instance.distances[i][j] * self._table[k, i, j] for i in range(self._instance.origin) for j in
-                range(self._instance.origin))
-
-        # Upper and lower bounds
-        self.__model += obj <= self._instance.max_path
-        self.__model += obj >= self._instance.min_path
-
-        for k in range(self._instance.m):
-            self.__model += obj >= self.__courier_distance[k]
-
-        self.__add_constraint()
-
-        # Set the objective
-        self.__model.objective = mip.minimize(obj)
+        if self.__builder == 'python':
+            build_start = time.time()
+            self.__build()
+            self._build_time += time.time() - build_start
+        obj = self.__obj
 
         # Parameters
         self.__model.cuts = self.__param  # Enable Gomory cuts
         self.__model.threads = processes
 
-        if self.__h:
-            # Call the Clark and Wright Savings Algorithm
-            initial_routes = self.clark_wright_savings(self._instance.distances, self._instance.max_load[0])
-
-            # Initialize routes using Clark and Wright Savings Algorithm
-            for k, route in enumerate(initial_routes):
-                for i, j in zip(route, route[1:]):
-                    self._table[k, i, j].start = 1
-
-            print('Using warm start CWS: Initial solution found in {} seconds'.format(time.time() - self._start_time))
-
+        if self.__h and self._incumbent is None:
+            # Warm start from a short run of the heuristic
+            heuristic = Heuristic_model('heuristic', self._instance)
+            heuristic.solve(timeout=max(1, int(timeout) // 10))
+            if heuristic.get_result()['sol'] is not None:
+                self.set_incumbent(heuristic.get_result()['sol'], heuristic.get_result()['time'])
+
+        if self._incumbent is not None:
+            table, positions = self._incumbent_values()
+            start = [(self._table[key], value) for key, value in table.items()]
+            start += [(self._u[key], value) for key, value in positions.items()]
+            start.append((obj, self.incumbent_objective()))
+            self.__model.start = start
+            # the bounds over time of CBC tell when it had its first solution
+            self.__model.store_search_progress_log = True
+
+        if self._shared is not None:
+            # solutions not better than the best one of the race are cut off
+            self.__model.cutoff = self._shared.value() - 1
+
+        solve_start = time.time()
         self._status = self.__model.optimize(max_seconds=int(timeout))
         self._end_time = time.time()
         self._inst_time = self._end_time - self._start_time
@@ -125,6 +103,40 @@ class Mip_model(Abstract_model):
             self._result['optimal'] = self._status == mip.OptimizationStatus.OPTIMAL
             self._result['obj'] = None
             self._result['sol'] = None
+        self._result['build_time'] = round(self._build_time, 3)
+
+        if self._incumbent is not None:
+            self._report_warm_start(self.__first_solution_time(solve_start))
+        self._share_result(self._status in (mip.OptimizationStatus.OPTIMAL, mip.OptimizationStatus.INFEASIBLE))
+
+    def __first_solution_time(self, solve_start: 'float') -> 'float|None':
+        # seconds from the creation of the model to the first upper bound in the search log,
+        # None if the solver does not keep the log or found nothing
+        for seconds, (lower, upper) in self.__model.search_progress_log.log:
+            if upper <= self._instance.max_path:
+                return solve_start - self._start_time + seconds
+        return None
+
+    def __build(self) -> None:
+        # Objective
+        self.__obj = self.__model.add_var(var_type=mip.INTEGER, name='obj')
+
+        for k in range(self._instance.m):
+            self.__model += self.__courier_distance[k] == mip.xsum(
+                self._instance.distances[i][j] * self._table[k, i, j] for i in range(self._instance.origin) for j in
+                range(self._instance.origin))
+
+        # Upper and lower bounds
+        self.__model += self.__obj <= self._instance.max_path
+        self.__model += self.__obj >= self._instance.min_path
+
+        for k in range(self._instance.m):
+            self.__model += self.__obj >= self.__courier_distance[k]
+
+        self.__add_constraint()
+
+        # Set the objective
+        self.__model.objective = mip.minimize(self.__obj)
 
     def __add_constraint(self) -> None:
 
@@ -185,13 +197,24 @@ class Mip_model(Abstract_model):
 
 class Or_model(Abstract_model):
 
-    def __init__(self, lib: 'str', instance: 'Instance', solver_name: 'str' = 'CBC_MIXED_INTEGER_PROGRAMMING'):
+    def __init__(self, lib: 'str', instance: 'Instance', solver_name: 'str' = 'CBC_MIXED_INTEGER_PROGRAMMING',
+                 builder: 'str' = 'python'):
         super().__init__(lib, instance)
         self._table = {}
 
         # Create solver
         self.__solver = pywraplp.Solver.CreateSolver(solver_name)
 
+        if builder == 'matrix':
+            matrix = Matrix_builder(self._instance)
+            variables = matrix.load_ortools(self.__solver)
+            self._table = Columns(variables, matrix.table)
+            self._u = Columns(variables, matrix.u)
+            self.obj = variables[matrix.obj]
+            self._end_time = time.time()
+            self._build_time = self._end_time - self._start_time
+            return
+
         for k in range(self._instance.m):
             for i in range(self._instance.origin):
                 for j in range(self._instance.origin):
@@ -229,6 +252,7 @@ class Or_model(Abstract_model):
         self.__solver.Minimize(self.obj)
 
         self._end_time = time.time()
+        self._build_time = self._end_time - self._start_time
 
     def solve(self, processes: 'int' = 1, timeout: 'int' = 300) -> None:
         self.__solver.SetNumThreads(processes)
@@ -243,6 +267,18 @@ class Or_model(Abstract_model):
         # IT IS NECESSARY TO HANDLE THE ABSENCE OF THE RETURN
         self.__solver.SetTimeLimit(int(timeout) * 1000)
 
+        if self._incumbent is not None:
+            # pywraplp tells neither whether the backend used the hint nor when it had its first solution,
+            # so these results carry no warm_start field
+            table, positions = self._incumbent_values()
+            variables = [self._table[key] for key in table] + [self._u[key] for key in positions] + [self.obj]
+            values = list(table.values()) + list(positions.values()) + [self.incumbent_objective()]
+            self.__solver.SetHint(variables, values)
+
+        if self._shared is not None:
+            # solutions not better than the best one of the race are cut off
+            self.__solver.Add(self.obj <= self._shared.value() - 1)
+
         # Solve the model
         status = self.__solver.Solve()
         self._end_time = time.time()
@@ -260,6 +296,9 @@ class Or_model(Abstract_model):
             self._result['optimal'] = status == pywraplp.Solver.OPTIMAL
             self._result['obj'] = None
             self._result['sol'] = None
+        self._result['build_time'] = round(self._build_time, 3)
+
+        self._share_result(status in (pywraplp.Solver.OPTIMAL, pywraplp.Solver.INFEASIBLE))
 
     def add_constraint(self) -> None:
 
@@ -294,7 +333,7 @@ class Or_model(Abstract_model):
             self.__solver.Add(self.__solver.Sum(self._table[k, i, j] for i in range(self._instance.origin) for j in
                                                 range(self._instance.origin - 1)) >= self._instance.min_packs)
             self.__solver.Add(self.__solver.Sum(self._table[k, i, j] for i in range(self._instance.origin) for j in
-                                                range(self._instance.origin - 1)) <= self._instance.max_path)
+                                                range(self._instance.origin - 1)) <= self._instance.max_packs)
 
         # If a courier goes for i to j then it cannot go from j to i, except for the origin
         # (this constraint it is not necessary for the model to work, but check if it improves the solution)
@@ -322,9 +361,12 @@ class Or_model(Abstract_model):
 
 class Pulp_model(Abstract_model):
 
-    def __init__(self, lib: 'str', instance: 'Instance', solver_name: 'str' = 'CBC', timeout: int = 300):
+    def __init__(self, lib: 'str', instance: 'Instance', solver_name: 'str' = 'CBC', timeout: int = 300,
+                 builder: 'str' = 'python'):
         super().__init__(lib, instance)
+        self.__builder = builder
 
+        self.__timeout = int(timeout)
         if solver_name == 'CBC':
             self._solver = pulp.PULP_CBC_CMD(msg=False, timeLimit=int(timeout))
         else:
@@ -333,6 +375,15 @@ class Pulp_model(Abstract_model):
         # Create model
         self.__model = pulp.LpProblem("CourierProblem", pulp.LpMinimize)
         self._inst_time = 0
+        if builder == 'matrix':
+            matrix = Matrix_builder(self._instance)
+            variables = matrix.load_pulp(self.__model)
+            self._table = Columns(variables, matrix.table)
+            self._u = Columns(variables, matrix.u)
+            self.__obj = variables[matrix.obj]
+            self._build_time = time.time() - self._start_time
+            return
+
         # Create variables
         self._table = pulp.LpVariable.dicts("table",
                                             ((k, i, j) for k in range(instance.m) for i in range(instance.origin) for j
@@ -348,10 +399,11 @@ class Pulp_model(Abstract_model):
             for i in range(self._instance.origin):
                 self._u[k, i] = pulp.LpVariable(f'u_{k}_{i}', lowBound=1, upBound=self._instance.origin,
                                                 cat=pulp.LpInteger)
+        self._build_time = time.time() - self._start_time
 
-    def solve(self, processes: int = 1, timeout: int = 300) -> None:
+    def __build(self) -> None:
         # Objective
-        obj = pulp.LpVariable('obj', cat=pulp.LpInteger)
+        self.__obj = pulp.LpVariable('obj', cat=pulp.LpInteger)
 
         for k in range(self._instance.m):
             self.__model += self.__courier_distance[k] == pulp.lpSum(
@@ -359,18 +411,24 @@ class Pulp_model(Abstract_model):
                 range(self._instance.origin))
 
         # Upper and lower bounds
-        self.__model += obj <= self._instance.max_path
-        self.__model += obj >= self._instance.min_path
+        self.__model += self.__obj <= self._instance.max_path
+        self.__model += self.__obj >= self._instance.min_path
 
         for k in range(self._instance.m):
-            self.__model += obj >= self.__courier_distance[k]
+            self.__model += self.__obj >= self.__courier_distance[k]
 
         # Constraints
         self.add_constraint()
 
         # Set the objective
-        self.__model += obj
+        self.__model += self.__obj
 
+    def solve(self, processes: int = 1, timeout: int = 300) -> None:
+        if self.__builder == 'python':
+            build_start = time.time()
+            self.__build()
+            self._build_time += time.time() - build_start
+        obj = self.__obj
 
         if self._inst_time >= timeout:
             self._result['time'] = round(self._inst_time, 3)
@@ -378,24 +436,63 @@ class Pulp_model(Abstract_model):
             self._result['obj'] = None
             self._result['sol'] = None
 
+        log_path = None
+        if self._incumbent is not None:
+            table, positions = self._incumbent_values()
+            for key, value in table.items():
+                self._table[key].setInitialValue(value)
+            for key, value in positions.items():
+                self._u[key].setInitialValue(value)
+            obj.setInitialValue(self.incumbent_objective())
+            # the log of CBC tells when it had its first solution
+            descriptor, log_path = tempfile.mkstemp(suffix='.log')
+            os.close(descriptor)
+            self._solver = pulp.PULP_CBC_CMD(msg=False, timeLimit=self.__timeout, warmStart=True, logPath=log_path)
+
+        if self._shared is not None:
+            # solutions not better than the best one of the race are cut off
+            self.__model += obj <= self._shared.value() - 1
+
         # Solve the problem
 
         self._status = self.__model.solve(self._solver)
         self._end_time = time.time()
         self._inst_time = self._end_time - self._start_time
 
+        # status is optimal also when CBC stops on the time limit with a feasible solution,
+        # only sol_status tells a proved optimum apart
+        solution_status = self.__model.sol_status
+
         # Output
-        if self._status == pulp.LpStatusOptimal or self._status == pulp.LpStatusNotSolved:
+        if solution_status == pulp.LpSolutionOptimal or solution_status == pulp.LpSolutionIntegerFeasible:
             self._result['time'] = round(self._inst_time, 3)
-            self._result['optimal'] = self._status == pulp.LpStatusOptimal
+            self._result['optimal'] = solution_status == pulp.LpSolutionOptimal
             self._result['obj'] = int(pulp.value(self.__model.objective))
             self._result['sol'] = self._get_solution()
 
         else:
+            # no solution, e.g. none found in time or none below the cutoff of the race
             self._result['time'] = round(self._inst_time, 3)
-            self._result['optimal'] = self._status == pulp.LpStatusOptimal
-            self._result['obj'] = pulp.value(self.__model.objective)
-            self._result['sol'] = self._get_solution()
+            self._result['optimal'] = False
+            self._result['obj'] = None
+            self._result['sol'] = None
+        self._result['build_time'] = round(self._build_time, 3)
+
+        if log_path is not None:
+            self._report_warm_start(self.__first_solution_time(log_path))
+            os.remove(log_path)
+        self._share_result(solution_status in (pulp.LpSolutionOptimal, pulp.LpSolutionInfeasible))
+
+    def __first_solution_time(self, log_path: 'str') -> 'float|None':
+        # seconds from the creation of the model to the first integer solution in the log of CBC,
+        # whose times count from the start of CBC: that is when the solve ended less the wallclock time of CBC
+        with open(log_path, 'r') as f:
+            log = f.read()
+        first = re.search(r'Cbc0012I Integer solution of \S+ found by .* \(([\d.]+) seconds\)', log)
+        total = re.search(r'Total time \(CPU seconds\):\s+[\d.]+\s+\(Wallclock seconds\):\s+([\d.]+)', log)
+        if first is None or total is None:
+            return None
+        return self._end_time - self._start_time - float(total.group(1)) + float(first.group(1))
 
     def add_constraint(self) -> None:
         for i in range(self._instance.origin):
@@ -427,7 +524,7 @@ class Pulp_model(Abstract_model):
             self.__model += pulp.lpSum(self._table[k, i, j] for i in range(self._instance.origin) for j in
                                        range(self._instance.origin - 1)) >= self._instance.min_packs
             self.__model += pulp.lpSum(self._table[k, i, j] for i in range(self._instance.origin) for j in
-                                       range(self._instance.origin - 1)) <= self._instance.max_path
+                                       range(self._instance.origin - 1)) <= self._instance.max_packs
 
         # If a courier goes for i to j then it cannot go from j to i, except for the origin
         # (this constraint it is not necessary for the model to work, but check if it improves the solution)
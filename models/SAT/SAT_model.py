@@ -1,10 +1,13 @@
-from z3 import Bool, And, Or, Not, Implies, sat, Solver
+from z3 import Bool, And, Or, Not, Implies, sat, unsat, Solver
 from instance import Instance
 from json_parser import Json_parser
 import numpy as np
-from models.SAT.Sat_utils import SatInteger, at_least_k, variable, exactly_one, at_most_k, SatSequences
+from models.SAT.Sat_utils import SatInteger, at_least_k, variable, exactly_one, at_most_k, SatSequences, pool
 
 from time import time
+import multiprocessing
+from multiprocessing.connection import wait
+import z3
 
 def flatten(e):
     if len(e) == 0:
@@ -19,10 +22,57 @@ def get_solution(sol:'list[list]') -> 'list[list]':
         m = max(path)
         new_sol.append(list(filter(lambda d: d < m, path)))
     return new_sol
+
+def probe_bound(text: 'str', bits: 'list[str]', bound: 'int', distances, m: 'int', n: 'int',
+                timeout: 'int', sender) -> None:
+    # runs in its own process on a copy of the model: is there a solution with max_distance <= bound?
+    # bits are the names of the bits of max_distance, the most significant first
+    ctx = z3.Context()
+    s = z3.Solver(ctx=ctx)
+    s.from_string(text)
+    values = [int(c) for c in bin(bound)[2:].zfill(len(bits))]
+    if len(values) > len(bits):
+        values = [1 for _ in bits]
+    literals = [z3.Bool(name, ctx) for name in bits]
+    # a 1 where the bound has a 0, with all the higher 1s of the bound set too, exceeds it
+    for p in range(len(bits)):
+        if values[p] == 0:
+            s.add(z3.Or([z3.Not(literals[p])] + [z3.Not(literals[q]) for q in range(p) if values[q] == 1]))
+    s.set("timeout", max(1, timeout))
+    result = s.check()
+    if result != z3.sat:
+        sender.send((bound, 'unsat' if result == z3.unsat else 'unknown', None, None))
+        return
+    model = s.model()
+    routes = []
+    for j in range(m):
+        route = []
+        current = n
+        while True:
+            current = next(k for k in range(n + 1) if k != current and z3.is_true(
+                model.eval(z3.Bool(f"courier_{j}_goes_from_{current}_to_{k}", ctx), model_completion=True)))
+            if current == n:
+                break
+            route.append(current)
+        routes.append(route)
+    obj = max(int(sum(distances[a][b] for a, b in zip([n] + r, r + [n]))) for r in routes)
+    sender.send((bound, 'sat', obj, [[i + 1 for i in r] for r in routes]))
+
+
 class Sat_model:
 
     def __init__(self) -> None:
         self.s = Solver()
+        self.__shared = None
+
+    def set_shared_bound(self, shared) -> None:
+        # scheduler.SharedBound of a race, the bisection never probes above its value
+        self.__shared = shared
+
+    def __bound(self, upper_bound):
+        if self.__shared is None:
+            return upper_bound
+        return min(upper_bound, self.__shared.value())
 
     @staticmethod
     def __buil_variables(_m, _n, _max_path_length, _s):
@@ -34,20 +84,18 @@ class Sat_model:
 
         
         for j in range(_m):
-            distances.append(SatInteger(0, "zero"))
-            loads.append(SatInteger(0, "zero"))
             for i in range(_n+1):
                 for k in range(_n+1):
                     courier_route[j,i,k] = Bool(f"courier_{j}_goes_from_{i}_to_{k}")
                 times[j,i] = SatSequences(_max_path_length)
-                _s.add(times[j,i].add())
+                pool.add(_s, 'sequence', times[j,i].add())
 
         return distances, loads, courier_route, times
 
     @staticmethod
     def __go_everywhere_once(s, n, courier_load):
         for i in range(n):
-            s.add(exactly_one(courier_load[:,i].tolist()))
+            pool.add(s, 'exactly_one', exactly_one(courier_load[:,i].tolist()))
     
     @staticmethod
     def __compute_max_distance(s, distances, min_path, max_path, m):
@@ -58,20 +106,20 @@ class Sat_model:
             variable_length= max_len, 
             variable_name="max_distance")
         
-        s.add(And([And(max_distance.add_geq(distances[j])) for j in range(m)]))
-        s.add(max_distance.add_geq_int(min_path))
-        s.push()
-        s.add(max_distance.add_leq_int(max_path))
+        pool.add(s, 'max_distance', And([And(max_distance.add_geq(distances[j])) for j in range(m)]))
+        pool.add(s, 'max_distance', max_distance.add_geq_int(min_path))
+        pool.add(s, 'max_distance', max_distance.add_leq_int(max_path))
 
         return max_distance
 
     @staticmethod
     def __build_base_model(s, min_path, max_path, max_load, size, distance_matrix, m, n, origin, max_path_length, min_packs, max_packs):
-        distances, \
-        loads, \
-        courier_route, \
-        times = \
-            Sat_model.__buil_variables(m, n, max_path_length, s)
+        with pool.timed('sequence'):
+            distances, \
+            loads, \
+            courier_route, \
+            times = \
+                Sat_model.__buil_variables(m, n, max_path_length, s)
                     
         courier_load = np.empty(shape=(m,n), dtype=object)
         
@@ -81,68 +129,82 @@ class Sat_model:
         
         origin_index = origin - 1
         
-        Sat_model.__go_everywhere_once(s, n, courier_load)
+        with pool.timed('exactly_one'):
+            Sat_model.__go_everywhere_once(s, n, courier_load)
         
         for j in range(m):
-            # # every courier has at least a package
-            s.add(at_least_k(courier_load[j,:].tolist(),k=min_packs))
-            s.add(at_most_k(courier_load[j,:].tolist(), k=max_packs))
-            # each courier start and ends at the origin
-            s.add(exactly_one(flatten(courier_route[j, origin_index, :origin_index].tolist())))
-            s.add(exactly_one(flatten(courier_route[j, :origin_index, origin_index].tolist())))
-            s.add(courier_route[j, origin_index, origin_index] == False)
+            with pool.timed('at_most_k'):
+                # # every courier has at least a package
+                pool.add(s, 'at_most_k', at_least_k(courier_load[j,:].tolist(),k=min_packs))
+                pool.add(s, 'at_most_k', at_most_k(courier_load[j,:].tolist(), k=max_packs))
+            with pool.timed('exactly_one'):
+                # each courier start and ends at the origin
+                pool.add(s, 'exactly_one', exactly_one(flatten(courier_route[j, origin_index, :origin_index].tolist())))
+                pool.add(s, 'exactly_one', exactly_one(flatten(courier_route[j, :origin_index, origin_index].tolist())))
+                pool.add(s, 'exactly_one', courier_route[j, origin_index, origin_index] == False)
 
             for i in range(n):
                  
                 j_at_i = courier_route[j, i, :].tolist()
             
-                # if a courier goes at position i, it does not stop there
-                s.add([
-                    exactly_one(j_at_i) == courier_load[j,i],
-                    exactly_one(courier_route[j, :, i].tolist()) == courier_load[j,i],
-                    times[j,i].is_zero == Not(Or(j_at_i)),
-                    times[j,i].is_zero == Not(Or(courier_route[j, :, i].tolist())),
-                ])
-
-                # add size of pack i to load of courier j if it brings that package
-                loads[j] = loads[j].add_int(size[i], courier_load[j,i])
-
-                for k in range(n):
-                    # do not go to i from k if we've already been at i
-                    s.add(Not(And(courier_route[j, i, k], courier_route[j, k, i])))
-                    # for each place i, if j goes to k, then, the moment at which j is at k is greater 
-                    # then the moment at which j is at i
-                    if i != k:
-                        s.add(Implies(
-                            courier_route[j, i, k], 
-                            And(times[j, k].next(times[j, i]))
-                        ))
+                with pool.timed('exactly_one'):
+                    # if a courier goes at position i, it does not stop there
+                    pool.add(s, 'exactly_one', [
+                        exactly_one(j_at_i) == courier_load[j,i],
+                        exactly_one(courier_route[j, :, i].tolist()) == courier_load[j,i],
+                        times[j,i].is_zero == Not(Or(j_at_i)),
+                        times[j,i].is_zero == Not(Or(courier_route[j, :, i].tolist())),
+                    ])
+
+                with pool.timed('sequence'):
+                    for k in range(n):
+                        # do not go to i from k if we've already been at i
+                        pool.add(s, 'route', Not(And(courier_route[j, i, k], courier_route[j, k, i])))
+                        # for each place i, if j goes to k, then, the moment at which j is at k is greater 
+                        # then the moment at which j is at i
+                        if i != k:
+                            pool.add(s, 'sequence', Implies(
+                                courier_route[j, i, k], 
+                                And(times[j, k].next(times[j, i]))
+                            ))
                 
                 # courier j do not stay at i 
-                s.add(courier_route[j,i,i] == False)
+                pool.add(s, 'route', courier_route[j,i,i] == False)
             
 
-            #compute distance for courier j
-            for i in range(origin):
-                for k in range(origin):
-                    if i != k:
-                        distances[j] = distances[j].add_int(distance_matrix[i,k], courier_route[j,i,k])        
-            s.add(distances[j].get_constraints())
-            s.add(loads[j].get_constraints())
-            s.add(loads[j].add_leq_int(max_load[j]))
+            with pool.timed('adder'):
+                # load of courier j: the sizes of the packs it brings
+                loads.append(SatInteger.weighted_sum([(size[i], courier_load[j,i]) for i in range(n)], f"load_{j}"))
+                #compute distance for courier j
+                distances.append(SatInteger.weighted_sum([(distance_matrix[i,k], courier_route[j,i,k])
+                                                          for i in range(origin) for k in range(origin) if i != k],
+                                                         f"distance_{j}"))
+                pool.add(s, 'adder', distances[j].get_constraints())
+                pool.add(s, 'adder', loads[j].get_constraints())
+            with pool.timed('comparison'):
+                pool.add(s, 'comparison', loads[j].add_leq_int(max_load[j]))
         
-        max_distance = Sat_model.__compute_max_distance(s, distances, min_path, max_path, m)
+        with pool.timed('max_distance'):
+            max_distance = Sat_model.__compute_max_distance(s, distances, min_path, max_path, m)
 
         return times, courier_route, loads, distances, max_load, max_distance
 
     
-    def __update_max_distance(self, s, upper_bound, max_distance):
-        s.pop()
-        s.push()
-        u = SatInteger(upper_bound)
-        s.add(u.get_constraints())
-        s.add(max_distance.add_less(u))
-        s.add(max_distance.get_constraints())
+    def __below(self, upper_bound):
+        # literal that, assumed, keeps max_distance below upper_bound: every bound is encoded once and
+        # chained to its neighbours, so the checks share what the solver learned instead of pop and push
+        bound = upper_bound - 1
+        if bound not in self.__thresholds:
+            literal = Bool(f"max_distance_le_{bound}")
+            pool.add(self.s, 'threshold', Implies(literal, self.__solution["max_distance"].add_leq_int(bound)))
+            lower = [b for b in self.__thresholds if b < bound]
+            higher = [b for b in self.__thresholds if b > bound]
+            if len(lower) > 0:
+                pool.add(self.s, 'threshold', Implies(self.__thresholds[max(lower)], literal))
+            if len(higher) > 0:
+                pool.add(self.s, 'threshold', Implies(literal, self.__thresholds[min(higher)]))
+            self.__thresholds[bound] = literal
+        return self.__thresholds[bound]
 
     @staticmethod
     def __get_route(route_matrix, model, start, end):
@@ -182,6 +244,8 @@ class Sat_model:
 
     def build(self):
         self.s = Solver()
+        pool.reset_stats()
+        start = time()
         times, courier_route, loads, distances, max_load, max_distance = \
             Sat_model.__build_base_model(
             self.s,
@@ -207,19 +271,27 @@ class Sat_model:
         solution["max_distance"] = max_distance
 
         self.__solution = solution
+        self.__thresholds = {}
+        self.__encoding = pool.stats()
+        self.__build_time = round(time() - start, 3)
+
+    def encoding_stats(self) -> 'dict':
+        # variables, constraints and seconds of every family of constraints of the last build
+        return {'build_time': self.__build_time, 'families': self.__encoding}
 
     def minimize(self, processes=1, timeout=300000):
         start = time()
         self.s.set("threads", processes)
         self.s.set("timeout",timeout)
 
-        if self.s.check() != sat:
-            print(self.s.check())
+        result = self.s.check()
+        if result != sat:
+            print(result)
             return []
 
         solutions = []
         current_time = 0
-        while self.s.check() == sat:
+        while result == sat:
 
             sol = self.__convert_solution(self.__solution, self.s.model(), self.instance.m, self.instance.origin)
             current_time = int(time()-start)
@@ -231,10 +303,10 @@ class Sat_model:
 
             if current_time >= 300:
                 break
-            self.__update_max_distance(self.s,sol["max_distance"], self.__solution["max_distance"])
+            result = self.s.check(self.__below(sol["max_distance"]))
 
         final_solution = {
-            'optimal': solutions[-1]['solution']["max_distance"] == self.instance.min_path or current_time < 300,
+            'optimal': solutions[-1]['solution']["max_distance"] == self.instance.min_path or result == unsat,
             'time' : time() - start,
             'obj': solutions[-1]['solution']["max_distance"],
             'sol': get_solution(solutions[-1]['solution']['route'])
@@ -246,8 +318,14 @@ class Sat_model:
         start = time()
         self.s.set("threads", processes)
         self.s.set("timeout",timeout)
-        result = self.s.check()
+        assumptions = []
+        if self.__shared is not None:
+            assumptions = [self.__below(self.__shared.value())]
+        result = self.s.check(assumptions)
         if result != sat:
+            if result == unsat and self.__shared is not None:
+                # nothing is better than the best solution of the race
+                self.__shared.close()
             print(result)
             return []
         
@@ -256,6 +334,7 @@ class Sat_model:
         current_time = 0
         cond = 0
         old_max = 0
+        new_max = 0
         sol = {}
         while cond != 2:
             current_time = int(time()-start)
@@ -264,31 +343,118 @@ class Sat_model:
             if result == sat:
                 sol = self.__convert_solution(self.__solution, self.s.model(), self.instance.m, self.instance.origin)
                 solutions.append({"solution":sol, "time":current_time})
+                if self.__shared is not None:
+                    self.__shared.publish(sol["max_distance"], get_solution(sol["route"]))
                 self.s.set("timeout", timeout - (current_time * 1000))
                 if sol["max_distance"] == self.instance.min_path:
                     break
                 cond = 0
                 old_max = sol["max_distance"]
                 new_max = (sol["max_distance"] - min_distance)//2 + min_distance
-                new_max = max(new_max, self.instance.min_path + 1)
-                self.__update_max_distance(self.s,new_max, self.__solution["max_distance"])
+                new_max = self.__bound(max(new_max, self.instance.min_path + 1))
+                assumptions = [self.__below(new_max)]
                 print("Success in", current_time, "s")
                 print("Solution: ", sol["max_distance"], "Now tryin with New Max: ", new_max, " and New Min: ", min_distance)
             else:  
                 cond += 1
                 min_distance = (old_max - min_distance)//2 + min_distance
-                self.__update_max_distance(self.s,old_max, self.__solution["max_distance"])
+                new_max = self.__bound(old_max)
+                assumptions = [self.__below(new_max)]
                 print("Fail, time spent:", current_time, "s")
-                print("Solution: ", old_max, "Now tryin with New Max: ", old_max, " and New Min: ", min_distance)
-            result = self.s.check()
+                print("Solution: ", old_max, "Now tryin with New Max: ", new_max, " and New Min: ", min_distance)
+            result = self.s.check(assumptions)
+        if cond == 2 and result == unsat and self.__shared is not None:
+            self.__shared.close()
         final_solution = {
-            'optimal': solutions[-1]['solution']["max_distance"] == self.instance.min_path or cond == 2,
+            'optimal': solutions[-1]['solution']["max_distance"] == self.instance.min_path or (cond == 2 and new_max == old_max),
             'time' : time() - start,
             'obj': solutions[-1]['solution']["max_distance"],
-            'sol': get_solution(solutions[-1]['solution']['route'])
+            'sol': get_solution(solutions[-1]['solution']['route']),
+            'encoding': self.encoding_stats()
         }
         return final_solution
         
+    def parallel_search(self, processes=1, timeout=300000):
+        # bisection probing up to `processes` bounds at the same time, each one on its own copy of the model;
+        # a solution at v makes the probes at v and above useless, a failure at b the ones at b and below
+        start = time()
+        remaining = lambda: int(timeout - (time() - start) * 1000)
+        text = self.s.to_smt2()
+        bits = [str(b) for b in self.__solution["max_distance"].all()]
+        # bound -> (process, receiver)
+        running = {}
+        low, high = self.instance.min_path, self.instance.max_path
+        best, best_sol = None, None
+        unknown = False
+
+        def cancel(redundant):
+            for bound in [b for b in running if redundant(b)]:
+                process, receiver = running.pop(bound)
+                process.terminate()
+                receiver.close()
+
+        try:
+            while low <= high and remaining() > 0 and not unknown:
+                high = self.__bound(high + 1) - 1
+                cancel(lambda b: b < low or b > high)
+                if low > high:
+                    break
+                # the new bounds split the widest gaps between the ones being probed
+                while len(running) < max(1, processes):
+                    fences = [low - 1] + sorted(running) + [high + 1]
+                    gap = max(range(len(fences) - 1), key=lambda g: fences[g + 1] - fences[g])
+                    if fences[gap + 1] - fences[gap] < 2:
+                        break
+                    bound = (fences[gap] + fences[gap + 1]) // 2
+                    if best is None and len(running) == 0:
+                        # the loosest bound first, to have a solution as soon as possible
+                        bound = high
+                    receiver, sender = multiprocessing.Pipe(duplex=False)
+                    process = multiprocessing.Process(
+                        target=probe_bound, args=(text, bits, bound, self.instance.distances, self.instance.m,
+                                                  self.instance.n, remaining(), sender), daemon=True)
+                    process.start()
+                    sender.close()
+                    running[bound] = (process, receiver)
+                ready = wait([receiver for _, receiver in running.values()], timeout=1)
+                if len(ready) == 0:
+                    continue
+                bound = next(b for b, (_, receiver) in running.items() if receiver is ready[0])
+                process, receiver = running.pop(bound)
+                try:
+                    _, status, obj, sol = receiver.recv()
+                except EOFError:
+                    # the probe died without an answer
+                    status = 'unknown'
+                process.join()
+                receiver.close()
+                if status == 'sat':
+                    if best is None or obj < best:
+                        best, best_sol = obj, sol
+                        if self.__shared is not None:
+                            self.__shared.publish(best, best_sol)
+                        print("Solution: ", best, "in", round(time() - start, 3), "s, probing between", low, "and", best - 1)
+                    high = min(high, obj - 1)
+                elif status == 'unsat':
+                    low = max(low, bound + 1)
+                else:
+                    unknown = True
+        finally:
+            cancel(lambda b: True)
+
+        if low > high and self.__shared is not None:
+            self.__shared.close()
+        if best is None:
+            return []
+        return {
+            'optimal': best == self.instance.min_path or (low > high and (self.__shared is None or
+                                                                          best <= self.__shared.value())),
+            'time': time() - start,
+            'obj': best,
+            'sol': best_sol,
+            'encoding': self.encoding_stats()
+        }
+
 if __name__ == "__main__":
     model = Sat_model()
     start = time()
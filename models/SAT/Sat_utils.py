@@ -1,19 +1,69 @@
 from itertools import combinations
-from z3 import Bool, Not, And, Or, Xor, Implies
+from collections import deque
+from z3 import Bool, BoolVal, Not, And, Or, Xor, Implies
 from z3.z3 import BoolRef
 from math import ceil, log2
+from contextlib import contextmanager
+from time import time
 import numpy as np
-import uuid
 
 debug_gts = []
 debug_eqs = []
+
+
+class VariablePool:
+    # hands out the auxiliary variables of the encodings with sequential names, family__index,
+    # and counts for every family the variables, the constraints and the seconds it took
+    def __init__(self) -> None:
+        self.__next = {}
+        self.__stats = {}
+
+    def __family(self, family: 'str') -> 'dict':
+        if family not in self.__stats:
+            self.__stats[family] = {'variables': 0, 'constraints': 0, 'time': 0.0}
+        return self.__stats[family]
+
+    def new(self, family: 'str') -> 'BoolRef':
+        index = self.__next.get(family, 0)
+        self.__next[family] = index + 1
+        self.__family(family)['variables'] += 1
+        return Bool(f'{family}__{index}')
+
+    def new_list(self, family: 'str', length: 'int') -> 'list[BoolRef]':
+        return [self.new(family) for _ in range(length)]
+
+    def add(self, solver, family: 'str', constraints) -> None:
+        if not isinstance(constraints, list):
+            constraints = [constraints]
+        solver.add(constraints)
+        self.__family(family)['constraints'] += len(constraints)
+
+    @contextmanager
+    def timed(self, family: 'str'):
+        start = time()
+        try:
+            yield
+        finally:
+            self.__family(family)['time'] += time() - start
+
+    def stats(self) -> 'dict':
+        return {family: dict(values, time=round(values['time'], 3)) for family, values in self.__stats.items()}
+
+    def reset_stats(self) -> None:
+        # the names keep growing, so that the variables of different models never get mixed
+        self.__stats = {}
+
+
+pool = VariablePool()
+
+
 class SatSequenceInteger:
     def __init__(self, number:'int' = 0, numbers:'list[tuple]' = [], constraints:'list' = []) -> None:
         if len(numbers) > 0:
             self.__numbers = numbers
             self.__constraints = constraints
         else:
-            b = Bool(str(uuid.uuid4()))
+            b = pool.new('sequence_integer')
             self.__numbers = [(number, b)]
             self. __constraints = constraints + [b == True]
 
@@ -47,7 +97,7 @@ class SatSequenceInteger:
             if couple[0] > other:
                 upper_constraints.append(couple[1])
             else:
-                new_vars_i = [Bool(str(uuid.uuid4())) for _ in range(couple[0])]
+                new_vars_i = [pool.new('sequence_integer') for _ in range(couple[0])]
                 new_vars += new_vars_i
                 lower_constraints.append(And(new_vars_i + [couple[1]]))
         if len(new_vars) > other:
@@ -68,7 +118,7 @@ class SatSequenceInteger:
             if couple[0] > other:
                 upper_constraints.append(couple[1])
             else:
-                new_vars_i = [Bool(str(uuid.uuid4())) for _ in range(couple[0])]
+                new_vars_i = [pool.new('sequence_integer') for _ in range(couple[0])]
                 new_vars += new_vars_i
                 lower_constraints.append(And(new_vars_i + [couple[1]]))
 
@@ -103,7 +153,7 @@ class SatOrderInteger:
             self.len = len(sequence)
             return
 
-        self.__encoding = [Bool(str(uuid.uuid4())) for _ in range(integer)]
+        self.__encoding = pool.new_list('order_integer', integer)
         self.__constraints = [And(self.__encoding)] + constraints
         self.name = name
         self.len = integer
@@ -127,7 +177,7 @@ class SatOrderInteger:
 
 
     def __mul__(self, other:'BoolRef') -> 'SatOrderInteger':
-        encoding = [Bool(str(uuid.uuid4())) for _ in range(len(self.all()))]
+        encoding = pool.new_list('order_integer', len(self.all()))
         constraints = self.__constraints + [And(self[i], other) == encoding[i] for i in range(len(self.all()))]
         return SatOrderInteger(sequence=encoding, constraints=constraints)
 
@@ -168,7 +218,9 @@ class SatOrderInteger:
 
 class SatInteger:
     def __init__(self, decimal_number: 'int' = 0, name: 'str' = "number",
-                 binary: 'list' = [], pre_operations: 'list' = []) -> None:
+                 binary: 'list' = [], pre_operations: 'list|None' = None) -> None:
+        if pre_operations is None:
+            pre_operations = []
         if len(binary) > 0:
             self.binary_length = len(binary)
             self.__representation = binary
@@ -191,7 +243,7 @@ class SatInteger:
         num = []
         str_num = bin(number)[2:]
         for i in range(length):
-            ni = Bool(str(uuid.uuid4()))
+            ni = pool.new('integer')
             num.append(ni)
             if str_num[i] == '1':
                 self.__operations.append(ni == True)
@@ -224,8 +276,8 @@ class SatInteger:
         elif other.binary_length == min_length:
             self_all = self[remain:]
             
-        gts = [And(self_all[0], Not(other_all[0]))] + [Bool(str(uuid.uuid4())) for _ in range(min_length-1)]
-        eqs = [self_all[0] == other_all[0]] + [Bool(str(uuid.uuid4())) for _ in range(min_length-1)]
+        gts = [And(self_all[0], Not(other_all[0]))] + pool.new_list('comparison', min_length-1)
+        eqs = [self_all[0] == other_all[0]] + pool.new_list('comparison', min_length-1)
         for i in range(1,min_length):
             constraints += [
                 gts[i] == And(self_all[i], Not(other_all[i]), eqs[i-1]),
@@ -255,8 +307,8 @@ class SatInteger:
             constraints.append(Not(Or(self[:remain])))
             self_all = self[remain:]
             
-        lts = [And(Not(self_all[0]), other_all[0])] + [Bool(str(uuid.uuid4())) for _ in range(min_length-1)]
-        eqs = [self_all[0] == other_all[0]] + [Bool(str(uuid.uuid4())) for _ in range(min_length-1)]
+        lts = [And(Not(self_all[0]), other_all[0])] + pool.new_list('comparison', min_length-1)
+        eqs = [self_all[0] == other_all[0]] + pool.new_list('comparison', min_length-1)
         for i in range(1,min_length):
             constraints += [
                 lts[i] == And(Not(self_all[i]), other_all[i], eqs[i-1]),
@@ -302,8 +354,8 @@ class SatInteger:
         elif other.binary_length == min_length:
             self_all = self[remain:]
             
-        gts = [And(self_all[0], Not(other_all[0]))] + [Bool(str(uuid.uuid4())) for _ in range(min_length-1)]
-        eqs = [self_all[0] == other_all[0]] + [Bool(str(uuid.uuid4())) for _ in range(min_length-1)]
+        gts = [And(self_all[0], Not(other_all[0]))] + pool.new_list('comparison', min_length-1)
+        eqs = [self_all[0] == other_all[0]] + pool.new_list('comparison', min_length-1)
         for i in range(1,min_length):
             constraints += [
                 gts[i] == And(self_all[i], Not(other_all[i]), eqs[i-1]),
@@ -332,8 +384,8 @@ class SatInteger:
             self_all = self[remain:]
             constraints.append(Not(Or(self[:remain])))
         
-        lts = [And(Not(self_all[0]), other_all[0])] + [Bool(str(uuid.uuid4())) for _ in range(min_length-1)]
-        eqs = [self_all[0] == other_all[0]] + [Bool(str(uuid.uuid4())) for _ in range(min_length-1)]
+        lts = [And(Not(self_all[0]), other_all[0])] + pool.new_list('comparison', min_length-1)
+        eqs = [self_all[0] == other_all[0]] + pool.new_list('comparison', min_length-1)
         for i in range(1,min_length):
             constraints += [
                 lts[i] == And(Not(self_all[i]), other_all[i], eqs[i-1]),
@@ -444,7 +496,7 @@ class SatInteger:
         return Or(self.all())
 
     def extend(self, n:'int'):
-        extra = [Bool(str(uuid.uuid4())) for _ in range(n)]
+        extra = pool.new_list('integer', n)
         self.__operations.append(Not(Or(extra)))
         self.__representation = extra + self.__representation
         self.binary_length = len(self.__representation)
@@ -623,11 +675,48 @@ class SatInteger:
 
     __rmul__ = __mul__
 
+    @staticmethod
+    def weighted_sum(terms: 'list[tuple]', name: 'str' = "sum") -> 'SatInteger':
+        # sum of coefficient * boolean as a carry-save adder tree: every boolean goes in the columns of the
+        # bits of its coefficient, then each column is reduced by adders defined on fresh variables,
+        # the oldest bits first, so that the depth grows with the log of the number of terms
+        columns = {}
+        for coefficient, boolean in terms:
+            p = 0
+            coefficient = int(coefficient)
+            while coefficient > 0:
+                if coefficient & 1:
+                    columns.setdefault(p, deque()).append(boolean)
+                coefficient >>= 1
+                p += 1
+        if len(columns) == 0:
+            return SatInteger(0, name)
+
+        operations = []
+        bits = []
+        p = 0
+        # the carries may open new columns on the left
+        while p <= max(columns):
+            column = columns.get(p, deque())
+            while len(column) >= 2:
+                a, b = column.popleft(), column.popleft()
+                total, carry = pool.new('adder'), pool.new('adder')
+                if len(column) > 0:
+                    c = column.popleft()
+                    operations += [total == Xor(Xor(a, b), c), carry == Or(And(a, b), And(a, c), And(b, c))]
+                else:
+                    operations += [total == Xor(a, b), carry == And(a, b)]
+                column.append(total)
+                columns.setdefault(p + 1, deque()).append(carry)
+            bits.append(column[0] if len(column) > 0 else BoolVal(False))
+            p += 1
+        return SatInteger(binary=list(reversed(bits)), name=name, pre_operations=operations)
+
 class SatSequences:
     def __init__(self, length):
-        self.__sequence = [Bool(str(uuid.uuid4())) for _ in range(length)]
+        self.__sequence = pool.new_list('sequence', length)
         self.length = length
-        self.is_zero = Bool(str(uuid.uuid4()))
+        self.is_zero = pool.new('sequence')
     
 
     def add(self):
@@ -659,7 +748,7 @@ class SatSequences:
 
 
 def variable(variable_length:'int' = 1, variable_name:'str'="name")->'SatInteger':
-    return SatInteger(binary=[Bool(str(uuid.uuid4())) for _ in range(variable_length)], name= variable_name)
+    return SatInteger(binary=pool.new_list(variable_name, variable_length), name= variable_name)
 
 amo = lambda x: And([Not(And(pair[0], pair[1])) for pair in combinations(x,2)])
 
@@ -673,7 +762,7 @@ def at_most_one(bool_vars):
     constraints = []
     n = len(bool_vars)
     m = ceil(log2(n))
-    r = [Bool(str(uuid.uuid4())) for _ in range(m)]
+    r = pool.new_list('at_most_one', m)
     binaries = [toBinary(i, m) for i in range(n)]
     for i in range(n):
         for j in range(m):
@@ -691,7 +780,7 @@ def exactly_one(bool_vars):
 
 def at_most_k(bool_vars, k):
     n = len(bool_vars)
-    s = np.array([[Bool(str(uuid.uuid4())) for _ in range(k)] for _ in range(n - 1)])
+    s = np.array([pool.new_list('at_most_k', k) for _ in range(n - 1)])
     constraints = [Or(Not(bool_vars[0]), s[0,0])] + \
         [Not(s[0,j]) for j in range(1,k)]
     for i in range(1, n-1):
@@ -0,0 +1,203 @@
+from array import array
+from collections import deque
+
+
+class CnfBuilder:
+    # clauses as DIMACS literals: variables are the integers from 1, negative literals are negated variables.
+    # The clauses are kept in one flat int array terminated by 0s or, with stream_path, written
+    # straight to that file one DIMACS line each, so that big models never live as Python objects
+    def __init__(self, stream_path: 'str|None' = None) -> None:
+        self.n_vars = 0
+        self.n_clauses = 0
+        self.__stream_path = stream_path
+        self.__stream = open(stream_path, 'w') if stream_path is not None else None
+        self.__clauses = array('i')
+
+    def new_var(self) -> 'int':
+        self.n_vars += 1
+        return self.n_vars
+
+    def new_vars(self, length: 'int') -> 'list[int]':
+        return [self.new_var() for _ in range(length)]
+
+    def add(self, clause: 'list[int]') -> None:
+        self.n_clauses += 1
+        if self.__stream is not None:
+            self.__stream.write(' '.join(map(str, clause)) + ' 0\n')
+        else:
+            self.__clauses.extend(clause)
+            self.__clauses.append(0)
+
+    def close(self) -> None:
+        if self.__stream is not None:
+            self.__stream.close()
+            self.__stream = None
+
+    def clauses(self):
+        # iterates over the clauses, as lists of literals
+        if self.__stream_path is not None:
+            self.close()
+            with open(self.__stream_path, 'r') as f:
+                for line in f:
+                    yield [int(literal) for literal in line.split()[:-1]]
+            return
+        clause = []
+        for literal in self.__clauses:
+            if literal == 0:
+                yield clause
+                clause = []
+            else:
+                clause.append(literal)
+
+    def write_dimacs(self, path: 'str', extra: 'list[list[int]]' = []) -> None:
+        with open(path, 'w') as f:
+            f.write(f'p cnf {self.n_vars} {self.n_clauses + len(extra)}\n')
+            for clause in self.clauses():
+                f.write(' '.join(map(str, clause)) + ' 0\n')
+            for clause in extra:
+                f.write(' '.join(map(str, clause)) + ' 0\n')
+
+    @staticmethod
+    def smt2_clauses(clauses, first_var: 'int' = 1, last_var: 'int' = 0) -> 'str':
+        # the clauses in SMT-LIB, declaring the variables from first_var to last_var
+        literal = lambda l: f'x{l}' if l > 0 else f'(not x{-l})'
+        lines = [f'(declare-const x{v} Bool)' for v in range(first_var, last_var + 1)]
+        for clause in clauses:
+            if len(clause) == 1:
+                lines.append(f'(assert {literal(clause[0])})')
+            else:
+                lines.append(f'(assert (or {" ".join(literal(l) for l in clause)}))')
+        return '\n'.join(lines)
+
+    def write_smt2(self, path: 'str') -> None:
+        with open(path, 'w') as f:
+            f.write(CnfBuilder.smt2_clauses([], 1, self.n_vars) + '\n')
+            for clause in self.clauses():
+                f.write(CnfBuilder.smt2_clauses([clause]) + '\n')
+
+    # cardinality constraints
+
+    def at_most_one(self, literals: 'list[int]') -> None:
+        if len(literals) <= 5:
+            for i in range(len(literals)):
+                for j in range(i + 1, len(literals)):
+                    self.add([-literals[i], -literals[j]])
+            return
+        self.at_most_k(literals, 1)
+
+    def exactly_one(self, literals: 'list[int]') -> None:
+        self.add(list(literals))
+        self.at_most_one(literals)
+
+    def at_most_k(self, literals: 'list[int]', k: 'int') -> None:
+        # sequential counter: s[i][j] holds when at least j+1 of the first i+1 literals are true
+        n = len(literals)
+        if k >= n:
+            return
+        if k <= 0:
+            for literal in literals:
+                self.add([-literal])
+            return
+        s = [self.new_vars(k) for _ in range(n - 1)]
+        self.add([-literals[0], s[0][0]])
+        for j in range(1, k):
+            self.add([-s[0][j]])
+        for i in range(1, n - 1):
+            self.add([-literals[i], s[i][0]])
+            self.add([-s[i - 1][0], s[i][0]])
+            for j in range(1, k):
+                self.add([-literals[i], -s[i - 1][j - 1], s[i][j]])
+                self.add([-s[i - 1][j], s[i][j]])
+            self.add([-literals[i], -s[i - 1][k - 1]])
+        self.add([-literals[n - 1], -s[n - 2][k - 1]])
+
+    def at_least_k(self, literals: 'list[int]', k: 'int') -> None:
+        if k <= 0:
+            return
+        if k == 1:
+            self.add(list(literals))
+            return
+        self.at_most_k([-literal for literal in literals], len(literals) - k)
+
+    # Tseitin encoded arithmetic, numbers are lists of literals from the least significant bit,
+    # None standing for a bit that is always 0
+
+    def half_adder(self, a: 'int', b: 'int') -> 'tuple[int, int]':
+        s, c = self.new_var(), self.new_var()
+        self.add([-a, -b, -s])
+        self.add([a, b, -s])
+        self.add([-a, b, s])
+        self.add([a, -b, s])
+        self.add([-c, a])
+        self.add([-c, b])
+        self.add([-a, -b, c])
+        return s, c
+
+    def full_adder(self, a: 'int', b: 'int', carry: 'int') -> 'tuple[int, int]':
+        s, c = self.new_var(), self.new_var()
+        for x in (a, -a):
+            for y in (b, -b):
+                for z in (carry, -carry):
+                    # s is the parity of the three inputs
+                    odd = (x > 0) + (y > 0) + (z > 0)
+                    self.add([-x, -y, -z, s if odd % 2 == 1 else -s])
+        self.add([-a, -b, c])
+        self.add([-a, -carry, c])
+        self.add([-b, -carry, c])
+        self.add([a, b, -c])
+        self.add([a, carry, -c])
+        self.add([b, carry, -c])
+        return s, c
+
+    def weighted_sum(self, terms: 'list[tuple[int, int]]') -> 'list':
+        # sum of coefficient * literal: every literal goes in the columns of the bits of its coefficient,
+        # then the columns are reduced with full and half adders, the oldest bits first so that the tree stays shallow
+        columns = {}
+        for coefficient, literal in terms:
+            p = 0
+            while coefficient > 0:
+                if coefficient & 1:
+                    columns.setdefault(p, deque()).append(literal)
+                coefficient >>= 1
+                p += 1
+        bits = []
+        p = 0
+        while p <= max(columns, default=-1):
+            column = columns.get(p, deque())
+            while len(column) >= 3:
+                s, c = self.full_adder(column.popleft(), column.popleft(), column.popleft())
+                column.append(s)
+                columns.setdefault(p + 1, deque()).append(c)
+            if len(column) == 2:
+                s, c = self.half_adder(column.popleft(), column.popleft())
+                column.append(s)
+                columns.setdefault(p + 1, deque()).append(c)
+            bits.append(column[0] if len(column) == 1 else None)
+            p += 1
+        return bits
+
+    def leq_const(self, bits: 'list', bound: 'int', guard: 'int|None' = None) -> None:
+        # the number is at most bound, only when guard holds if it is given
+        condition = [] if guard is None else [-guard]
+        if bound < 0:
+            self.add(condition)
+            return
+        if bound >= (1 << len(bits)) - 1:
+            return
+        for p in range(len(bits)):
+            if bound >> p & 1 or bits[p] is None:
+                continue
+            # bit p set where bound has a 0, with all the higher ones of bound set too, exceeds it
+            clause = [-bits[p]]
+            for q in range(p + 1, len(bits)):
+                if bound >> q & 1:
+                    if bits[q] is None:
+                        clause = None
+                        break
+                    clause.append(-bits[q])
+            if clause is not None:
+                self.add(clause + condition)
+
+    @staticmethod
+    def value(bits: 'list', assignment) -> 'int':
+        return sum(1 << p for p, bit in enumerate(bits) if bit is not None and assignment(bit))
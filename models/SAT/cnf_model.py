@@ -0,0 +1,223 @@
+import os
+import re
+import shutil
+import tempfile
+import subprocess
+import z3
+
+from time import time
+from instance import Instance
+from models.SAT.cnf import CnfBuilder
+
+
+class Cnf_model:
+    # the SAT model written directly as clauses: arcs, one-hot positions along the routes and
+    # Tseitin adders for loads and distances; the bisection on the objective probes every bound
+    # under its own guard literal, solved by z3 or by a SAT solver binary
+    WORKSPACES = '.cache/sat/work'
+    # binaries that print the model in the SAT competition format, the others write it to a file
+    COMPETITION_SOLVERS = ['kissat', 'cadical', 'cryptominisat5', 'lingeling', 'glucose']
+
+    def __init__(self, solver: 'str' = 'z3', stream: 'bool' = False) -> None:
+        # solver: 'z3' or the name of a SAT solver binary on the PATH
+        self.solver = solver
+        self.__stream = stream
+        self.__shared = None
+        self.__workspace = None
+        self.__build_time = 0
+
+    def set_shared_bound(self, shared) -> None:
+        # scheduler.SharedBound of a race, the bisection never probes above its value
+        self.__shared = shared
+
+    def add_instance(self, instance: 'Instance', build: 'bool' = True) -> None:
+        self.instance = instance
+        if build:
+            self.build()
+
+    def build(self) -> None:
+        start = time()
+        if self.__workspace is None:
+            os.makedirs(self.WORKSPACES, exist_ok=True)
+            self.__workspace = tempfile.mkdtemp(dir=self.WORKSPACES)
+        stream_path = os.path.join(self.__workspace, 'model.clauses') if self.__stream else None
+        self.cnf = CnfBuilder(stream_path)
+        cnf = self.cnf
+        m, n, o = self.instance.m, self.instance.n, self.instance.n
+        length = self.instance.max_packs
+        d = self.instance.distances
+
+        # x[k][i][j]: courier k goes from i to j, node n is the origin
+        self.__x = [[[cnf.new_var() if i != j else None for j in range(n + 1)] for i in range(n + 1)]
+                    for _ in range(m)]
+        y = [cnf.new_vars(n) for _ in range(m)]
+        # t[k][i][p]: item i is the p-th stop of courier k
+        t = [[cnf.new_vars(length) for _ in range(n)] for _ in range(m)]
+
+        for i in range(n):
+            cnf.exactly_one([y[k][i] for k in range(m)])
+
+        self.__distances = []
+        for k in range(m):
+            x = self.__x[k]
+            cnf.at_least_k(y[k], self.instance.min_packs)
+            cnf.at_most_k(y[k], length)
+            # each courier starts and ends at the origin
+            cnf.exactly_one([x[o][j] for j in range(n)])
+            cnf.exactly_one([x[i][o] for i in range(n)])
+            for i in range(n):
+                # an item carried by k is left and reached exactly once by k
+                for arcs in ([x[i][j] for j in range(n + 1) if j != i], [x[j][i] for j in range(n + 1) if j != i]):
+                    cnf.add([-y[k][i]] + arcs)
+                    cnf.at_most_one(arcs)
+                    for arc in arcs:
+                        cnf.add([-arc, y[k][i]])
+                cnf.add([-y[k][i]] + t[k][i])
+                cnf.at_most_one(t[k][i])
+                for p in range(length):
+                    cnf.add([-t[k][i][p], y[k][i]])
+                # the first stop comes from the origin, every other one right after the previous one
+                cnf.add([-x[o][i], t[k][i][0]])
+                for j in range(n):
+                    if i == j:
+                        continue
+                    cnf.add([-x[i][j], -t[k][i][length - 1]])
+                    for p in range(length - 1):
+                        cnf.add([-x[i][j], -t[k][i][p], t[k][j][p + 1]])
+
+            load = cnf.weighted_sum([(int(self.instance.size[i]), y[k][i]) for i in range(n)])
+            cnf.leq_const(load, int(self.instance.max_load[k]))
+            self.__distances.append(cnf.weighted_sum([(int(d[i][j]), x[i][j]) for i in range(n + 1)
+                                                      for j in range(n + 1) if i != j and d[i][j] > 0]))
+        cnf.close()
+        self.__build_time = round(time() - start, 3)
+
+    def close(self) -> None:
+        # removes the files of the model, solving needs a new build afterwards
+        if self.__workspace is not None:
+            shutil.rmtree(self.__workspace, ignore_errors=True)
+            self.__workspace = None
+
+    def encoding_stats(self) -> 'dict':
+        return {'build_time': self.__build_time, 'variables': self.cnf.n_vars, 'clauses': self.cnf.n_clauses}
+
+    def __bound_clauses(self, bound: 'int') -> 'tuple[int, list]':
+        # a fresh guard literal and the clauses that, under it, keep every distance within bound
+        guard = self.cnf.new_var()
+        probe = CnfBuilder()
+        for bits in self.__distances:
+            probe.leq_const(bits, bound, guard)
+        return guard, list(probe.clauses())
+
+    def __routes(self, assignment) -> 'list[list]':
+        o = self.instance.n
+        routes = []
+        for x in self.__x:
+            route = []
+            current = o
+            while True:
+                current = next(j for j in range(o + 1) if j != current and assignment(x[current][j]))
+                if current == o:
+                    break
+                route.append(current + 1)
+            routes.append(route)
+        return routes
+
+    def __z3_solver(self):
+        solver = z3.SolverFor('QF_FD')
+        path = os.path.join(self.__workspace, 'model.smt2')
+        self.cnf.write_smt2(path)
+        solver.from_file(path)
+        return solver
+
+    def __z3_probe(self, solver, bound: 'int', timeout: 'int'):
+        first = self.cnf.n_vars + 1
+        guard, clauses = self.__bound_clauses(bound)
+        solver.from_string(CnfBuilder.smt2_clauses(clauses, first, guard))
+        solver.set('timeout', max(1, timeout))
+        result = solver.check(z3.Bool(f'x{guard}'))
+        if result == z3.sat:
+            model = solver.model()
+            return True, self.__routes(lambda v: z3.is_true(model.eval(z3.Bool(f'x{v}'), model_completion=True)))
+        if result == z3.unsat:
+            return False, None
+        return None, None
+
+    def __binary_probe(self, bound: 'int', timeout: 'int'):
+        guard, clauses = self.__bound_clauses(bound)
+        path = os.path.join(self.__workspace, 'probe.cnf')
+        output_path = os.path.join(self.__workspace, 'probe.out')
+        self.cnf.write_dimacs(path, clauses + [[guard]])
+        command = [self.solver, path]
+        if self.solver not in self.COMPETITION_SOLVERS:
+            command.append(output_path)
+        try:
+            process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                     text=True, timeout=max(0.001, timeout / 1000))
+        except subprocess.TimeoutExpired:
+            return None, None
+        output = process.stdout
+        if self.solver not in self.COMPETITION_SOLVERS and os.path.exists(output_path):
+            with open(output_path, 'r') as f:
+                output = f.read()
+        if re.search(r'^(s )?UNSAT', output, re.MULTILINE):
+            return False, None
+        if not re.search(r'^(s )?SAT', output, re.MULTILINE):
+            return None, None
+        true_vars = set()
+        for line in output.splitlines():
+            if line.startswith('v ') or re.match(r'^-?\d', line):
+                true_vars.update(int(literal) for literal in line.split() if literal.lstrip('-').isdigit()
+                                 and int(literal) > 0)
+        return True, self.__routes(lambda v: v in true_vars)
+
+    def split_search(self, processes: 'int' = 1, timeout: 'int' = 300000) -> 'dict|list':
+        # timeout in milliseconds, as for Sat_model
+        start = time()
+        remaining = lambda: int(timeout - (time() - start) * 1000)
+        try:
+            if self.solver == 'z3':
+                solver = self.__z3_solver()
+                if processes > 1:
+                    solver.set('threads', processes)
+                probe = lambda bound: self.__z3_probe(solver, bound, remaining())
+            else:
+                if shutil.which(self.solver) is None:
+                    raise Exception(f"SAT solver {self.solver} not found")
+                probe = lambda bound: self.__binary_probe(bound, remaining())
+
+            # every unsat probe raises low, so once low passes high nothing better than best exists
+            low, high = self.instance.min_path, self.instance.max_path
+            best, best_routes = None, None
+            while low <= high and remaining() > 0:
+                if self.__shared is not None:
+                    high = min(high, self.__shared.value() - 1)
+                    if low > high:
+                        break
+                bound = high if best is None else (low + high) // 2
+                found, routes = probe(bound)
+                if found is None:
+                    break
+                if found:
+                    best, best_routes = self.instance.objective(routes), routes
+                    high = best - 1
+                    if self.__shared is not None:
+                        self.__shared.publish(best, best_routes)
+                    print("Solution:", best, "in", round(time() - start, 3), "s")
+                else:
+                    low = bound + 1
+            if low > high and self.__shared is not None:
+                self.__shared.close()
+        finally:
+            self.close()
+
+        if best is None:
+            return []
+        return {
+            'optimal': best == self.instance.min_path or (low > high and (self.__shared is None or
+                                                                          best <= self.__shared.value())),
+            'time': time() - start,
+            'obj': best,
+            'sol': best_routes,
+            'encoding': self.encoding_stats()
+        }
@@ -1,30 +1,156 @@
 import z3
 import time
+import multiprocessing
 import numpy as np
 
 from os.path import join
+from multiprocessing.connection import wait
 from models.Abstract_model import Abstract_model
 from instance import Instance
+from models.SAT.Sat_utils import VariablePool
+from bounds import shortest_paths, max_items_per_courier
+from scheduler import SharedBound
+
+
+def pb(relation: 'str', terms: 'list', k: 'int') -> 'z3.BoolRef':
+    # z3 pseudo-boolean constraint ('le', 'ge' or 'eq'), also when pruning left no terms
+    if len(terms) == 0:
+        return z3.BoolVal({'le': 0 <= k, 'ge': 0 >= k, 'eq': k == 0}[relation])
+    return {'le': z3.PbLe, 'ge': z3.PbGe, 'eq': z3.PbEq}[relation](terms, k)
+
+
+# coefficients and bound of the pseudo-boolean atoms are parameters of their declaration
+PSEUDO_BOOLEAN = [z3.Z3_OP_PB_LE, z3.Z3_OP_PB_GE, z3.Z3_OP_PB_EQ, z3.Z3_OP_PB_AT_MOST, z3.Z3_OP_PB_AT_LEAST]
+
+
+def linear(expression: 'z3.ExprRef', rewritten: 'dict') -> 'z3.ExprRef':
+    # the expression with its pseudo-boolean atoms written as sums of ite terms; rewritten
+    # maps the ids of the subexpressions already seen to their rewriting, as they are shared
+    key = expression.get_id()
+    if key in rewritten:
+        return rewritten[key]
+    result = expression
+    if z3.is_app(expression) and expression.num_args() > 0:
+        arguments = [linear(argument, rewritten) for argument in expression.children()]
+        kind = expression.decl().kind()
+        if kind in PSEUDO_BOOLEAN:
+            ctx, decl = expression.ctx.ref(), expression.decl().ast
+            parameters = [z3.Z3_get_decl_int_parameter(ctx, decl, i)
+                          for i in range(z3.Z3_get_decl_num_parameters(ctx, decl))]
+            coefficients = parameters[1:] if len(parameters) > 1 else [1 for _ in arguments]
+            total = z3.Sum([z3.If(argument, coefficient, 0) for argument, coefficient in zip(arguments, coefficients)])
+            if kind in (z3.Z3_OP_PB_LE, z3.Z3_OP_PB_AT_MOST):
+                result = total <= parameters[0]
+            elif kind in (z3.Z3_OP_PB_GE, z3.Z3_OP_PB_AT_LEAST):
+                result = total >= parameters[0]
+            else:
+                result = total == parameters[0]
+        elif any(a.get_id() != b.get_id() for a, b in zip(arguments, expression.children())):
+            result = expression.decl()(*arguments)
+    rewritten[key] = result
+    return result
+
+
+# z3 configurations of the portfolio, each one a solver built in the context of its worker;
+# seed-<n> is the default solver with random seed n
+PORTFOLIO = {
+    'default': lambda ctx: z3.Solver(ctx=ctx),
+    'qflia': lambda ctx: z3.Tactic('qflia', ctx).solver(),
+    'lia2card': lambda ctx: z3.Then('simplify', 'lia2card', 'smt', ctx=ctx).solver(),
+    'optimize': lambda ctx: z3.Optimize(ctx=ctx)
+}
+
+
+def portfolio_worker(text: 'str', configuration: 'str', min_path: 'int', shared, timeout: 'float', sender) -> None:
+    # runs in its own process on a copy of the model: lowers the bound on longest_route until nothing is below it.
+    # Sends ('sat', values) for every solution, ('unsat', bound) once no solution is within bound, or ('unknown', None)
+    start = time.time()
+    ctx = z3.Context()
+    if configuration.startswith('seed-'):
+        solver = z3.Solver(ctx=ctx)
+        solver.set('random_seed', int(configuration[len('seed-'):]))
+    else:
+        solver = PORTFOLIO[configuration](ctx)
+    solver.from_string(text)
+    objective = z3.Int('longest_route', ctx)
+    if configuration == 'optimize':
+        solver.minimize(objective)
+
+    bound = shared.value() - 1
+    while bound >= min_path:
+        remaining = timeout - (time.time() - start)
+        if remaining <= 0:
+            break
+        solver.set('timeout', max(1, int(remaining * 1000)))
+        solver.add(objective <= bound)
+        result = solver.check()
+        if result != z3.sat:
+            sender.send(('unsat', bound) if result == z3.unsat else ('unknown', None))
+            return
+        model = solver.model()
+        sender.send(('sat', [(decl.name(), z3.is_true(model[decl]) if z3.is_bool(model[decl]) else model[decl].as_long())
+                             for decl in model.decls() if decl.arity() == 0]))
+        found = model[objective].as_long()
+        if configuration == 'optimize':
+            # the minimum, nothing is within one less than it
+            sender.send(('unsat', found - 1))
+            return
+        bound = min(found, shared.value()) - 1
+    sender.send(('unsat', bound) if bound < min_path else ('unknown', None))
+
+
+class Assignment:
+    # the values of a solution found by a portfolio worker, evaluated as a z3 model does on the
+    # expressions of the model they were found for
+    def __init__(self, values: 'list') -> None:
+        self.__values = {}
+        for name, value in values:
+            if isinstance(value, bool):
+                self.__values[name] = (z3.Bool(name), z3.BoolVal(value))
+            else:
+                self.__values[name] = (z3.Int(name), z3.IntVal(value))
+
+    def evaluate(self, expression, model_completion: 'bool' = False):
+        if z3.is_const(expression):
+            if str(expression) in self.__values:
+                return self.__values[str(expression)][1]
+            if z3.is_true(expression) or z3.is_false(expression) or z3.is_int_value(expression):
+                return expression
+            if model_completion:
+                return z3.BoolVal(False) if z3.is_bool(expression) else z3.IntVal(0)
+            return expression
+        return z3.simplify(z3.substitute(expression, *self.__values.values()))
 
 
 class Z3_smt_model(Abstract_model):
 
-    def __init__(self, lib: 'str', instance: Instance):
+    def __init__(self, lib: 'str', instance: Instance, compact: 'bool' = False, redundant: 'bool' = True):
+        # compact: only the arcs that can be part of a solution, pseudo-boolean distance bounds and
+        # MTZ positions by implication; redundant: also assert the implied constraints
         super().__init__(lib, instance)
         self._model = None
         self._optimal_solution_found = False
+        self._compact = compact
+        self._redundant = redundant
 
         self._solver = z3.Solver()
+        # assertions and build seconds of every family of constraints
+        self._stats = VariablePool()
 
         self._table = np.array([[[z3.Bool(f'table_{k}_{i}_{j}') for j in range(self._instance.origin)]
                                  for i in range(self._instance.origin)] for k in range(self._instance.m)])
+        if compact:
+            self.__build_compact()
+            self._end_time = time.time()
+            self._build_time = self._end_time - self._start_time
+            return
 
         self._courier_distance = np.array([z3.Int(f'courier_distance_{k}') for k in range(self._instance.m)])
 
         # Lower and upper bounds on the courier distance for each courier
         for k in range(self._instance.m):
-            self._solver.add(self._courier_distance[k] >= 0)
-            self._solver.add(self._courier_distance[k] <= self._instance.max_path)
+            self._stats.add(self._solver, 'bounds', self._courier_distance[k] >= 0)
+            self._stats.add(self._solver, 'bounds', self._courier_distance[k] <= self._instance.max_path)
 
         # Auxiliary variables to avoid Sub-tours
         self._u = np.array(
@@ -33,127 +159,454 @@ class Z3_smt_model(Abstract_model):
         # Lower and upper bounds on the auxiliary variables
         for k in range(instance.m):
             for i in range(instance.origin):
-                self._solver.add(self._u[k][i] >= 0)
-                self._solver.add(self._u[k][i] <= instance.origin - 1)
+                self._stats.add(self._solver, 'mtz', self._u[k][i] >= 0)
+                self._stats.add(self._solver, 'mtz', self._u[k][i] <= instance.origin - 1)
 
         self.__build()
         self._end_time = time.time()
+        self._build_time = self._end_time - self._start_time
 
     def __build(self):
         self.obj = z3.Int('obj')
 
         # Upper and lower bounds on the objective
-        self._solver.add(self.obj <= self._instance.max_path)
-        self._solver.add(self.obj >= self._instance.min_path)
+        self._stats.add(self._solver, 'objective', self.obj <= self._instance.max_path)
+        self._stats.add(self._solver, 'objective', self.obj >= self._instance.min_path)
 
-        # Calculate the courier distance for each courier
-        for k in range(self._instance.m):
-            self._courier_distance[k] = z3.Sum(
-                [z3.If(self._table[k][i][j], 1, 0) * self._instance.distances[i][j]
-                 for i in range(self._instance.origin) for j in range(self._instance.origin)])
+        with self._stats.timed('objective'):
+            # Calculate the courier distance for each courier
+            for k in range(self._instance.m):
+                self._courier_distance[k] = z3.Sum(
+                    [z3.If(self._table[k][i][j], 1, 0) * self._instance.distances[i][j]
+                     for i in range(self._instance.origin) for j in range(self._instance.origin)])
 
-        # Objective
-        for k in range(self._instance.m):
-            self._solver.add(self.obj >= self._courier_distance[k])
+            # Objective
+            for k in range(self._instance.m):
+                self._stats.add(self._solver, 'objective', self.obj >= self._courier_distance[k])
 
         self.add_constraints()
 
+    def __live_arcs(self) -> 'list':
+        # live[k][i][j]: courier k may go from i to j. An arc is dropped when even the shortest closed walk
+        # through it is longer than max_path, or when courier k cannot carry the items at its ends
+        o = self._instance.origin - 1
+        sp = shortest_paths(self._instance.distances)
+        d = self._instance.distances
+        size = self._instance.size + [0]
+        live = []
+        for k in range(self._instance.m):
+            capacity = self._instance.max_load[k]
+            live.append([[i != j and sp[o][i] + d[i][j] + sp[j][o] <= self._instance.max_path
+                          and size[i] + size[j] <= capacity for j in range(o + 1)] for i in range(o + 1)])
+        return live
+
+    def __build_compact(self):
+        instance = self._instance
+        o = instance.origin - 1
+        d = instance.distances
+        live = self.__live_arcs()
+        max_packs = [min(instance.max_packs, packs) for packs in max_items_per_courier(instance.size, instance.max_load)]
+        add = lambda family, constraint: self._stats.add(self._solver, family, constraint)
+        leaving = lambda k, i: [self._table[k][i][j] for j in range(o + 1) if live[k][i][j]]
+        entering = lambda k, j: [self._table[k][i][j] for i in range(o + 1) if live[k][i][j]]
+
+        self.obj = None
+        # positions along the routes, one per item since every item has a single courier
+        self._u = [z3.Int(f'u_{i}') for i in range(o)]
+        with self._stats.timed('bounds'):
+            for k in range(instance.m):
+                for i in range(o + 1):
+                    for j in range(o + 1):
+                        if not live[k][i][j]:
+                            self._table[k][i][j] = z3.BoolVal(False)
+        self._courier_distance = [z3.Sum([z3.IntVal(0)] + [z3.If(self._table[k][i][j], int(d[i][j]), 0) for i in range(o + 1)
+                                                           for j in range(o + 1) if live[k][i][j]]) for k in range(instance.m)]
+        self.__weighted_arcs = [[(self._table[k][i][j], int(d[i][j])) for i in range(o + 1) for j in range(o + 1)
+                                 if live[k][i][j] and d[i][j] > 0] for k in range(instance.m)]
+
+        with self._stats.timed('objective'):
+            for k in range(instance.m):
+                if instance.max_path < sum(weight for _, weight in self.__weighted_arcs[k]):
+                    add('objective', pb('le', self.__weighted_arcs[k], instance.max_path))
+            if self._redundant and instance.min_path > 0:
+                add('redundant', pb('ge', [arc for arcs in self.__weighted_arcs for arc in arcs], instance.min_path))
+
+        with self._stats.timed('flow'):
+            for k in range(instance.m):
+                add('origin', pb('eq', [(arc, 1) for arc in leaving(k, o)], 1))
+                add('origin', pb('eq', [(arc, 1) for arc in entering(k, o)], 1))
+                for i in range(o):
+                    # If an item is reached, it is also left by the same courier
+                    add('flow', pb('eq', [(arc, 1) for arc in leaving(k, i)] + [(arc, -1) for arc in entering(k, i)], 0))
+
+        with self._stats.timed('assignment'):
+            for j in range(o):
+                add('assignment', pb('eq', [(arc, 1) for k in range(instance.m) for arc in entering(k, j)], 1))
+                if self._redundant:
+                    add('redundant', pb('eq', [(arc, 1) for k in range(instance.m) for arc in leaving(k, j)], 1))
+
+        with self._stats.timed('load'):
+            for k in range(instance.m):
+                delivered = [(self._table[k][i][j], j) for j in range(o) for i in range(o + 1) if live[k][i][j]]
+                add('load', pb('le', [(arc, instance.size[j]) for arc, j in delivered], instance.max_load[k]))
+                add('packs', pb('ge', [(arc, 1) for arc, _ in delivered], instance.min_packs))
+                add('packs', pb('le', [(arc, 1) for arc, _ in delivered], max_packs[k]))
+
+        with self._stats.timed('mtz'):
+            for i in range(o):
+                add('mtz', self._u[i] >= 0)
+                add('mtz', self._u[i] <= max(max_packs) - 1)
+            for k in range(instance.m):
+                for j in range(o):
+                    if live[k][o][j]:
+                        add('mtz', z3.Implies(self._table[k][o][j], self._u[j] == 0))
+                    for i in range(o):
+                        if live[k][i][j]:
+                            # Sub-tour elimination, the next item is one position further
+                            add('mtz', z3.Implies(self._table[k][i][j], self._u[j] == self._u[i] + 1))
+                            if self._redundant and live[k][j][i] and i < j:
+                                add('two_cycle', z3.Not(z3.And(self._table[k][i][j], self._table[k][j][i])))
+
+    def encoding_stats(self) -> 'dict':
+        # assertions and seconds of every family of constraints
+        return {'build_time': round(self._build_time, 3), 'families': self._stats.stats()}
+
+    def to_smt2(self, portable: 'bool' = False) -> 'str':
+        # the model and longest_route, the length of its longest route, as SMT-LIB commands without check-sat;
+        # portable writes the pseudo-boolean constraints as linear sums, for the solvers that only know QF_LIA
+        objective = z3.Int('longest_route')
+        assertions = list(self._solver.assertions())
+        assertions += [objective >= distance for distance in self._courier_distance]
+        assertions.append(z3.Or([objective == distance for distance in self._courier_distance]))
+        if portable:
+            rewritten = {}
+            assertions = [linear(assertion, rewritten) for assertion in assertions]
+        solver = z3.Solver()
+        solver.add(assertions)
+        text = solver.to_smt2()
+        return text[:text.rfind('(check-sat)')]
+
     def save(self, save_folder: 'str'):
+        # a complete QF_LIA benchmark, the input of smtlib_runner
         f = open(join(save_folder, f'{self._instance.name}.smt2'), "w")
-        smt_file = self._solver.to_smt2()
-        f.write(smt_file)
+        f.write('(set-option :produce-models true)\n(set-logic QF_LIA)\n')
+        f.write(self.to_smt2(portable=True))
+        f.write('(check-sat)\n')
         f.close()
         print(f"exported model to file {self._instance.name} into folder {save_folder}")
 
     def solve(self, processes=1, timeout: 'int' = 300) -> None:
+        # bisection on the objective between min_path and the incumbent, one check per step under an
+        # assumed bound literal, so that what the solver learns is kept from one step to the next
         self._inst_time = self._end_time - self._start_time
+        self.__thresholds = {}
+        self._result['trace'] = []
 
-        if self._inst_time >= timeout:
-            self._result['time'] = round(self._inst_time, 3)
-            self._result['optimal'] = self._optimal_solution_found
-            self._result['obj'] = None
-            self._result['sol'] = None
-
-        self._solver.set("timeout", int(timeout - self._inst_time) * 1000)
         if processes > 1:
             self._solver.set("threads", processes)
-        while self._solver.check() == z3.sat:
-            self._model = self._solver.model()
-            self._solver.add(self.obj < self._model[self.obj])
 
-            # Check if the solution is optimal
-            if self._solver.check() == z3.unsat:
-                self._end_time = time.time()
-                self._inst_time = self._end_time - self._start_time
+        low, high = self._instance.min_path, self._instance.max_path
+        status = None
+        while low <= high:
+            remaining = timeout - (time.time() - self._start_time)
+            if remaining <= 0:
+                break
+            if self._shared is not None:
+                high = min(high, self._shared.value() - 1)
+                if low > high:
+                    break
+            bound = high if self._model is None else (low + high) // 2
+            self._solver.set("timeout", max(1, int(remaining * 1000)))
+            status = self._solver.check(self.__below(bound))
+            if status == z3.sat:
+                self._model = self._solver.model()
+                found = self.__objective(self._model)
+                elapsed = round(time.time() - self._start_time, 3)
+                if len(self._result['trace']) == 0:
+                    self._result['time_to_first_solution'] = elapsed
+                self._result['trace'].append([elapsed, found])
+                if self._shared is not None:
+                    self._shared.publish(found, self._routes(self._model))
+                high = found - 1
+            elif status == z3.unsat:
+                low = bound + 1
+            else:
+                break
+
+        self._end_time = time.time()
+        self._inst_time = self._end_time - self._start_time
+        # once low passes high no solution is better than the last one, or than the best of the race
+        proved = low > high
+        self._optimal_solution_found = self._model is not None and proved and \
+            (self._shared is None or self.__objective(self._model) <= self._shared.value())
+        if proved and self._shared is not None:
+            self._shared.close()
+
+        self._result['time'] = round(self._inst_time, 3)
+        self._result['optimal'] = self._optimal_solution_found
+        if self._model is None:
+            self._result['obj'] = None
+            self._result['sol'] = None
+            return
+        self._result['obj'] = self.__objective(self._model)
+        self._result['sol'] = self._routes(self._model)
+
+    def portfolio(self, configurations: 'list[str]', timeout: 'int' = 300) -> None:
+        # every configuration runs on its own copy of the model in its own process, the solutions they send
+        # lower the bound all of them solve for, the first proof that nothing is below it ends the search
+        if self._shared is None:
+            self._shared = SharedBound(self._instance)
+        text = self.to_smt2()
 
-                # Convert table to a list of lists of booleans
-                self._table = [[[self._model[self._table[k][i][j]] for j in range(self._instance.origin)] for i in
-                                range(self._instance.origin)] for k
-                               in
-                               range(self._instance.m)]
+        self._result['trace'] = []
+        remaining = timeout - (time.time() - self._start_time)
+        low = self._instance.min_path
+        # receiver -> (process, configuration)
+        running = {}
+        for configuration in configurations:
+            receiver, sender = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(target=portfolio_worker, daemon=True,
+                                              args=(text, configuration, low, self._shared, remaining, sender))
+            process.start()
+            sender.close()
+            running[receiver] = (process, configuration)
+        try:
+            while len(running) > 0 and low < self._shared.value() and not self._shared.closed():
+                remaining = timeout - (time.time() - self._start_time)
+                if remaining <= 0:
+                    break
+                for receiver in wait(list(running), timeout=min(1, remaining)):
+                    try:
+                        status, value = receiver.recv()
+                    except EOFError:
+                        # the worker died, or its tactic gave up
+                        status, value = 'unknown', None
+                    if status == 'sat':
+                        model = Assignment(value)
+                        found = self.__objective(model)
+                        if self._model is None or found < self.__objective(self._model):
+                            self._model = model
+                            elapsed = round(time.time() - self._start_time, 3)
+                            if len(self._result['trace']) == 0:
+                                self._result['time_to_first_solution'] = elapsed
+                            self._result['trace'].append([elapsed, found])
+                            self._result['configuration'] = running[receiver][1]
+                            self._shared.publish(found, self._routes(model))
+                        continue
+                    if status == 'unsat':
+                        if value + 1 > low:
+                            self._result['configuration'] = running[receiver][1]
+                        low = max(low, value + 1)
+                    process, _ = running.pop(receiver)
+                    process.join()
+                    receiver.close()
+        finally:
+            for receiver, (process, _) in running.items():
+                process.terminate()
+                process.join()
+                receiver.close()
 
-                self._optimal_solution_found = True
+        self._end_time = time.time()
+        self._inst_time = self._end_time - self._start_time
+        proved = low >= self._shared.value()
+        self._optimal_solution_found = self._model is not None and proved and \
+            self.__objective(self._model) <= self._shared.value()
+        if proved:
+            self._shared.close()
 
         self._result['time'] = round(self._inst_time, 3)
         self._result['optimal'] = self._optimal_solution_found
-        self._result['obj'] = self._model[self.obj].as_long()
-        self._result['sol'] = self._get_solution()
+        if self._model is None:
+            self._result['obj'] = None
+            self._result['sol'] = None
+            return
+        self._result['obj'] = self.__objective(self._model)
+        self._result['sol'] = self._routes(self._model)
+
+    def __below(self, bound: 'int') -> 'z3.BoolRef':
+        # literal that, assumed, keeps obj within bound: every bound is asserted once and chained to
+        # its neighbours, as the threshold literals of Sat_model
+        if bound not in self.__thresholds:
+            literal = z3.Bool(f'obj_le_{bound}')
+            self._stats.add(self._solver, 'objective', z3.Implies(literal, self._bound_constraint(bound)))
+            lower = [b for b in self.__thresholds if b < bound]
+            higher = [b for b in self.__thresholds if b > bound]
+            if len(lower) > 0:
+                self._stats.add(self._solver, 'objective', z3.Implies(self.__thresholds[max(lower)], literal))
+            if len(higher) > 0:
+                self._stats.add(self._solver, 'objective', z3.Implies(literal, self.__thresholds[min(higher)]))
+            self.__thresholds[bound] = literal
+        return self.__thresholds[bound]
+
+    def _bound_constraint(self, bound: 'int') -> 'z3.BoolRef':
+        # what obj_le_{bound} implies
+        if self._compact:
+            return z3.And([pb('le', arcs, bound) for arcs in self.__weighted_arcs])
+        return self.obj <= bound
+
+    def __objective(self, model: 'z3.ModelRef') -> 'int':
+        # obj only bounds the distances from above, the longest route is the value of the solution
+        return max(model.evaluate(distance, model_completion=True).as_long() for distance in self._courier_distance)
+
+    def _routes(self, model: 'z3.ModelRef') -> 'list':
+        # routes of a model, in the result['sol'] format
+        table = self._table
+        self._table = [[[z3.is_true(model.evaluate(table[k][i][j], model_completion=True))
+                         for j in range(self._instance.origin)] for i in range(self._instance.origin)]
+                       for k in range(self._instance.m)]
+        routes = self._get_solution()
+        self._table = table
+        return routes
 
     def add_constraints(self) -> None:
         # Constraints
-        for k in range(self._instance.m):
-            for i in range(self._instance.origin):
-                # A courier can't move to the same item
-                self._solver.add(self._table[k][i][i] == False)
-                # If an item is reached, it is also left by the same courier
-                self._solver.add(z3.Sum([self._table[k][i][j] for j in range(self._instance.origin)])
-                                 == z3.Sum([self._table[k][j][i] for j in range(self._instance.origin)]))
+        with self._stats.timed('flow'):
+            for k in range(self._instance.m):
+                for i in range(self._instance.origin):
+                    # A courier can't move to the same item
+                    self._stats.add(self._solver, 'flow', self._table[k][i][i] == False)
+                    # If an item is reached, it is also left by the same courier
+                    self._stats.add(self._solver, 'flow', z3.Sum([self._table[k][i][j] for j in range(self._instance.origin)])
+                                    == z3.Sum([self._table[k][j][i] for j in range(self._instance.origin)]))
+                    # REDUNDANT
+                    if self._redundant:
+                        self._stats.add(self._solver, 'redundant', z3.Or([self._table[k][i][j] for j in range(self._instance.origin)]) == z3.Or(
+                            [self._table[k][j][i] for j in range(self._instance.origin)]))
+                        self._stats.add(self._solver, 'redundant',
+                            z3.PbEq([(self._table[k][i][j], 1) for j in range(self._instance.origin)], 1) == z3.PbEq(
+                                [(self._table[k][j][i], 1) for j in range(self._instance.origin)], 1))
+
+        with self._stats.timed('assignment'):
+            for j in range(self._instance.origin - 1):
+                # Every item is delivered using PbEq
+                self._stats.add(self._solver, 'assignment',
+                    z3.PbEq(
+                        [(self._table[k][i][j], 1) for k in range(self._instance.m) for i in range(self._instance.origin)],
+                        1))
                 # REDUNDANT
-                self._solver.add(z3.Or([self._table[k][i][j] for j in range(self._instance.origin)]) == z3.Or(
-                    [self._table[k][j][i] for j in range(self._instance.origin)]))
-                self._solver.add(
-                    z3.PbEq([(self._table[k][i][j], 1) for j in range(self._instance.origin)], 1) == z3.PbEq(
-                        [(self._table[k][j][i], 1) for j in range(self._instance.origin)], 1))
-
-        for j in range(self._instance.origin - 1):
-            # Every item is delivered using PbEq
-            self._solver.add(
-                z3.PbEq(
-                    [(self._table[k][i][j], 1) for k in range(self._instance.m) for i in range(self._instance.origin)],
-                    1))
-            # REDUNDANT
-            self._solver.add(
-                z3.PbEq(
-                    [(self._table[k][j][i], 1) for k in range(self._instance.m) for i in range(self._instance.origin)],
-                    1))
+                if self._redundant:
+                    self._stats.add(self._solver, 'redundant',
+                        z3.PbEq(
+                            [(self._table[k][j][i], 1) for k in range(self._instance.m) for i in range(self._instance.origin)],
+                            1))
 
-        for k in range(self._instance.m):
-            # Each courier can carry at most max_load items
-            self._solver.add(
-                z3.PbLe([(self._table[k][i][j], self._instance.size[j]) for i in range(self._instance.origin) for j in
-                         range(self._instance.origin - 1)], self._instance.max_load[k]))
-
-            # Couriers start at the origin and end at the origin
-            self._solver.add(
-                z3.Sum([self._table[k][self._instance.origin - 1][j] for j in range(self._instance.origin - 1)]) == 1)
-            self._solver.add(
-                z3.Sum([self._table[k][j][self._instance.origin - 1] for j in range(self._instance.origin - 1)]) == 1)
-
-            # Each courier must visit at least min_packs items and at most max_path_length items
-            self._solver.add(z3.Sum(
-                [self._table[k][i][j] for i in range(self._instance.origin) for j in
-                 range(self._instance.origin - 1)]) >= self._instance.min_packs)
-            self._solver.add(z3.Sum([self._table[k][i][j] for i in range(self._instance.origin) for j in
-                                     range(self._instance.origin - 1)]) <= self._instance.max_path)
+        with self._stats.timed('load'):
+            for k in range(self._instance.m):
+                # Each courier can carry at most max_load items
+                self._stats.add(self._solver, 'load',
+                    z3.PbLe([(self._table[k][i][j], self._instance.size[j]) for i in range(self._instance.origin) for j in
+                             range(self._instance.origin - 1)], self._instance.max_load[k]))
 
-        for k in range(self._instance.m):
-            for i in range(self._instance.origin - 1):
-                for j in range(self._instance.origin - 1):
-                    if i != j:
-                        # If a courier goes for i to j then it cannot go from j to i, except for the origin
-                        self._solver.add(z3.Not(z3.And(self._table[k][i][j], self._table[k][j][i])))
-
-                        # Sub-tour elimination
-                        self._solver.add(self._u[k][j]
-                                         >= self._u[k][i] + 1 - self._instance.origin * (
-                                                 1 - z3.If(self._table[k][i][j], 1, 0)))
+                # Couriers start at the origin and end at the origin
+                self._stats.add(self._solver, 'origin',
+                    z3.Sum([self._table[k][self._instance.origin - 1][j] for j in range(self._instance.origin - 1)]) == 1)
+                self._stats.add(self._solver, 'origin',
+                    z3.Sum([self._table[k][j][self._instance.origin - 1] for j in range(self._instance.origin - 1)]) == 1)
+
+                # Each courier must visit at least min_packs items and at most max_path_length items
+                self._stats.add(self._solver, 'packs', z3.Sum(
+                    [self._table[k][i][j] for i in range(self._instance.origin) for j in
+                     range(self._instance.origin - 1)]) >= self._instance.min_packs)
+                self._stats.add(self._solver, 'packs', z3.Sum([self._table[k][i][j] for i in range(self._instance.origin) for j in
+                                         range(self._instance.origin - 1)]) <= self._instance.max_packs)
+
+        with self._stats.timed('mtz'):
+            for k in range(self._instance.m):
+                for i in range(self._instance.origin - 1):
+                    for j in range(self._instance.origin - 1):
+                        if i != j:
+                            # If a courier goes for i to j then it cannot go from j to i, except for the origin
+                            self._stats.add(self._solver, 'two_cycle', z3.Not(z3.And(self._table[k][i][j], self._table[k][j][i])))
+
+                            # Sub-tour elimination
+                            self._stats.add(self._solver, 'mtz', self._u[k][j]
+                                            >= self._u[k][i] + 1 - self._instance.origin * (
+                                                    1 - z3.If(self._table[k][i][j], 1, 0)))
+
+
+class Z3_smt_successor_model(Z3_smt_model):
+    # every item and every courier start has the node that follows it: the items, or the end of a courier.
+    # Distinct successors, the courier and the position of every item and the leg leaving it
+    # replace the table of arcs, so the formula grows with the square of the nodes instead of their cube
+
+    def __init__(self, lib: 'str', instance: Instance):
+        Abstract_model.__init__(self, lib, instance)
+        self._model = None
+        self._optimal_solution_found = False
+        self._compact = False
+        self._solver = z3.Solver()
+        self._stats = VariablePool()
+        n, m = instance.n, instance.m
+
+        # nodes: items 0..n-1, starts n..n+m-1, ends n+m..n+2m-1
+        self._successor = [z3.Int(f'successor_{v}') for v in range(n + m)]
+        self._courier = [z3.Int(f'courier_{i}') for i in range(n)] + [z3.IntVal(k) for k in range(m)]
+        self._position = [z3.Int(f'position_{i}') for i in range(n)] + [z3.IntVal(0) for _ in range(m)]
+        self._leg = [z3.Int(f'leg_{v}') for v in range(n + m)]
+        self._courier_distance = [z3.Int(f'courier_distance_{k}') for k in range(m)]
+        self.__build()
+        self._end_time = time.time()
+        self._build_time = self._end_time - self._start_time
+
+    def __node(self, v: 'int') -> 'int':
+        # index of the node in the distance matrix
+        return v if v < self._instance.n else self._instance.origin - 1
+
+    def __build(self):
+        n, m = self._instance.n, self._instance.m
+        d = self._instance.distances
+        self.obj = z3.Int('obj')
+        add = lambda family, constraint: self._stats.add(self._solver, family, constraint)
+
+        with self._stats.timed('successor'):
+            for v in range(n + m):
+                # the successors are the items and the ends, never the node itself
+                add('successor', z3.And(self._successor[v] >= 0, self._successor[v] < n + 2 * m))
+                add('successor', z3.Or(self._successor[v] < n, self._successor[v] >= n + m))
+                add('successor', self._successor[v] != v)
+            add('successor', z3.Distinct(self._successor))
+
+        with self._stats.timed('assignment'):
+            for i in range(n):
+                add('assignment', z3.And(self._courier[i] >= 0, self._courier[i] < m))
+                add('assignment', z3.And(self._position[i] >= 1, self._position[i] <= self._instance.max_packs))
+            for v in range(n + m):
+                for w in range(n):
+                    if w != v:
+                        # the next item is carried by the same courier, one position later
+                        add('assignment', z3.Implies(self._successor[v] == w, z3.And(
+                            self._courier[w] == self._courier[v], self._position[w] == self._position[v] + 1)))
+                for k in range(m):
+                    add('assignment', z3.Implies(self._successor[v] == n + m + k, self._courier[v] == k))
+
+        with self._stats.timed('objective'):
+            for v in range(n + m):
+                # leg leaving v: the distance to its successor
+                add('objective', z3.Or([z3.And(self._successor[v] == w, self._leg[v] == int(d[self.__node(v)][self.__node(w)]))
+                                        for w in range(n + 2 * m) if w != v and not n <= w < n + m]))
+            for k in range(m):
+                add('objective', self._courier_distance[k] == self._leg[n + k] + z3.Sum(
+                    [z3.If(self._courier[i] == k, self._leg[i], 0) for i in range(n)]))
+                add('objective', self.obj >= self._courier_distance[k])
+            add('objective', self.obj <= self._instance.max_path)
+            add('objective', self.obj >= self._instance.min_path)
+
+        with self._stats.timed('load'):
+            for k in range(m):
+                carried = [self._courier[i] == k for i in range(n)]
+                add('load', z3.PbLe([(carried[i], int(self._instance.size[i])) for i in range(n)],
+                                    int(self._instance.max_load[k])))
+                add('packs', z3.PbGe([(c, 1) for c in carried], self._instance.min_packs))
+                add('packs', z3.PbLe([(c, 1) for c in carried], self._instance.max_packs))
+
+    def _routes(self, model: 'z3.ModelRef') -> 'list':
+        n, m = self._instance.n, self._instance.m
+        routes = []
+        for k in range(m):
+            route = []
+            v = model.evaluate(self._successor[n + k], model_completion=True).as_long()
+            while v < n:
+                route.append(v + 1)
+                v = model.evaluate(self._successor[v], model_completion=True).as_long()
+            routes.append(route)
+        return routes
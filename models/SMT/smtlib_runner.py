@@ -0,0 +1,181 @@
+import os
+import re
+import time
+import select
+import shutil
+import subprocess
+
+from models.Abstract_model import Abstract_model
+from instance import Instance
+
+# how every solver is started to read SMT-LIB 2 commands from its standard input,
+# any other name is run as it is with no arguments
+COMMANDS = {
+    'z3': ['z3', '-in', '-smt2'],
+    'cvc5': ['cvc5', '--lang=smt2', '--incremental', '--produce-models'],
+    'yices-smt2': ['yices-smt2', '--incremental'],
+    'mathsat': ['mathsat', '-input=smt2']
+}
+TOKEN = re.compile(r'\(|\)|"(?:[^"]|"")*"|\|[^|]*\||[^\s()"|]+')
+
+
+def parse_sexpr(text: 'str') -> 'list|str':
+    # one s-expression: a symbol, or the nested lists of its tokens
+    stack = [[]]
+    for token in TOKEN.findall(text):
+        if token == '(':
+            stack.append([])
+        elif token == ')':
+            closed = stack.pop()
+            stack[-1].append(closed)
+        else:
+            stack[-1].append(token)
+    if len(stack) != 1 or len(stack[0]) != 1:
+        raise Exception(f"not one s-expression: {text[:100]}")
+    return stack[0][0]
+
+
+def value_of(term: 'list|str') -> 'int|bool':
+    # a Bool or Int value as get-value answers it
+    if term == 'true' or term == 'false':
+        return term == 'true'
+    if isinstance(term, list) and len(term) == 2 and term[0] == '-':
+        return -value_of(term[1])
+    return int(term)
+
+
+class Smtlib_runner(Abstract_model):
+    # solves a model exported by Z3_smt_model.save with a solver binary that reads SMT-LIB 2 from its standard input:
+    # the bound on longest_route is bisected with push and pop, the routes are read back with get-value of the arcs
+    # (table_k_i_j) or of the successors (successor_v) the file declares, so that every solver gets the same formula
+
+    def __init__(self, lib: 'str', instance: 'Instance', path: 'str') -> None:
+        super().__init__(lib, instance)
+        with open(path, 'r') as f:
+            script = f.read()
+        if '(check-sat)' in script:
+            script = script[:script.rfind('(check-sat)')]
+        self.__script = script
+        declared = re.findall(r'\(declare-fun (\S+) \(\) (?:Bool|Int)\)', script)
+        self.__arcs = {name: tuple(int(i) for i in name.split('_')[1:]) for name in declared
+                       if re.fullmatch(r'table_\d+_\d+_\d+', name)}
+        self.__successors = {name: int(name.split('_')[1]) for name in declared
+                             if re.fullmatch(r'successor_\d+', name)}
+        if len(self.__arcs) == 0 and len(self.__successors) == 0 or 'longest_route' not in declared:
+            raise Exception(f"{path} is not a model exported by Z3_smt_model.save")
+        self.__process = None
+        self.__buffer = ''
+        self._end_time = time.time()
+
+    def __send(self, commands: 'str') -> None:
+        self.__process.stdin.write((commands + '\n').encode())
+        self.__process.stdin.flush()
+
+    def __answer(self, deadline: 'float') -> 'list|str|None':
+        # the next answer of the solver, None if it does not come before deadline
+        while True:
+            text = self.__buffer.lstrip()
+            depth = 0
+            for token in TOKEN.finditer(text):
+                depth += 1 if token.group() == '(' else -1 if token.group() == ')' else 0
+                # a symbol is complete only when something follows it
+                if depth == 0 and token.end() < len(text):
+                    self.__buffer = text[token.end():]
+                    answer = parse_sexpr(text[:token.end()])
+                    if isinstance(answer, list) and len(answer) > 0 and answer[0] == 'error':
+                        raise Exception(f"{self._lib}: {' '.join(map(str, answer[1:]))}")
+                    return answer
+                if depth == 0:
+                    break
+            remaining = deadline - time.time()
+            if remaining <= 0 or len(select.select([self.__process.stdout], [], [], remaining)[0]) == 0:
+                return None
+            chunk = os.read(self.__process.stdout.fileno(), 1 << 16)
+            if chunk == b'':
+                raise Exception(f"{self._lib} exited with code {self.__process.wait()}")
+            self.__buffer += chunk.decode()
+
+    def __routes(self, values: 'dict') -> 'list':
+        # routes in the result['sol'] format
+        n, m = self._instance.n, self._instance.m
+        routes = []
+        for k in range(m):
+            route = []
+            if len(self.__arcs) > 0:
+                following = {i: j for name, (courier, i, j) in self.__arcs.items() if courier == k and values[name]}
+                current = following.get(n, n)
+                while current != n:
+                    route.append(current + 1)
+                    current = following[current]
+            else:
+                successor = {v: values[name] for name, v in self.__successors.items()}
+                current = successor[n + k]
+                while current < n:
+                    route.append(current + 1)
+                    current = successor[current]
+            routes.append(route)
+        return routes
+
+    def solve(self, processes=1, timeout: 'int' = 300) -> None:
+        # timeout in seconds from the creation of the runner, as for Z3_smt_model
+        command = COMMANDS.get(self._lib, [self._lib])
+        if shutil.which(command[0]) is None:
+            raise Exception(f"SMT solver {self._lib} not found")
+        deadline = self._start_time + timeout
+        names = ' '.join(list(self.__arcs) + list(self.__successors))
+        self._result['trace'] = []
+        best, best_routes = None, None
+        low, high = self._instance.min_path, self._instance.max_path
+
+        self.__process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                          stderr=subprocess.DEVNULL)
+        try:
+            self.__send(self.__script)
+            while low <= high and time.time() < deadline:
+                if self._shared is not None:
+                    high = min(high, self._shared.value() - 1)
+                    if low > high:
+                        break
+                bound = high if best is None else (low + high) // 2
+                self.__send(f'(push 1)\n(assert (<= longest_route {bound}))\n(check-sat)')
+                status = self.__answer(deadline)
+                if status == 'sat':
+                    self.__send(f'(get-value ({names}))')
+                    values = self.__answer(deadline)
+                    if values is None:
+                        break
+                    routes = self.__routes({name: value_of(value) for name, value in values})
+                    found = self._instance.objective(routes)
+                    if best is None or found < best:
+                        best, best_routes = found, routes
+                        elapsed = round(time.time() - self._start_time, 3)
+                        if len(self._result['trace']) == 0:
+                            self._result['time_to_first_solution'] = elapsed
+                        self._result['trace'].append([elapsed, found])
+                        if self._shared is not None:
+                            self._shared.publish(best, best_routes)
+                    high = min(high, found - 1)
+                    # every later probe is below the solution, the bound can stay
+                    self.__send(f'(pop 1)\n(assert (<= longest_route {found - 1}))')
+                elif status == 'unsat':
+                    low = bound + 1
+                    self.__send('(pop 1)')
+                else:
+                    # unknown, or the time is over
+                    break
+        finally:
+            self.__process.kill()
+            self.__process.wait()
+
+        self._end_time = time.time()
+        self._inst_time = self._end_time - self._start_time
+        proved = low > high
+        self._optimal_solution_found = best is not None and proved and \
+            (self._shared is None or best <= self._shared.value())
+        if proved and self._shared is not None:
+            self._shared.close()
+
+        self._result['time'] = round(self._inst_time, 3)
+        self._result['optimal'] = self._optimal_solution_found
+        self._result['obj'] = best
+        self._result['sol'] = best_routes
@@ -0,0 +1,104 @@
+import os
+import json
+import copy
+import hashlib
+
+from scheduler import Job
+
+# fields of the approach configurations that only select which jobs are run
+JOB_SELECTION_FIELDS = ['solvers', 'library', 'timeout', 'export_folder']
+
+
+class Result_store:
+
+    def __init__(self, model_files: 'dict', store_folder: 'str' = '.cache/store') -> None:
+        # model_files: for every approach, the files whose content defines its model
+        self.store_folder = store_folder
+        self.__model_hashes = {}
+        for approach, files in model_files.items():
+            digest = hashlib.sha256()
+            for file_path in files:
+                with open(file_path, 'rb') as f:
+                    digest.update(f.read())
+            self.__model_hashes[approach] = digest.hexdigest()
+
+    def key(self, job: 'Job') -> 'str':
+        config = {field: value for field, value in job.config.items()
+                  if field not in JOB_SELECTION_FIELDS and not field.endswith('_solvers')}
+        content = json.dumps({
+            'approach': job.approach,
+            'solver': job.solver,
+            'instance': job.instance.hash,
+            'model': self.__model_hashes.get(job.approach, ''),
+            'config': config
+        }, sort_keys=True)
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def entries(self, job: 'Job') -> 'list[dict]':
+        # stored results of the job, from the smallest timeout to the largest
+        folder = os.path.join(self.store_folder, self.key(job))
+        if not os.path.exists(folder):
+            return []
+        entries = []
+        for file_name in os.listdir(folder):
+            if not file_name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(folder, file_name), 'r') as f:
+                    entries.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return sorted(entries, key=lambda e: e['timeout'])
+
+    def save(self, job: 'Job', result: 'dict') -> None:
+        # the jobs that were killed or crashed say nothing about what they could find, a later run
+        # solves them again; the ones that found nothing in time are kept as they are
+        if 'unsolved' in result:
+            return
+        folder = os.path.join(self.store_folder, self.key(job))
+        os.makedirs(folder, exist_ok=True)
+        entry = {
+            'approach': job.approach,
+            'solver': job.solver,
+            'instance': job.instance.name,
+            'timeout': job.timeout,
+            'result': copy.deepcopy(result)
+        }
+        path = os.path.join(folder, f'{job.timeout:g}.json')
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+
+    def plan(self, jobs: 'list[Job]', on_result, retry_factor: 'float|None' = None) -> 'list[Job]':
+        # the jobs with a usable stored result are delivered to on_result right away, the others
+        # are returned; with retry_factor the non optimal ones get that many times their largest budget
+        to_run = []
+        for job in jobs:
+            entries = self.entries(job)
+            optimal = [e for e in entries if e['result']['optimal']]
+            same_timeout = [e for e in entries if e['timeout'] == job.timeout]
+            if len(optimal) > 0:
+                print(f'job {job} has an optimal stored result')
+                on_result(job, copy.deepcopy(optimal[0]['result']))
+            elif retry_factor is not None and len(entries) > 0:
+                scale = entries[-1]['timeout'] * retry_factor / job.timeout
+                timeout = job.config['timeout'] * scale
+                if isinstance(job.config['timeout'], int):
+                    timeout = int(timeout)
+                config = dict(job.config, timeout=timeout)
+                to_run.append(Job(job.approach, job.solver, job.instance, job.runner, config,
+                                  job.timeout * scale, job.processes, job.options))
+            elif len(same_timeout) > 0:
+                print(f'job {job} has a stored result')
+                on_result(job, copy.deepcopy(same_timeout[0]['result']))
+            else:
+                to_run.append(job)
+        return to_run
+
+    def recorder(self, on_result):
+        # on_result, storing the result before anything else can change it
+        def record(job: 'Job', result: 'dict') -> None:
+            self.save(job, result)
+            on_result(job, result)
+        return record
@@ -0,0 +1,212 @@
+import os
+import signal
+import time
+import traceback
+import multiprocessing
+from multiprocessing.connection import wait
+
+from instance import Instance
+
+
+def unsolved_result(timeout: 'float', reason: 'str|None' = None) -> 'dict':
+    # reason tells a job that did not run to its end, 'killed' or 'crashed', from one that found nothing in time
+    result = {'time': round(timeout, 3), 'optimal': False, 'obj': None, 'sol': None}
+    if reason is not None:
+        result['unsolved'] = reason
+    return result
+
+
+class SharedBound:
+
+    def __init__(self, instance: 'Instance') -> None:
+        # objective and routes of the best solution found by the solvers racing on the instance,
+        # the routes are stored one after the other, each followed by a 0
+        self.__m = instance.m
+        self.__min_path = instance.min_path
+        self.__value = multiprocessing.Value('i', instance.max_path + 1)
+        self.__routes = multiprocessing.Array('i', instance.n + instance.m, lock=False)
+        self.__owner = multiprocessing.Array('c', 64, lock=False)
+        self.__closed = multiprocessing.Event()
+        self.__name = ''
+
+    def register(self, name: 'str') -> None:
+        # name under which the current process publishes its solutions
+        self.__name = name
+
+    def value(self) -> 'int':
+        # strict upper bound on the objective of any solution still worth finding
+        return self.__value.value
+
+    def publish(self, obj: 'int', routes: 'list') -> 'bool':
+        # routes in the result['sol'] format
+        with self.__value.get_lock():
+            if obj >= self.__value.value:
+                return False
+            self.__value.value = obj
+            flat = [i for route in routes for i in route + [0]]
+            self.__routes[:len(flat)] = flat
+            self.__owner.value = self.__name.encode()[:63]
+        if obj <= self.__min_path:
+            self.__closed.set()
+        return True
+
+    def close(self) -> None:
+        # some solver proved that no solution is better than the current value
+        self.__closed.set()
+
+    def closed(self) -> 'bool':
+        return self.__closed.is_set()
+
+    def best(self) -> 'tuple[int, list, str]|None':
+        with self.__value.get_lock():
+            if self.__owner.value == b'':
+                return None
+            routes = [[]]
+            for i in self.__routes:
+                if i != 0:
+                    routes[-1].append(i)
+                elif len(routes) < self.__m:
+                    routes.append([])
+                else:
+                    break
+            return self.__value.value, routes, self.__owner.value.decode()
+
+
+class Job:
+
+    def __init__(self, approach: 'str', solver: 'str', instance: 'Instance', runner, config: 'dict',
+                 timeout: 'float', processes: 'int' = 1, options: 'dict' = None) -> None:
+        # approach and solver are the folder names used by Json_parser.save_results
+        self.approach = approach
+        self.solver = solver
+        self.instance = instance
+        self.runner = runner
+        self.config = config
+        # wall-clock budget of the solver in seconds, whatever unit the approach config uses
+        self.timeout = timeout
+        self.processes = max(1, int(processes))
+        self.options = options if options is not None else {}
+
+    def __str__(self):
+        return f'{self.approach}/{self.solver}/{self.instance.name}'
+
+
+def _execute(job: 'Job', connection) -> None:
+    # every job gets its own process group, so that killing it also kills the
+    # external solvers (minizinc, cbc, ...) it has spawned
+    os.setpgrp()
+    try:
+        result = job.runner(job)
+        connection.send(('ok', result))
+    except Exception:
+        connection.send(('error', traceback.format_exc()))
+    finally:
+        connection.close()
+
+
+def kill_process_group(process: 'multiprocessing.Process') -> None:
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        # the worker has not moved to its own group yet
+        process.kill()
+    process.join()
+
+
+class Scheduler:
+
+    def __init__(self, cores: 'int' = 0, grace: 'float' = 30) -> None:
+        self.cores = cores if cores > 0 else os.cpu_count()
+        # seconds granted on top of the solver timeout for building the model and writing the result
+        self.grace = grace
+
+    def run(self, jobs: 'list[Job]', on_result) -> None:
+        # biggest jobs first, the smaller ones fill the cores left free
+        pending = sorted(jobs, key=lambda j: j.processes, reverse=True)
+        running = {}
+        free = self.cores
+
+        while len(pending) > 0 or len(running) > 0:
+            for job in list(pending):
+                needed = min(job.processes, self.cores)
+                if needed <= free:
+                    pending.remove(job)
+                    free -= needed
+                    receiver, process = self.__start(job)
+                    running[receiver] = (job, process, time.time(), needed)
+                    print(f'started job {job} on {needed} core(s)')
+
+            for receiver in wait(list(running.keys()), timeout=1):
+                job, process, start, needed = running.pop(receiver)
+                try:
+                    status, payload = receiver.recv()
+                except EOFError:
+                    status, payload = 'error', 'worker exited without a result'
+                receiver.close()
+                process.join()
+                free += needed
+                self.__deliver(job, status, payload, time.time() - start, on_result)
+
+            now = time.time()
+            for receiver, (job, process, start, needed) in list(running.items()):
+                if now - start > job.timeout + self.grace:
+                    kill_process_group(process)
+                    receiver.close()
+                    del running[receiver]
+                    free += needed
+                    print(f'job {job} exceeded its wall-clock limit and was killed')
+                    on_result(job, unsolved_result(job.timeout, 'killed'))
+
+    def race(self, jobs: 'list[Job]', shared: 'SharedBound', on_result) -> None:
+        # the jobs all start together on the same instance and share the bound, the ones still
+        # running are killed as soon as one of them proves it optimal
+        needed = sum(min(job.processes, self.cores) for job in jobs)
+        if needed > self.cores:
+            print(f'the race needs {needed} cores, only {self.cores} are available')
+        running = {}
+        for job in jobs:
+            receiver, process = self.__start(job)
+            running[receiver] = (job, process, time.time())
+            print(f'started job {job}')
+
+        while len(running) > 0:
+            for receiver in wait(list(running.keys()), timeout=0.1):
+                job, process, start = running.pop(receiver)
+                try:
+                    status, payload = receiver.recv()
+                except EOFError:
+                    status, payload = 'error', 'worker exited without a result'
+                receiver.close()
+                process.join()
+                self.__deliver(job, status, payload, time.time() - start, on_result)
+
+            now = time.time()
+            for receiver, (job, process, start) in list(running.items()):
+                if shared.closed() or now - start > job.timeout + self.grace:
+                    kill_process_group(process)
+                    receiver.close()
+                    del running[receiver]
+                    if shared.closed():
+                        print(f'job {job} was stopped, the race is over')
+                    else:
+                        print(f'job {job} exceeded its wall-clock limit and was killed')
+                    on_result(job, unsolved_result(min(now - start, job.timeout), 'killed'))
+
+    @staticmethod
+    def __start(job: 'Job') -> 'tuple':
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(target=_execute, args=(job, sender), daemon=False)
+        process.start()
+        sender.close()
+        return receiver, process
+
+    @staticmethod
+    def __deliver(job: 'Job', status: 'str', payload, elapsed: 'float', on_result) -> None:
+        if status == 'error':
+            print(f'job {job} failed:')
+            print(payload)
+            on_result(job, unsolved_result(min(elapsed, job.timeout), 'crashed'))
+            return
+        if not payload:
+            payload = unsolved_result(min(elapsed, job.timeout))
+        on_result(job, payload)